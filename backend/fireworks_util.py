@@ -1,10 +1,148 @@
 from langchain_fireworks import Fireworks
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
     CallbackManagerForLLMRun,
 )
+from langchain_core.outputs import GenerationChunk
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: rate limiting and transient server errors.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Latency of the most recent requests, see ``latency_summary``.
+latencies = deque(maxlen=1000)
+
+_session_lock = threading.Lock()
+_sessions = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _pool_size():
+    return int(os.getenv("FIREWORKS_POOL_SIZE", "10"))
+
+
+def get_session() -> requests.Session:
+    """Keep-alive session shared by every call in this process; recreated after a fork."""
+    pid = os.getpid()
+    with _session_lock:
+        if pid not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size())
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions.clear()
+            _sessions[pid] = session
+        return _sessions[pid]
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Pooled async client for the running event loop; connections cannot be shared across loops."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_connections=_pool_size(), max_keepalive_connections=_pool_size())
+        client = _async_clients[loop] = httpx.AsyncClient(limits=limits)
+    return client
+
+
+def record_latency(model, seconds, status, attempts, stream=False):
+    latencies.append({"model": model, "seconds": seconds, "status": status, "attempts": attempts, "stream": stream})
+    logger.info(f"Fireworks {'stream' if stream else 'call'} to {model}: {seconds:.2f}s, status {status}, attempts {attempts}")
+
+
+def latency_summary():
+    """Count, mean and p50/p95 latency in seconds of the recorded requests."""
+    seconds = sorted(record["seconds"] for record in latencies)
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "mean": sum(seconds) / len(seconds),
+        "p50": seconds[len(seconds) // 2],
+        "p95": seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))],
+    }
+
+
+def _raise_for_status(status_code, text):
+    if status_code >= 500:
+        raise Exception(f"Fireworks Server: Error {status_code}")
+    elif status_code >= 400:
+        raise ValueError(f"Fireworks received an invalid payload: {text}")
+    elif status_code != 200:
+        raise Exception(
+            f"Fireworks returned an unexpected response with status "
+            f"{status_code}: {text}"
+        )
+
+
 class FireworksWithTrace(Fireworks):
+    """
+    Fireworks completions over pooled keep-alive connections, with sync and async calls.
+
+    Requests time out after ``connect_timeout``/``read_timeout`` seconds and are retried up
+    to ``max_attempts`` times on 429/5xx and connection errors, sleeping a random ("full
+    jitter") delay of up to ``retry_backoff * 2**attempt`` seconds, or the server's
+    ``Retry-After``. A read timeout is not retried: the server was generating and would
+    likely time out again. No retry starts once ``retry_deadline`` seconds have passed since
+    the first attempt. Every request's latency is appended to ``latencies``.
+    """
+
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+    max_attempts: int = 4
+    retry_backoff: float = 0.5
+    retry_backoff_max: float = 8.0
+    retry_deadline: float = 30.0
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.fireworks_api_key.get_secret_value()}",
+            "Content-Type": "application/json",
+            "X-Fireworks-Genie": "true"
+        }
+
+    def _payload(self, prompt: str, stop: Optional[List[str]], **kwargs: Any) -> Dict[str, Any]:
+        stop_to_use = stop[0] if stop and len(stop) == 1 else stop
+        payload: Dict[str, Any] = {
+            **self.default_params,
+            "prompt": prompt,
+            "stop": stop_to_use,
+            **kwargs,
+        }
+        # filter None values to not pass them to the http payload
+        return {k: v for k, v in payload.items() if v is not None}
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.retry_backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+
+    def _should_retry(self, attempt: int, status_code: Optional[int], started: float) -> bool:
+        return (
+            attempt + 1 < self.max_attempts
+            and (status_code is None or status_code in RETRY_STATUS)
+            and time.perf_counter() - started < self.retry_deadline
+        )
+
     def _call(
         self,
         prompt: str,
@@ -12,11 +150,6 @@ class FireworksWithTrace(Fireworks):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.fireworks_api_key.get_secret_value()}",
-            "Content-Type": "application/json",
-            "X-Fireworks-Genie": "true"
-        }
         """Call out to Fireworks's text generation endpoint.
 
         Args:
@@ -25,29 +158,107 @@ class FireworksWithTrace(Fireworks):
         Returns:
             The string generated by the model..
         """
-        stop_to_use = stop[0] if stop and len(stop) == 1 else stop
-        payload: Dict[str, Any] = {
-            **self.default_params,
-            "prompt": prompt,
-            "stop": stop_to_use,
-            **kwargs,
-        }
+        payload = self._payload(prompt, stop, **kwargs)
+        started = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            try:
+                response = get_session().post(
+                    url=self.base_url, json=payload, headers=self._headers,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if isinstance(e, requests.ReadTimeout) or not self._should_retry(attempt, None, started):
+                    record_latency(self.model, time.perf_counter() - started, None, attempt + 1)
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code != 200 and self._should_retry(attempt, response.status_code, started):
+                time.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            break
 
-        # filter None values to not pass them to the http payload
-        payload = {k: v for k, v in payload.items() if v is not None}
-        response = requests.post(url=self.base_url, json=payload, headers=headers)
-
-        if response.status_code >= 500:
-            raise Exception(f"Fireworks Server: Error {response.status_code}")
-        elif response.status_code >= 400:
-            raise ValueError(f"Fireworks received an invalid payload: {response.text}")
-        elif response.status_code != 200:
-            raise Exception(
-                f"Fireworks returned an unexpected response with status "
-                f"{response.status_code}: {response.text}"
-            )
-
-        data = response.json()
-        output = self._format_output(data)
-
-        return output
\ No newline at end of file
+        record_latency(self.model, time.perf_counter() - started, response.status_code, attempt + 1)
+        _raise_for_status(response.status_code, response.text)
+        return self._format_output(response.json())
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Async variant of ``_call``; the event loop is free while the model generates."""
+        payload = self._payload(prompt, stop, **kwargs)
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        started = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            try:
+                response = await get_async_client().post(
+                    self.base_url, json=payload, headers=self._headers, timeout=timeout
+                )
+            except httpx.TransportError as e:
+                if isinstance(e, httpx.ReadTimeout) or not self._should_retry(attempt, None, started):
+                    record_latency(self.model, time.perf_counter() - started, None, attempt + 1)
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code != 200 and self._should_retry(attempt, response.status_code, started):
+                await asyncio.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            break
+
+        record_latency(self.model, time.perf_counter() - started, response.status_code, attempt + 1)
+        _raise_for_status(response.status_code, response.text)
+        return self._format_output(response.json())
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """
+        Stream tokens from the server-sent events of the completions endpoint.
+
+        Only opening the stream is retried; once tokens have been yielded a failure is raised.
+        """
+        payload = {**self._payload(prompt, stop, **kwargs), "stream": True}
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        started = time.perf_counter()
+        client = get_async_client()
+        for attempt in range(self.max_attempts):
+            try:
+                request = client.build_request("POST", self.base_url, json=payload, headers=self._headers, timeout=timeout)
+                response = await client.send(request, stream=True)
+            except httpx.TransportError as e:
+                if isinstance(e, httpx.ReadTimeout) or not self._should_retry(attempt, None, started):
+                    record_latency(self.model, time.perf_counter() - started, None, attempt + 1, stream=True)
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if response.status_code != 200:
+                await response.aread()
+                await response.aclose()
+                if self._should_retry(attempt, response.status_code, started):
+                    await asyncio.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+                    continue
+                record_latency(self.model, time.perf_counter() - started, response.status_code, attempt + 1, stream=True)
+                _raise_for_status(response.status_code, response.text)
+            break
+
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = GenerationChunk(text=self._format_output(json.loads(data)))
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        finally:
+            await response.aclose()
+            record_latency(self.model, time.perf_counter() - started, response.status_code, attempt + 1, stream=True)
@@ -0,0 +1,163 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+import requests
+
+import fireworks_util
+from fireworks_util import FireworksWithTrace
+
+URL = "https://fireworks.test/inference/v1/completions"
+
+
+def completion(text):
+    return {"choices": [{"text": text}]}
+
+
+def make_model(**kwargs):
+    return FireworksWithTrace(model="test-model", fireworks_api_key="test-key", base_url=URL, retry_backoff=0.0, **kwargs)
+
+
+class StubAdapter(requests.adapters.BaseAdapter):
+    """Replays canned responses (or raises canned errors) in order."""
+
+    def __init__(self, replies):
+        super().__init__()
+        self.replies = list(replies)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        status, body, *headers = self.replies.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers.update(headers[0] if headers else {})
+        response.request, response.url = request, request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session_replies(monkeypatch):
+    """Mount a ``StubAdapter`` on the shared session; returns a function taking the replies."""
+    monkeypatch.setattr(fireworks_util, "_sessions", {})
+
+    def mount(*replies):
+        adapter = StubAdapter(replies)
+        fireworks_util.get_session().mount("https://", adapter)
+        return adapter
+    return mount
+
+
+def test_session_is_pooled_per_process(monkeypatch):
+    monkeypatch.setattr(fireworks_util, "_sessions", {})
+    monkeypatch.setenv("FIREWORKS_POOL_SIZE", "3")
+    session = fireworks_util.get_session()
+    assert fireworks_util.get_session() is session
+    assert session.get_adapter(URL)._pool_maxsize == 3
+
+    # A forked child must not reuse the parent's sockets.
+    monkeypatch.setattr(fireworks_util.os, "getpid", lambda: -1)
+    assert fireworks_util.get_session() is not session
+    assert list(fireworks_util._sessions) == [-1]
+
+
+def test_call_retries_transient_errors_then_succeeds(session_replies):
+    adapter = session_replies(
+        (requests.ConnectionError("reset"), None),
+        (503, {}),
+        (429, {}, {"Retry-After": "0"}),
+        (200, completion("hello")),
+    )
+    assert make_model()._call("Hi") == "hello"
+    assert adapter.calls == 4
+    assert fireworks_util.latencies[-1]["attempts"] == 4
+
+
+def test_call_status_errors_keep_their_types(session_replies):
+    adapter = session_replies(*[(429, {})] * 4)
+    with pytest.raises(ValueError):
+        make_model()._call("Hi")
+    assert adapter.calls == 4
+
+    adapter = session_replies((400, {"error": "bad"}))
+    with pytest.raises(ValueError, match="invalid payload"):
+        make_model()._call("Hi")
+    assert adapter.calls == 1
+
+    adapter = session_replies((500, {}), (500, {}))
+    with pytest.raises(Exception, match="Error 500"):
+        make_model(max_attempts=2)._call("Hi")
+    assert adapter.calls == 2
+
+
+def test_call_does_not_retry_read_timeouts_or_past_the_deadline(session_replies):
+    adapter = session_replies((requests.ReadTimeout("slow"), None), (200, completion("late")))
+    with pytest.raises(requests.ReadTimeout):
+        make_model()._call("Hi")
+    assert adapter.calls == 1
+
+    adapter = session_replies((503, {}), (200, completion("late")))
+    with pytest.raises(Exception, match="Error 503"):
+        make_model(retry_deadline=0.0)._call("Hi")
+    assert adapter.calls == 1
+
+
+def test_retry_delay_honours_retry_after_and_caps_backoff(monkeypatch):
+    model = FireworksWithTrace(model="test-model", fireworks_api_key="test-key", retry_backoff=0.5, retry_backoff_max=8.0)
+    assert model._retry_delay(0, "3") == 3.0
+    assert model._retry_delay(0, "120") == 8.0
+    monkeypatch.setattr(fireworks_util.random, "uniform", lambda low, high: high)
+    assert [model._retry_delay(attempt, "soon") for attempt in range(6)] == [0.5, 1.0, 2.0, 4.0, 8.0, 8.0]
+
+
+def run_with_transport(handler, coroutine_factory):
+    """Run a coroutine with this loop's pooled client replaced by one over ``handler``."""
+    async def main():
+        loop = asyncio.get_running_loop()
+        fireworks_util._async_clients[loop] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await coroutine_factory()
+        finally:
+            await fireworks_util._async_clients.pop(loop).aclose()
+    return asyncio.run(main())
+
+
+def test_async_client_is_pooled_per_event_loop():
+    async def clients():
+        return fireworks_util.get_async_client(), fireworks_util.get_async_client()
+
+    first, again = asyncio.run(clients())
+    assert first is again
+    assert asyncio.run(clients())[0] is not first
+
+
+def test_acall_retries_and_does_not_retry_read_timeouts():
+    replies = [httpx.Response(502), httpx.Response(200, json=completion("hello"))]
+    assert run_with_transport(lambda request: replies.pop(0), lambda: make_model()._acall("Hi")) == "hello"
+    assert not replies
+
+    calls = []
+    def read_timeout(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("slow", request=request)
+    with pytest.raises(httpx.ReadTimeout):
+        run_with_transport(read_timeout, lambda: make_model()._acall("Hi"))
+    assert len(calls) == 1
+
+
+def test_astream_yields_server_sent_tokens():
+    events = "".join(f"data: {json.dumps(completion(text))}\n\n" for text in ("Hel", "lo")) + "data: [DONE]\n\n"
+    replies = [httpx.Response(503), httpx.Response(200, content=events.encode())]
+
+    async def collect():
+        return [chunk.text async for chunk in make_model()._astream("Hi")]
+
+    assert run_with_transport(lambda request: replies.pop(0), collect) == ["Hel", "lo"]
+    assert fireworks_util.latencies[-1]["stream"] and fireworks_util.latencies[-1]["attempts"] == 2
@@ -3,40 +3,52 @@ Flask application for BFSI credit recommendation and scoring.
 """
 
 import json
+import logging
 import os
 
 from dotenv import load_dotenv
-import pandas as pd
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 from dummy import PrepareDummyCols
-from credit_rating import col
-from stat_score_util import calculate_credit_score, calculate_percentile_given_value
+from credit_rating import score_many, get_user_profile, get_feature_contributions, format_feature_contributions
+from profile_store import find_login_name, find_profiles
+from stat_score_util import score_profiles, valid_scorecard_rows, SCORECARD_COLUMNS
 from mdb_utils import DB_NAME, COLLECTION_NAME, get_mongo_client
-from graph import get_app
+from llm_cache import get_llm_cache
+from llm_utils import get_embeddings, get_router
+from context_builder import prompt_token_stats
+from output_repair import parse_stats
+from graph import get_graph_runs, run_graph, insert_response, credit_profile_doc
+from response_freshness import CREDIT_PROFILE_FIELDS, ReadStats, classify
+from model_store import model_version
+from single_flight import LeaseBusyError
+from job_queue import enqueue_graph_run, get_job_queue, get_job_workers, is_active
+from credit_score_expl import stream_credit_score_expl
 
 load_dotenv()
 
+credit_score_reads = ReadStats()
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 
 @app.route("/login", methods=["POST"])
 def login():
-    """Authenticate user and invoke agentic graph on success."""
+    """Authenticate user and queue a background graph run on success."""
     data = request.get_json()
     user_id = int(data["userId"])
     password = data["password"]
 
-    df = pd.DataFrame.from_records(
-        col.find({"Customer_ID": user_id}, {"_id": 0})
-    )
+    name = find_login_name(user_id)
+    first_name = name.split()[0] if name and name.strip() else None
 
-    if not df.empty and df["Name"].str.split().str[0].str.lower().iloc[0] == password.lower():
-        # get_app().ainvoke(
-        #     {"user_id": user_id},
-        #     config={"recursion_limit": 15, "configurable": {"thread_id": user_id}},
-        # )
+    if first_name and first_name.lower() == password.lower():
+        # Precompute the dashboard in the background; a queue outage must not block login.
+        try:
+            enqueue_graph_run(user_id)
+        except Exception as e:
+            logging.error(f"Could not enqueue graph run for user {user_id}: {e}")
         return jsonify({"message": "Login Successful"})
 
     return Response(json.dumps({"message": "Login Failed"}), status=403)
@@ -44,16 +56,39 @@ def login():
 
 @app.route("/credit_score/<int:user_id>", methods=["GET"])
 def get_credit_score(user_id):
-    """Retrieve stored credit response or return 404."""
+    """
+    Serve the stored credit response with stale-while-revalidate; 404 for unknown users.
+
+    A fresh response is returned as is. A stale one (older than ``CREDIT_SCORE_TTL_SECONDS``
+    or from another model version) is returned too, and a background graph run is queued
+    to refresh it (``revalidating`` says whether this request queued it, rather than finding
+    a refresh already queued or running). When nothing is stored yet, a 202 is returned while the user's queued
+    run is in progress; otherwise the request runs the graph itself.
+    """
     client = get_mongo_client()
     collection = client[DB_NAME][COLLECTION_NAME]
-    print(collection.find_one({}))
     print("Fetching credit score for user_id:", user_id)
-    state = collection.find_one({"user_id": user_id}, {"_id": 0})
-    state = get_app().invoke(
+    state = collection.find_one(
         {"user_id": user_id},
-        config={"recursion_limit": 15, "configurable": {"thread_id": user_id}},
+        {"_id": 0, **{field: 1 for field in CREDIT_PROFILE_FIELDS}, "timestamp": 1, "model_version": 1},
     )
+    freshness, age = classify(state, model_version())
+    credit_score_reads.record(freshness)
+    revalidating = False
+    if freshness == "miss":
+        # Another gunicorn worker may already be running this user's job; don't run it twice.
+        job = get_job_queue().status(user_id)
+        if is_active(job):
+            return Response(json.dumps({"message": "Credit profile is being prepared", "job": job_json(job)}), status=202)
+        try:
+            state, age = run_graph(user_id), 0.0
+        except LeaseBusyError:
+            return Response(json.dumps({"message": "Credit profile is being prepared"}), status=202)
+    elif freshness == "stale":
+        try:
+            _, revalidating = enqueue_graph_run(user_id)
+        except Exception as e:
+            logging.error(f"Could not queue revalidation for user {user_id}: {e}")
     if state is None:
         return Response(json.dumps({"message": "User not found"}), status=404)
 
@@ -70,39 +105,115 @@ def get_credit_score(user_id):
         "scoreCardCreditScore": score,
         "scorecardScoreFeatures": features,
         "userId": user_id,
+        "ageSeconds": age,
+        "stale": freshness == "stale",
+        "revalidating": revalidating,
+    })
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/credit_score/<int:user_id>/stream", methods=["GET"])
+def stream_credit_score(user_id):
+    """
+    Server-sent events: a ``score`` event with the model result and scorecard right away,
+    ``token`` events as the explanation is generated, then ``done`` once it is saved.
+    """
+    try:
+        pred, allowed_limit, profile_ip = get_user_profile(user_id)
+    except KeyError:
+        return Response(json.dumps({"message": "User not found"}), status=404)
+
+    def events():
+        features, score = traditional_credit_score(profile_ip)
+        yield _sse("score", {
+            "userCreditProfile": pred,
+            "allowedCreditLimit": allowed_limit,
+            "scoreCardCreditScore": score,
+            "scorecardScoreFeatures": features,
+            "userId": user_id,
+        })
+
+        contributions = get_feature_contributions(profile_ip, pred)
+        feature_importance = format_feature_contributions(contributions, profile_ip, pred)
+        chunks = []
+        try:
+            for chunk in stream_credit_score_expl(profile_ip, pred, allowed_limit, feature_importance):
+                chunks.append(chunk)
+                yield _sse("token", {"text": chunk})
+        except Exception as e:
+            logging.error(f"Error streaming the explanation for user {user_id}: {e}")
+            yield _sse("error", {"message": "Explanation unavailable"})
+            return
+
+        user_profile = "".join(chunks).strip()
+        insert_response(credit_profile_doc(user_id, user_profile, profile_ip, pred, allowed_limit, contributions))
+        yield _sse("done", {"userProfile": user_profile})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Keep proxies from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/credit_score/batch", methods=["POST"])
+def get_credit_score_batch():
+    """Score many users in one pass without running the agentic graph."""
+    data = request.get_json()
+    user_ids = [int(user_id) for user_id in data["userIds"]]
+    scores = score_many(user_ids)
+    return jsonify({
+        "scores": [
+            {
+                "userId": user_id,
+                "userCreditProfile": score["pred"],
+                "classProbabilities": score["proba"],
+                "allowedCreditLimit": score["allowed_credit_limit"],
+            }
+            for user_id, score in scores.items()
+        ],
+        "missing": [user_id for user_id in dict.fromkeys(user_ids) if user_id not in scores],
     })
 
 
 def traditional_credit_score(profile_ip):
     """Compute individual feature scores and aggregate credit score."""
-    features = {
-        "Repayment History": (
-            (profile_ip["Credit_History_Age"] - profile_ip["Num_of_Delayed_Payment"])
-            / profile_ip["Credit_History_Age"]
-        ),
-        "Credit Utilization": 1 - (
-            1 if (profile_ip["Credit_Utilization_Ratio"] / 100) > 0.4
-            else (profile_ip["Credit_Utilization_Ratio"] / 100)
-        ),
-        "Credit History": calculate_percentile_given_value(
-            profile_ip["Credit_History_Age"], 221.220, 99.681
-        ),
-        "Outstanding": 1 - calculate_percentile_given_value(
-            profile_ip["Outstanding_Debt"], 1426.220, 1155.129
-        ),
-        "Num Credit Inquiries": (
-            0
-            if calculate_percentile_given_value(
-                profile_ip["Num_Credit_Inquiries"], 5.798, 3.868
-            ) > 0.8
-            else 1 - calculate_percentile_given_value(
-                profile_ip["Num_Credit_Inquiries"], 5.798, 3.868
-            )
-        ),
-    }
-    score = calculate_credit_score(features)
+    scores = score_profiles([profile_ip]).iloc[0]
+    score = int(scores.pop("Score"))
+    features = {name: float(value) for name, value in scores.items()}
     return features, score
 
+
+@app.route("/scorecard/batch", methods=["POST"])
+def get_scorecard_batch():
+    """Compute the traditional scorecard for many users in one vectorized pass; unknown or unscorable users are listed under ``missing``."""
+    data = request.get_json()
+    user_ids = [int(user_id) for user_id in data["userIds"]]
+    profiles = find_profiles(user_ids, {column: 1 for column in SCORECARD_COLUMNS})
+    # Profiles with missing, non-finite or zero-age inputs cannot be scored; report them as missing.
+    valid = valid_scorecard_rows(list(profiles.values()))
+    profiles = {user_id: profile for (user_id, profile), ok in zip(profiles.items(), valid) if ok}
+    if not profiles:
+        return jsonify({"scores": [], "missing": list(dict.fromkeys(user_ids))})
+
+    scores = score_profiles(list(profiles.values()))
+    features = scores.drop(columns="Score").to_dict(orient="records")
+    return jsonify({
+        "scores": [
+            {
+                "userId": user_id,
+                "scoreCardCreditScore": int(score),
+                "scorecardScoreFeatures": row,
+            }
+            for user_id, score, row in zip(profiles, scores["Score"].tolist(), features)
+        ],
+        "missing": [user_id for user_id in dict.fromkeys(user_ids) if user_id not in profiles],
+    })
+
 @app.route("/product_suggestions", methods=["POST"])
 def product_suggetions():
     data = request.get_json()
@@ -127,9 +238,53 @@ def product_suggestions_1(user_id):
     recommendations = state.get("final_recommendations") if state else None
 
     if not recommendations:
+        job = get_job_queue().status(user_id)
+        if is_active(job):
+            return Response(json.dumps({"message": "Recommendations are being prepared", "job": job_json(job)}), status=202)
         return Response(json.dumps({"message": "No recommendations found"}), status=404)
 
-    return jsonify({"productRecommendations": json.loads(recommendations)})
+    # validate_step stores a list of cards; older documents hold a JSON string.
+    if isinstance(recommendations, str):
+        recommendations = json.loads(recommendations)
+    return jsonify({"productRecommendations": recommendations})
+
+
+def job_json(job):
+    def iso(value):
+        return value.isoformat() if value else None
+    return {
+        "userId": job["_id"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "enqueuedAt": iso(job.get("enqueued_at")),
+        "startedAt": iso(job.get("started_at")),
+        "finishedAt": iso(job.get("finished_at")),
+        "error": job.get("error"),
+    }
+
+
+@app.route("/jobs/<int:user_id>", methods=["GET"])
+def get_job(user_id):
+    """Status of the user's background graph run, or 404 when none was queued."""
+    job = get_job_queue().status(user_id)
+    if job is None:
+        return Response(json.dumps({"message": "No job found"}), status=404)
+    return jsonify(job_json(job))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Per-process cache counters, prompt token totals, parse outcomes, model routing, graph run coalescing, job queue counts and /credit_score freshness."""
+    return jsonify({
+        "llmCache": get_llm_cache().stats(),
+        "embeddingCache": get_embeddings().cache.stats(),
+        "promptTokens": prompt_token_stats(),
+        "parseOutcomes": parse_stats(),
+        "modelRouter": get_router().stats(),
+        "graphRuns": get_graph_runs().stats(),
+        "jobs": {"queue": get_job_queue().counts(), "workers": get_job_workers().stats()},
+        "creditScoreReads": credit_score_reads.stats(),
+    })
 
 
 if __name__ == "__main__":
@@ -137,4 +292,6 @@ if __name__ == "__main__":
     print("Loading data into MongoDB...")
     load_data_mongodb()
     print("Data loaded successfully.")
+    from model_store import warm_up
+    warm_up()
     app.run(host="0.0.0.0", port=5001)
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+Precomputed card candidate pools per credit tier and per tier x income band.
+
+The cards retrieved for users of one tier overlap heavily, so instead of one vector search
+per generated card-type suggestion, each (tier, band) gets a ranked pool of
+``POOL_SIZE`` products built once from a tier/band search hint. The per-user path then only
+embeds its suggestions and reranks inside the pool (``rank_within_pool``), which is a few
+dot products.
+
+Pools live in ``bfsi-genai.card_candidate_pools`` stamped with ``catalog_version``, a hash
+of the ``cc_products`` ids and texts. A pool built against another catalog version is
+rebuilt on first use, and ``refresh_pools`` (run periodically) rebuilds any pool that is
+stale or older than ``max_age_seconds``.
+
+Usage:
+    python candidate_pools.py            # rebuild stale pools
+    python candidate_pools.py --force    # rebuild every pool
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from mdb_utils import DB_NAME, get_mongo_client
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+POOL_COLLECTION = "card_candidate_pools"
+POOL_SIZE = int(os.getenv("CANDIDATE_POOL_SIZE", "30"))
+POOL_RERANK_K = int(os.getenv("CANDIDATE_POOL_RERANK_K", "25"))
+CATALOG_CHECK_SECONDS = float(os.getenv("CANDIDATE_POOL_CHECK_SECONDS", "60"))
+
+# Search hints per credit tier, as used by the original product suggestion prompt.
+TIER_QUERIES = {
+    "Good": "suggest card that have the usage of words like priority pass, zenith, lifetime free, super premium, ultra luxury, dining benefits, concerige services, premium, co branded, travel, cashback, rewards, dining, shopping, fuel, lifestyle, entertainment, airport, lounge, golf, movie, hotel, concierge, insurance, wellness, health, fitness, luxury, exclusive, signature, platinum, gold, silver, titanium",
+    "Poor": "suggest card that have the usage limits, cashback, basic, 50 days repayment cycle, low annual fee, basic features, low joining fees, higher interest rate",
+    "Standard": "suggest card that have usage of words cashback, with moderate credit limit and features, annual fee waiver on spends, redeem gifts on reward points",
+}
+
+# (name, upper bound of Annual_Income, search hint); the last band is open-ended.
+INCOME_BANDS = [
+    ("low", 30000, "for a low income earner, lifetime free or low annual fee, entry level"),
+    ("middle", 80000, "for a salaried middle income earner, moderate annual fee with rewards"),
+    ("high", float("inf"), "for a high income earner, premium benefits justify a higher annual fee"),
+]
+
+
+def income_band(annual_income):
+    """Name of the income band ``annual_income`` falls in; None when it is unknown."""
+    if annual_income is None:
+        return None
+    for name, upper, _ in INCOME_BANDS:
+        if annual_income < upper:
+            return name
+    return INCOME_BANDS[-1][0]
+
+
+def pool_id(tier, band=None):
+    return f"{tier}|{band}" if band else tier
+
+
+def pool_query(tier, band=None):
+    hint = {name: text for name, _, text in INCOME_BANDS}.get(band)
+    return f"{TIER_QUERIES[tier]}, {hint}" if hint else TIER_QUERIES[tier]
+
+
+def rank_within_pool(candidates, query_vectors, k=POOL_RERANK_K):
+    """
+    Rerank a pool against the user's suggestion embeddings.
+
+    Each candidate scores its best ``(1 + cosine) / 2`` over the queries, the scale of Atlas
+    ``vectorSearchScore``.
+
+    Args:
+        candidates (list): Pool entries with ``title``, ``description`` and ``embedding``.
+        query_vectors (list): One embedding per suggestion.
+        k (int): Number of candidates to keep.
+
+    Returns:
+        list: ``{"title", "description", "score"}`` for the top ``k``, best first.
+    """
+    if not candidates or not len(query_vectors):
+        return []
+    matrix = np.asarray([candidate["embedding"] for candidate in candidates], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+    scores = (1 + (matrix @ queries.T).max(axis=1)) / 2
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [
+        {"title": candidates[i]["title"], "description": candidates[i]["description"], "score": float(scores[i])}
+        for i in order
+    ]
+
+
+def catalog_version():
+    """Hash of the product ids, titles and texts; changes whenever the catalog does."""
+    from llm_utils import PRODUCT_COLLECTION
+    digest = hashlib.sha256()
+    products = get_mongo_client()[DB_NAME][PRODUCT_COLLECTION].find({}, {"_id": 1, "title": 1, "text": 1}).sort("_id", 1)
+    for product in products:
+        digest.update(repr((product["_id"], product.get("title"), product.get("text"))).encode())
+    return digest.hexdigest()[:16]
+
+
+_version_lock = threading.Lock()
+_version_cache = {"value": None, "checked_at": None}
+
+
+def current_catalog_version():
+    """``catalog_version`` re-read at most every ``CATALOG_CHECK_SECONDS``."""
+    with _version_lock:
+        checked_at = _version_cache["checked_at"]
+        if checked_at is None or time.monotonic() - checked_at >= CATALOG_CHECK_SECONDS:
+            _version_cache["value"] = catalog_version()
+            _version_cache["checked_at"] = time.monotonic()
+        return _version_cache["value"]
+
+
+def build_pool(tier, band=None, version=None):
+    """Search the catalog with the tier/band hint and store the ranked pool."""
+    from llm_utils import embed_queries, vector_search
+
+    query_vector = embed_queries([pool_query(tier, band)])[0]
+    candidates = [
+        {"title": hit["title"], "description": hit["description"], "score": hit["score"], "embedding": hit["embedding"]}
+        for hit in vector_search(query_vector, k=POOL_SIZE, include_embeddings=True)
+    ]
+    doc = {
+        "tier": tier,
+        "band": band,
+        "catalog_version": version or current_catalog_version(),
+        "candidates": candidates,
+        "built_at": datetime.utcnow(),
+    }
+    get_mongo_client()[DB_NAME][POOL_COLLECTION].replace_one({"_id": pool_id(tier, band)}, doc, upsert=True)
+    logger.info(f"Built candidate pool {pool_id(tier, band)} with {len(candidates)} cards")
+    return doc
+
+
+def get_candidate_pool(tier, annual_income=None):
+    """
+    The pool for ``tier`` and the income band of ``annual_income``, rebuilt if the catalog changed.
+
+    Returns:
+        list: Ranked candidates, or None for an unknown tier.
+    """
+    if tier not in TIER_QUERIES:
+        return None
+    band = income_band(annual_income)
+    version = current_catalog_version()
+    doc = get_mongo_client()[DB_NAME][POOL_COLLECTION].find_one({"_id": pool_id(tier, band)})
+    if doc is None or doc["catalog_version"] != version:
+        doc = build_pool(tier, band, version)
+    return doc["candidates"]
+
+
+def refresh_pools(force=False, max_age_seconds=24 * 3600):
+    """
+    Rebuild every tier and tier x band pool that is missing, stale or older than ``max_age_seconds``.
+
+    Returns:
+        int: Number of pools rebuilt.
+    """
+    version = catalog_version()
+    collection = get_mongo_client()[DB_NAME][POOL_COLLECTION]
+    rebuilt = 0
+    for tier in TIER_QUERIES:
+        for band in [None, *(name for name, _, _ in INCOME_BANDS)]:
+            doc = collection.find_one({"_id": pool_id(tier, band)}, {"catalog_version": 1, "built_at": 1})
+            fresh = (
+                doc is not None
+                and doc["catalog_version"] == version
+                and (datetime.utcnow() - doc["built_at"]).total_seconds() < max_age_seconds
+            )
+            if force or not fresh:
+                build_pool(tier, band, version)
+                rebuilt += 1
+    logger.info(f"Rebuilt {rebuilt} candidate pools for catalog version {version}")
+    return rebuilt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the per-tier card candidate pools.")
+    parser.add_argument("--force", action="store_true", help="rebuild every pool")
+    parser.add_argument("--max-age", type=float, default=24 * 3600, help="rebuild pools older than this many seconds")
+    args = parser.parse_args()
+    refresh_pools(force=args.force, max_age_seconds=args.max_age)
@@ -0,0 +1,177 @@
+"""
+Deterministic local reranking of retrieved credit cards.
+
+Each candidate is scored from its retrieval similarity plus eligibility features taken
+from the product text: the annual fee (parsed from the description) against the user's
+``Annual_Income``, and how premium the card is against the user's credit tier. Picking the
+top five is arithmetic over features parsed once per product text (``text_features`` is
+memoized), so the rerank stage no longer needs a 405B completion to choose cards.
+"""
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# A full stop followed by a space or the end; "Rs." and decimals do not end a sentence.
+_SENTENCE_END = re.compile(r"(?<!\bRs)\.(?=\s|$)")
+_FEE_SENTENCE = re.compile(r"\b(annual|membership|joining|renewal|yearly)\b[^.]*\bfees?\b|\bfees?\b[^.]*\b(annual|membership|joining|renewal|yearly)\b", re.I)
+_AMOUNT = re.compile(r"(?:\$|₹|\bRs\.?|\bINR)\s?(\d[\d,]*(?:\.\d+)?)")
+# An amount in the same clause after one of these is a spend threshold or a benefit, not the fee.
+_NOT_A_FEE = re.compile(r"\b(spend\w*|expenses?|purchases?|transactions?|benefits?|vouchers?|worth|up to|earn\w*|sav\w+)\b[^,;]*$", re.I)
+# Only annual-fee signals: a card with no joining fee can still charge an annual one.
+_NO_FEE = re.compile(r"lifetime free|no annual fees?|zero annual fees?|free for life", re.I)
+
+PREMIUM_TERMS = (
+    "lounge", "priority pass", "concierge", "golf", "luxury", "premium", "elite", "exclusive",
+    "signature", "lifestyle", "travel insurance", "air miles", "miles", "hotel", "first class",
+)
+BASIC_TERMS = ("cashback", "lifetime free", "fuel", "basic", "low annual fee", "emi", "utility", "grocery")
+
+
+@dataclass(frozen=True)
+class RankerConfig:
+    """
+    Weights of the local card score.
+
+    Attributes:
+        similarity (float): Weight of the retrieval score (0-1).
+        tier_fit (float): Weight of the tier fit (-1 to 1).
+        affordability (float): Weight of the fee burden penalty (0-1).
+        fee_income_ratio (float): Annual fee as a share of annual income that counts as a full burden.
+        waiver_bonus (float): Added when the text offers a spend-based fee waiver.
+        unknown_fee_burden (float): Burden assumed when no fee can be parsed.
+    """
+    similarity: float = 1.0
+    tier_fit: float = 0.15
+    affordability: float = 0.3
+    fee_income_ratio: float = 0.01
+    waiver_bonus: float = 0.02
+    unknown_fee_burden: float = 0.1
+    tier_premium_target: dict = field(default_factory=lambda: {"Good": 1.0, "Standard": 0.4, "Poor": 0.0})
+
+
+DEFAULT_RANKER = RankerConfig()
+
+
+def parse_annual_fee(text):
+    """
+    Annual (or joining/renewal) fee in dollars stated in a product description.
+
+    Returns:
+        float: The first fee amount stated in an annual-fee sentence, 0.0 for lifetime-free
+        cards that state none, or None when the text gives neither.
+    """
+    no_fee = False
+    for sentence in _SENTENCE_END.split(text):
+        no_fee = no_fee or bool(_NO_FEE.search(sentence))
+        if not _FEE_SENTENCE.search(sentence):
+            continue
+        for match in _AMOUNT.finditer(sentence):
+            if _NOT_A_FEE.search(sentence[:match.start()]):
+                continue
+            return float(match.group(1).replace(",", ""))
+    return 0.0 if no_fee else None
+
+
+def has_fee_waiver(text):
+    return bool(re.search(r"\bwaiv", text, re.I))
+
+
+def premium_level(text):
+    """0 for a basic card, 1 for a premium one, from the terms its description uses."""
+    lowered = text.lower()
+    premium = sum(term in lowered for term in PREMIUM_TERMS)
+    basic = sum(term in lowered for term in BASIC_TERMS)
+    return premium / (premium + basic) if premium + basic else 0.5
+
+
+@lru_cache(maxsize=4096)
+def text_features(text):
+    """(annual fee, premium level, fee waiver) of one product description."""
+    return parse_annual_fee(text), premium_level(text), has_fee_waiver(text)
+
+
+def card_features(card, annual_income, pred, config=DEFAULT_RANKER):
+    """
+    Eligibility features and the combined score of one candidate.
+
+    Returns:
+        dict: ``similarity``, ``annual_fee``, ``fee_burden``, ``premium``, ``tier_fit``,
+        ``waiver`` and ``score``.
+    """
+    fee, premium, waiver = text_features(card["description"])
+    if fee is None:
+        burden = config.unknown_fee_burden
+    elif annual_income:
+        burden = min(1.0, fee / (annual_income * config.fee_income_ratio))
+    else:
+        burden = 0.0 if fee == 0 else config.unknown_fee_burden
+    target = config.tier_premium_target.get(pred, 0.5)
+    tier_fit = 1.0 - 2.0 * abs(premium - target)
+    similarity = float(card.get("score", 0.0))
+    score = (
+        config.similarity * similarity
+        + config.tier_fit * tier_fit
+        - config.affordability * burden
+        + (config.waiver_bonus if waiver and fee else 0.0)
+    )
+    return {
+        "similarity": similarity,
+        "annual_fee": fee,
+        "fee_burden": burden,
+        "premium": premium,
+        "tier_fit": tier_fit,
+        "waiver": waiver,
+        "score": score,
+    }
+
+
+def rank_cards(candidates, annual_income, pred, k=5, config=DEFAULT_RANKER):
+    """
+    Pick the top ``k`` candidates by local score, one per title.
+
+    Args:
+        candidates (list): ``{"title", "description", "score"}`` dicts from retrieval.
+        annual_income (float): The user's ``Annual_Income``.
+        pred (str): Credit tier (Good/Standard/Poor).
+        k (int): Number of cards to return.
+        config (RankerConfig): Score weights.
+
+    Returns:
+        list: The chosen candidates, best first, each with a ``features`` dict.
+    """
+    scored = {}
+    for card in candidates:
+        features = card_features(card, annual_income, pred, config)
+        best = scored.get(card["title"])
+        if best is None or features["score"] > best["features"]["score"]:
+            scored[card["title"]] = {**card, "features": features}
+    return sorted(scored.values(), key=lambda card: (-card["features"]["score"], card["title"]))[:k]
+
+
+def format_annual_fee(fee):
+    if fee is None:
+        return "As per card terms"
+    return "Lifetime free" if fee == 0 else f"${fee:g}"
+
+
+def summarize(text, max_words=50):
+    """First ``max_words`` words of a description, ending at a sentence when possible."""
+    words = " ".join(text.split()).split(" ")
+    if len(words) <= max_words:
+        return " ".join(words)
+    cut = " ".join(words[:max_words])
+    end = cut.rfind(". ")
+    return cut[: end + 1] if end > len(cut) // 2 else cut + "..."
+
+
+def agreement(local_titles, llm_titles):
+    """Overlap of two top-k picks: share of the LLM's cards also chosen locally, and whether its first pick was."""
+    llm_titles = list(llm_titles)
+    if not llm_titles:
+        return {"overlap": 0.0, "top1_hit": False}
+    chosen = set(local_titles)
+    return {
+        "overlap": sum(title in chosen for title in llm_titles) / len(llm_titles),
+        "top1_hit": llm_titles[0] in chosen,
+    }
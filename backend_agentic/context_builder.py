@@ -0,0 +1,120 @@
+"""
+Token-budgeted prompt context for the card rerank stage.
+
+``build_card_context`` ranks retrieved cards by retrieval score, trims every description to
+a per-card token cap at a sentence boundary, drops near-duplicate descriptions (word
+3-shingle Jaccard similarity) and stops once the budget is spent. ``log_prompt_tokens``
+records the size of every LLM prompt per stage.
+
+Tokens are counted with ``tiktoken``'s ``cl100k_base`` when it is installed and estimated
+at four characters per token otherwise; either is close enough for budgeting.
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import defaultdict
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_encoding = tiktoken.get_encoding("cl100k_base") if tiktoken is not None else None
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\w+")
+
+# Prompt tokens per stage since process start; updated from request and job worker threads.
+prompt_tokens = defaultdict(lambda: {"prompts": 0, "tokens": 0})
+_prompt_tokens_lock = threading.Lock()
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut ``text`` to at most ``max_tokens``, at the last sentence end that fits when there is one."""
+    if max_tokens is None or count_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    for sentence in _SENTENCE_END.split(text):
+        if count_tokens(" ".join(kept + [sentence])) > max_tokens:
+            break
+        kept.append(sentence)
+    if kept:
+        return " ".join(kept)
+    # A single sentence is over the cap: cut it by characters.
+    cut = text[: max_tokens * 4]
+    while cut and count_tokens(cut) > max_tokens:
+        cut = cut[: int(len(cut) * 0.9)]
+    return cut.rsplit(" ", 1)[0] + "..."
+
+
+def _shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def build_card_context(cards, budget_tokens=3000, max_description_tokens=120, duplicate_threshold=0.8):
+    """
+    Render the best cards that fit the token budget as ``- title: description`` lines.
+
+    Args:
+        cards (list): ``{"title", "description"}`` dicts, optionally with a retrieval ``score``.
+        budget_tokens (int): Upper bound on the tokens of the rendered context.
+        max_description_tokens (int): Per-card description cap.
+        duplicate_threshold (float): Drop a card whose description's shingle Jaccard
+            similarity to an already kept one reaches this value.
+
+    Returns:
+        tuple: (context str, stats dict with ``kept``, ``duplicates``, ``over_budget`` and ``tokens``).
+    """
+    ranked = sorted(cards, key=lambda card: -card.get("score", 0.0))
+    lines, kept_shingles, seen_titles = [], [], set()
+    stats = {"kept": 0, "duplicates": 0, "over_budget": 0, "tokens": 0}
+    for card in ranked:
+        if card["title"] in seen_titles:
+            stats["duplicates"] += 1
+            continue
+        description = truncate_tokens(" ".join(card["description"].split()), max_description_tokens)
+        shingles = _shingles(description)
+        if any(_jaccard(shingles, other) >= duplicate_threshold for other in kept_shingles):
+            stats["duplicates"] += 1
+            continue
+        line = f"- {card['title']}: {description}"
+        tokens = count_tokens(line) + 1
+        if stats["tokens"] + tokens > budget_tokens:
+            stats["over_budget"] += 1
+            continue
+        lines.append(line)
+        kept_shingles.append(shingles)
+        seen_titles.add(card["title"])
+        stats["kept"] += 1
+        stats["tokens"] += tokens
+    return "\n".join(lines), stats
+
+
+def log_prompt_tokens(stage, prompt):
+    """Count and log the tokens of one prompt sent at ``stage``; returns the count."""
+    tokens = count_tokens(prompt)
+    with _prompt_tokens_lock:
+        prompt_tokens[stage]["prompts"] += 1
+        prompt_tokens[stage]["tokens"] += tokens
+    logger.info(f"Prompt tokens for {stage}: {tokens}")
+    return tokens
+
+
+def prompt_token_stats():
+    """Snapshot of ``prompt_tokens``, safe to serialize while other threads log prompts."""
+    with _prompt_tokens_lock:
+        return {stage: dict(counts) for stage, counts in prompt_tokens.items()}
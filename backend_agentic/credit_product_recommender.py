@@ -5,14 +5,36 @@ from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
 from pydantic import BaseModel, Field
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from llm_utils import llm, retriever
+from llm_utils import get_router, embed_queries, vector_search, RETRIEVER_K
+from candidate_pools import get_candidate_pool, rank_within_pool
+from context_builder import build_card_context, log_prompt_tokens, truncate_tokens
+from card_ranker import rank_cards, format_annual_fee, summarize
+from output_repair import parse_structured
 import logging
 from langchain.tools import tool
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Upper bound on concurrent ``$vectorSearch`` queries per retrieval.
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+# Rerank inside the precomputed per-tier pool instead of searching per suggestion.
+USE_CANDIDATE_POOLS = os.getenv("CANDIDATE_POOLS", "true").lower() != "false"
+# Token budget for the cards in the rerank prompt; 0 sends every retrieved card as before.
+RERANK_CONTEXT_TOKENS = int(os.getenv("RERANK_CONTEXT_TOKENS", "3000"))
+RERANK_DESCRIPTION_TOKENS = int(os.getenv("RERANK_DESCRIPTION_TOKENS", "120"))
+RERANK_PROFILE_TOKENS = int(os.getenv("RERANK_PROFILE_TOKENS", "400"))
+# llm: the LLM picks the top 5 from the retrieved cards (original behaviour).
+# local: ``card_ranker`` picks them and the LLM only writes the personalized descriptions.
+# fast: ``card_ranker`` picks them and the descriptions are summaries of the product text.
+RERANK_MODE = os.getenv("RERANK_MODE", "local").lower()
+RERANK_TOP_K = 5
+# Budget of the single fix-up call made when an output cannot be repaired locally.
+REPAIR_INPUT_TOKENS = int(os.getenv("REPAIR_INPUT_TOKENS", "1500"))
+REPAIR_MAX_TOKENS = int(os.getenv("REPAIR_MAX_TOKENS", "1024"))
+
 class CreditCard(BaseModel):
     title: str = Field(description="name of a credit card from Credit cards Recommendations")
     description: str = Field(description="Rephrase description to summarize the features of the credit card in 50 words")
@@ -83,6 +105,73 @@ user_profile_based_cc_rec_prompt = PromptTemplate(
 )
 
 
+card_description_prompt = PromptTemplate(
+    template="""
+    You are an AI assistant. The credit cards below were selected for the given user profile.
+    - For each card, keep the title and annual fee as given and write a personalized description in 50 words explaining why it suits the user.
+
+    ## ML Model Inference Results on User Profile:
+    - Credit Health={pred}
+    - Processed Credit Limit for the user={allowed_credit_limit}
+    User profile={user_profile}
+    Occupation={occupation}
+    Annual Income={annual_income}
+    Monthly Inhand Salary={monthly_inhand_salary}
+
+    ## Selected Credit cards:
+    {selected_cards}
+
+    ##Format Instructions: {format_instruction}
+
+    """,
+    input_variables=["user_profile", "pred", "allowed_credit_limit", "occupation", "annual_income", "monthly_inhand_salary", "selected_cards"],
+    partial_variables={"format_instruction": final_output_parser.get_format_instructions()}
+)
+
+
+repair_prompt = PromptTemplate(
+    template="""
+    The output below should be JSON matching the format instructions, but it failed to parse.
+    Return only the corrected JSON, with no other text.
+
+    ## Parse Error: {error}
+
+    ## Output:
+    {output}
+
+    ##Format Instructions: {format_instruction}
+    """,
+    input_variables=["error", "output", "format_instruction"],
+)
+
+
+def invoke_structured(prompt: str, parser: PydanticOutputParser, stage: str):
+    """
+    Run ``prompt`` and parse the completion with ``output_repair``.
+
+    When the local repair steps fail, one fix-up call with at most ``REPAIR_INPUT_TOKENS``
+    of the bad output and ``REPAIR_MAX_TOKENS`` of completion is made before giving up.
+
+    Raises:
+        OutputRepairError: When the output cannot be repaired.
+    """
+    def fix_up(output, error):
+        fix_prompt = repair_prompt.format(
+            error=error,
+            output=truncate_tokens(output, REPAIR_INPUT_TOKENS),
+            format_instruction=parser.get_format_instructions(),
+        )
+        log_prompt_tokens("repair", fix_prompt)
+        return get_router().invoke("repair", fix_prompt, max_tokens=REPAIR_MAX_TOKENS)
+
+    output = get_router().invoke(stage, prompt)
+    return parse_structured(output, parser.pydantic_object, stage, fix_up=fix_up)
+
+
+def format_structured_profile(user_profile_ip: dict) -> str:
+    """Render the raw profile fields as ``Name=value`` lines, for prompts that run before any explanation exists."""
+    return "\n".join(f"{name}={value}" for name, value in user_profile_ip.items())
+
 def get_credit_card_recommendations(
     user_profile: str,
     user_profile_ip: dict,
@@ -111,39 +200,120 @@ def get_credit_card_recommendations(
         monthly_inhand_salary=user_profile_ip.get("Monthly_Inhand_Salary"),
 
     )
+    log_prompt_tokens("card_queries", prompt)
     try:
-        chain = llm | recommendation_parser
-        parsed_resp = chain.invoke(prompt)
-        return parsed_resp
+        return invoke_structured(prompt, recommendation_parser, "card_queries")
     except Exception as e:
         logging.error(f"Error in get_credit_card_recommendations: {e}")
         return None
 
-def retrieve_card_recommendations(queries, retriever) -> List[dict]:
+def search_card_products(queries, k=RETRIEVER_K, max_workers=RETRIEVAL_WORKERS) -> List[dict]:
+    """
+    Embed all queries in one batch, run their vector searches concurrently and merge the hits.
+
+    Args:
+        queries (list): List of card type queries
+        k (int): Hits per query
+        max_workers (int): Concurrent vector searches
+
+    Returns:
+        list: One ``{"title", "description", "score"}`` per card, in first-seen order over
+        the queries' ranked hits, keeping each card's best score.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+    vectors = embed_queries(queries)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(vectors)))) as pool:
+        hit_lists = list(pool.map(lambda vector: vector_search(vector, k), vectors))
+
+    merged = {}
+    for hit in (hit for hits in hit_lists for hit in hits):
+        best = merged.setdefault(hit["title"], hit)
+        best["score"] = max(best["score"], hit["score"])
+    return list(merged.values())
+
+def retrieve_card_candidates(queries, pred=None, annual_income=None) -> List[dict]:
+    """
+    Retrieve scored, title-unique card candidates for the queries.
+
+    Args:
+        queries (list): List of card type queries
+        pred (str): Credit tier; selects the precomputed candidate pool when given.
+        annual_income (float): Selects the income band within the tier's pools.
+
+    Returns:
+        list: ``{"title", "description", "score"}`` per card
+    """
+    pool = get_candidate_pool(pred, annual_income) if USE_CANDIDATE_POOLS and pred else None
+    if pool:
+        return rank_within_pool(pool, embed_queries(list(queries)))
+    return search_card_products(queries)
+
+def retrieve_card_recommendations(queries, pred=None, annual_income=None) -> List[dict]:
     """
     Retrieve credit card recommendations based on query criteria,
     remove duplicates and sort by title.
     
     Args:
         queries (list): List of card type queries
-        retriever: Document retriever object
+        pred (str): Credit tier; selects the precomputed candidate pool when given.
+        annual_income (float): Selects the income band within the tier's pools.
     
     Returns:
         list: Sorted unique document results
     """
-    # Retrieve documents for each query
-    docs = [retriever.invoke(query) for query in queries]
-    
-    # Flatten and standardize format
-    all_docs = [{"title": doc.metadata["title"], "description": doc.page_content} 
-                for doc_list in docs for doc in doc_list]
-    
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_docs = [doc for doc in all_docs if doc["title"] not in seen and not seen.add(doc["title"])]
-    
-    # Sort by title
-    return sorted(unique_docs, key=lambda x: x["title"])
+    hits = retrieve_card_candidates(queries, pred, annual_income)
+    cards = [{"title": card["title"], "description": card["description"]} for card in hits]
+    return sorted(cards, key=lambda x: x["title"])
+
+def summarize_cards(chosen) -> CreditCardList:
+    """``CreditCardList`` of locally ranked cards with their product text summarized and the parsed fee."""
+    return CreditCardList(cards=[
+        CreditCard(
+            title=card["title"],
+            description=summarize(card["description"]),
+            annual_fee=format_annual_fee(card["features"]["annual_fee"]),
+        )
+        for card in chosen
+    ])
+
+def describe_cards(
+    chosen: List[dict],
+    user_profile: str,
+    user_profile_ip: dict,
+    pred: float,
+    allowed_credit_limit: float,
+) -> CreditCardList:
+    """
+    Have the LLM write personalized descriptions for locally ranked cards.
+
+    The selection, order and fees stay those of the ranker; a card the LLM drops or renames
+    keeps its summarized product text.
+    """
+    fallback = summarize_cards(chosen)
+    selected_cards = "\n".join(
+        f"- {card.title} (annual fee: {card.annual_fee}): {truncate_tokens(original['description'], RERANK_DESCRIPTION_TOKENS)}"
+        for card, original in zip(fallback.cards, chosen)
+    )
+    prompt = card_description_prompt.format(
+        user_profile=truncate_tokens(user_profile, RERANK_PROFILE_TOKENS),
+        pred=pred,
+        allowed_credit_limit=allowed_credit_limit,
+        occupation=user_profile_ip.get("Occupation"),
+        annual_income=user_profile_ip.get("Annual_Income"),
+        monthly_inhand_salary=user_profile_ip.get("Monthly_Inhand_Salary"),
+        selected_cards=selected_cards,
+    )
+    log_prompt_tokens("card_descriptions", prompt)
+    try:
+        described = {card.title: card.description for card in invoke_structured(prompt, final_output_parser, "card_descriptions").cards}
+    except Exception as e:
+        logging.error(f"Error in describe_cards: {e}")
+        return fallback
+    for card in fallback.cards:
+        card.description = described.get(card.title, card.description)
+    return fallback
 
 def get_final_user_profile_cc_rec(
     user_profile: str,
@@ -166,10 +336,28 @@ def get_final_user_profile_cc_rec(
         str: The card suggestions with personalized summary.
     """
 
-    retrieved_cards = retrieve_card_recommendations(
-        queries=card_suggestions,
-        retriever=retriever
-    )
+    if RERANK_MODE in ("local", "fast"):
+        annual_income = user_profile_ip.get("Annual_Income")
+        candidates = retrieve_card_candidates(card_suggestions, pred, annual_income)
+        chosen = rank_cards(candidates, annual_income, pred, k=RERANK_TOP_K)
+        logging.info(f"Ranked {len(candidates)} cards locally: {[card['title'] for card in chosen]}")
+        if RERANK_MODE == "fast":
+            return summarize_cards(chosen)
+        return describe_cards(chosen, user_profile, user_profile_ip, pred, allowed_credit_limit)
+
+    if RERANK_CONTEXT_TOKENS > 0:
+        candidates = retrieve_card_candidates(card_suggestions, pred, user_profile_ip.get("Annual_Income"))
+        retrieved_cards, context_stats = build_card_context(
+            candidates, budget_tokens=RERANK_CONTEXT_TOKENS, max_description_tokens=RERANK_DESCRIPTION_TOKENS
+        )
+        logging.info(f"Rerank context from {len(candidates)} cards: {context_stats}")
+        user_profile = truncate_tokens(user_profile, RERANK_PROFILE_TOKENS)
+    else:
+        retrieved_cards = retrieve_card_recommendations(
+            queries=card_suggestions,
+            pred=pred,
+            annual_income=user_profile_ip.get("Annual_Income"),
+        )
     # print("++++++++++++++++++++++++++++++++++++++++++++++")
     # print("Final Recommendations", parsed_cards_recommendations)
     # print("++++++++++++++++++++++++++++++++++++++++++++++")
@@ -182,9 +370,9 @@ def get_final_user_profile_cc_rec(
         monthly_inhand_salary=user_profile_ip.get("Monthly_Inhand_Salary"),
         card_suggestions=retrieved_cards
     )
+    log_prompt_tokens("rerank", prompt)
     try:
-        chain = llm | final_output_parser
-        parsed_resp = chain.invoke(prompt)
+        parsed_resp = invoke_structured(prompt, final_output_parser, "rerank")
         # print("++++++++++++++++++++++++++++++++++++++++++++++")
         # print("Final Recommendations_out", parsed_resp)
         # print("++++++++++++++++++++++++++++++++++++++++++++++")
@@ -199,11 +387,12 @@ def get_final_user_profile_cc_rec(
 if __name__=="__main__":
     load_dotenv()
     from dummy import PrepareDummyCols
-    from credit_rating import get_user_profile, get_model_feature_imps
+    from credit_rating import get_user_profile, get_feature_contributions, format_feature_contributions
     from credit_score_expl import get_credit_score_expl
     user_id = 8625
     pred, allowed_credit_limit, user_profile_ip = get_user_profile(user_id)
-    feature_importance = get_model_feature_imps()
+    contributions = get_feature_contributions(user_profile_ip, pred)
+    feature_importance = format_feature_contributions(contributions, user_profile_ip, pred)
     response = get_credit_score_expl(user_profile_ip, pred, allowed_credit_limit, feature_importance)
     print("++++++++++++++++++++++++++++++++++++++++++++++++")
     print(response)
@@ -1,5 +1,3 @@
-import pandas as pd
-import joblib
 from pymongo import MongoClient
 import certifi
 import os
@@ -9,57 +7,184 @@ import json
 
 import numpy as np
 
+import hashlib
 import logging
 import os
 from functools import lru_cache
-from mdb_utils import get_mongo_client
+from profile_store import find_profile, find_profiles, get_profile_collection
+from model_store import get_artifact, get_feature_compiler, get_tree_engine, model_version
 
 from dotenv import load_dotenv
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-client = get_mongo_client()
-col = client["bfsi-genai"]["user_data"]
+# Artifacts load lazily through ``model_store``; the old module-level names still resolve.
+# ``col`` is lazy too, so importing this module in a pre-fork master opens no Mongo client.
+_LAZY_ATTRS = {
+    "col": get_profile_collection,
+    "label_encoder_l": lambda: get_artifact("label_encoder"),
+    "dummy_l": lambda: get_artifact("dummy"),
+    "model_l": lambda: get_artifact("model"),
+    "ordinal_enc_l": lambda: get_artifact("ordinal_encoder"),
+    "feature_compiler": get_feature_compiler,
+    "tree_engine": get_tree_engine,
+    "MODEL_VERSION": model_version,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return _LAZY_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Above this many rows XGBoost's native predictor outruns the NumPy traversal.
+ENGINE_MAX_ROWS = 64
+
+PROFILE_DROP_COLS = ["ID", "Customer_ID", "SSN", "Credit_Score"]
+
+
+def model_input_projection():
+    return {"_id": 0, **{column: 1 for column in get_feature_compiler().source_columns}}
+
+
+def feature_fingerprint(record):
+    """Stable hash of the encoded model-input row; equal hashes mean equal pred and limit."""
+    return hashlib.sha256(get_feature_compiler().compile(record).tobytes()).hexdigest()
+
+
+def get_model_input(user_id):
+    """Fetch only the columns the model reads for ``user_id``, or None if unknown."""
+    return find_profile(user_id, model_input_projection())
+
+
+def _predict_matrix(features):
+    if len(features) <= ENGINE_MAX_ROWS:
+        proba = get_tree_engine().predict_proba(features)
+    else:
+        proba = get_artifact("model").get_booster().inplace_predict(features)
+    preds = get_artifact("label_encoder").inverse_transform(proba.argmax(axis=1))
+    return preds, proba
+
+
+def predict_records(records):
+    """
+    Score raw ``user_data`` documents in one model pass.
+
+    Args:
+        records (list): Raw ``user_data`` documents.
+
+    Returns:
+        tuple: (labels, class probabilities) with one entry per document.
+    """
+    return _predict_matrix(get_feature_compiler().compile_many(records))
+
+
+def predict_record(record):
+    """Score a single raw ``user_data`` document using the compiler's preallocated row."""
+    preds, proba = _predict_matrix(get_feature_compiler().compile(record))
+    return preds[0], proba[0]
+
+
+def predict_many(df):
+    return predict_records(df.to_dict(orient="records"))
 
-label_encoder_l = joblib.load("./model/credit_score_mul_lable_le.jlb")
-dummy_l = joblib.load("./model/credit_score_mul_lable_coldummy.jlb")
-model_l = joblib.load("./model/credit_score_mul_lable_model.jlb")
-ordinal_enc_l = joblib.load("./model/credit_score_mul_lable_ordenc.jlb")
 
 def predict(df):
-    df_copy = df.copy()
-    df_copy.drop(columns=["ID", "Customer_ID", "Name", "SSN","Credit_Score"], inplace=True)
-    df_copy = dummy_l.transform(df_copy)
-    df_copy[ordinal_enc_l.feature_names_in_] = ordinal_enc_l.transform(df_copy[ordinal_enc_l.feature_names_in_])
-    v = model_l.predict_proba(df_copy[model_l.feature_names_in_])[0]
-    pred = label_encoder_l.inverse_transform(model_l.predict(df_copy[model_l.feature_names_in_]))[0]
-    return pred,v
+    preds, proba = predict_many(df)
+    return preds[0], proba[0]
+
+
+def compute_allowed_credit_limit(monthly_income, proba):
+    """Credit limit as six months of in-hand salary weighted by the class probabilities."""
+    proba = np.atleast_2d(proba)
+    return np.ceil(monthly_income*6*((1*proba[:, 0]+0.5*proba[:, 1]+0.25*proba[:, 2]))).astype(int)
+
 
 def get_user_profile(user_id):
     logging.info(f"Processing User ID: {user_id}")
-    user_id_df = pd.DataFrame.from_records((col.find({"Customer_ID":int(user_id)}, {"_id":0})))
-    
-    pred,v = predict(user_id_df)
-    user_id_df.drop(columns=["ID", "Customer_ID", "SSN","Credit_Score"], inplace=True)
-    user_profile_ip = user_id_df.to_dict(orient="records")[0]
-    # print(user_profile_ip)
-
-    monthly_income = user_id_df['Monthly_Inhand_Salary'].values[0]
+    user_profile_ip = find_profile(user_id, {column: 0 for column in PROFILE_DROP_COLS})
+    if user_profile_ip is None:
+        raise KeyError(f"No profile for User ID {user_id}")
+
+    pred,v = predict_record(user_profile_ip)
+
+    monthly_income = user_profile_ip['Monthly_Inhand_Salary']
     logging.info(f">>>>>>>>>>>>>>>>>>>>>> Monthly Income : {monthly_income}")
-    allowed_credit_limit = int(np.ceil(monthly_income*6*((1*v[0]+0.5*v[1]+0.25*v[2]))))
+    allowed_credit_limit = int(compute_allowed_credit_limit(monthly_income, v)[0])
     logging.info(f"Allowed Credit Limit for the user: {allowed_credit_limit}")
     return pred, allowed_credit_limit, user_profile_ip
 
+
+def score_many(user_ids):
+    """
+    Score many customers with a single ``$in`` query and one model pass.
+
+    As with ``get_user_profile``, the first record returned for a customer is the one scored.
+
+    Args:
+        user_ids (list): Customer_IDs to score.
+
+    Returns:
+        dict: Customer_ID -> {"pred", "proba", "allowed_credit_limit"}; unknown IDs are omitted.
+    """
+    records = find_profiles(user_ids, model_input_projection())
+    if not records:
+        return {}
+
+    preds, proba = predict_records(list(records.values()))
+    monthly_income = np.array([record["Monthly_Inhand_Salary"] for record in records.values()], dtype=float)
+    limits = compute_allowed_credit_limit(monthly_income, proba)
+    classes = get_artifact("label_encoder").classes_
+    return {
+        int(customer_id): {
+            "pred": pred,
+            "proba": {label: float(p) for label, p in zip(classes, row)},
+            "allowed_credit_limit": int(limit),
+        }
+        for customer_id, pred, row, limit in zip(records, preds, proba, limits)
+    }
+
 @lru_cache(1)
 def get_model_feature_imps():
-    # model = joblib.load("classifier.jlb")
-    df = pd.DataFrame.from_records((col.find({"Customer_ID":8625}, {"_id":0})))
+    """Global feature importances of the model, most important first."""
+    model_l = get_artifact("model")
     imp_idx = np.argsort(-1 * model_l.feature_importances_)
-    feature_importance = "\n".join(i for i in list(map(lambda x:f"Columns:{x[0]}  Prob score for decision making:{x[1]}" ,zip(df.columns[imp_idx], model_l.feature_importances_[imp_idx]))))
+    feature_importance = "\n".join(i for i in list(map(lambda x:f"Columns:{x[0]}  Prob score for decision making:{x[1]}" ,zip(model_l.feature_names_in_[imp_idx], model_l.feature_importances_[imp_idx]))))
     return feature_importance
 
 
+# Number of per-user contributions sent to the explanation prompt.
+TOP_K_CONTRIBUTIONS = int(os.getenv("TOP_K_CONTRIBUTIONS", "5"))
+
+
+def get_feature_contributions(record, pred):
+    """
+    Per-user contribution of every model feature towards the predicted class.
+
+    Args:
+        record (dict): Raw profile holding at least the model input columns.
+        pred (str): Predicted Credit Health label.
+
+    Returns:
+        dict: feature -> contribution to the ``pred`` margin, largest magnitude first.
+    """
+    compiler = get_feature_compiler()
+    class_index = list(get_artifact("label_encoder").classes_).index(pred)
+    contributions = get_tree_engine().contributions(compiler.compile(record))[0, class_index, :-1]
+    order = np.argsort(-np.abs(contributions))
+    return {compiler.feature_names[i]: round(float(contributions[i]), 4) for i in order}
+
+
+def format_feature_contributions(contributions, record, pred, top_k=TOP_K_CONTRIBUTIONS):
+    """Render the ``top_k`` contributions as prompt lines with the user's own values."""
+    return "\n".join(
+        f"{name}={record.get(name)}: {'supports' if value > 0 else 'works against'} Credit Health={pred} (weight {value:+.3f})"
+        for name, value in list(contributions.items())[:top_k]
+    )
+
+
 # if __name__=="__main__":
 #     print(col.find_one({}))
 #     user_id = 8625
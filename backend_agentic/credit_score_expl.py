@@ -5,15 +5,15 @@ load_dotenv()
 from typing import List
 
 from langchain_core.messages import SystemMessage
-from langchain_core.output_parsers import StrOutputParser
 from pydantic import BaseModel
 from langchain_fireworks import ChatFireworks
 
 from dummy import PrepareDummyCols
 
-from credit_rating import get_model_feature_imps, get_user_profile, col, predict
+from credit_rating import get_feature_contributions, format_feature_contributions, get_user_profile, predict
 
-from llm_utils import llm
+from llm_utils import get_router
+from context_builder import log_prompt_tokens
 
 credit_score_expl_prompt = """    
     You are Credit Health AI Assistant. 
@@ -45,7 +45,7 @@ credit_score_expl_prompt = """
     Payment_Behaviour: Represents the payment behavior of the customer
     Monthly_Balance: Represents the monthly balance amount of the customer (in USD)
 
-    ##Feature importaces for all above defined features of the alternative credit scroing technique:
+    ##Factors that most influenced this person's Credit Health in the alternative credit scroing technique:
     {feature_importance}
 
     ##Featurized User profile input to predict the Result(Credit Score Profile):
@@ -66,6 +66,14 @@ credit_score_expl_prompt = """
     Detailed explanation for Credit Health and Processed Credit limit within 250 words:[Reason]
 """
 
+def build_credit_score_expl_prompt(user_profile_ip, pred, allowed_credit_limit, feature_importance):
+    return credit_score_expl_prompt.format(
+        user_profile_ip=user_profile_ip,
+        pred=pred,
+        allowed_credit_limit=allowed_credit_limit,
+        feature_importance=feature_importance
+    )
+
 def get_credit_score_expl(user_profile_ip, pred, allowed_credit_limit, feature_importance):
     """
     Get the credit score explanation for a given user profile.
@@ -74,25 +82,34 @@ def get_credit_score_expl(user_profile_ip, pred, allowed_credit_limit, feature_i
         user_profile_ip (dict): The user profile input.
         pred (str): The predicted credit score.
         allowed_credit_limit (float): The allowed credit limit.
-        feature_importance (str): The feature importance scores.
+        feature_importance (str): The top per-user feature contributions.
 
     Returns:
         str: The credit score explanation.
     """
-    prompt = credit_score_expl_prompt.format(
-        user_profile_ip=user_profile_ip,
-        pred=pred,
-        allowed_credit_limit=allowed_credit_limit,
-        feature_importance=feature_importance
-    )
-    chain = llm | StrOutputParser()
-    response = chain.invoke(prompt)
+    prompt = build_credit_score_expl_prompt(user_profile_ip, pred, allowed_credit_limit, feature_importance)
+    log_prompt_tokens("explanation", prompt)
+    response = get_router().invoke("explanation", prompt)
     response = response.strip()
     return response
 
+def stream_credit_score_expl(user_profile_ip, pred, allowed_credit_limit, feature_importance):
+    """
+    Stream the credit score explanation as the model generates it.
+
+    Takes the same arguments as ``get_credit_score_expl``.
+
+    Yields:
+        str: Text chunks; joined and stripped they form the explanation.
+    """
+    prompt = build_credit_score_expl_prompt(user_profile_ip, pred, allowed_credit_limit, feature_importance)
+    log_prompt_tokens("explanation", prompt)
+    yield from get_router().stream("explanation", prompt)
+
 if __name__=="__main__":
     user_id = 8625
     pred, allowed_credit_limit, user_profile_ip = get_user_profile(user_id)
-    feature_importance = get_model_feature_imps()
+    contributions = get_feature_contributions(user_profile_ip, pred)
+    feature_importance = format_feature_contributions(contributions, user_profile_ip, pred)
     response = get_credit_score_expl(user_profile_ip, pred, allowed_credit_limit, feature_importance)
     print(response)
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Two-tier cache of embedding vectors: a bounded in-process LRU over an on-disk float32 store.
+
+The disk store is two append-only files: ``vectors.f32`` (one float32 row per entry, read
+through ``numpy.memmap``) and ``keys.txt`` (``<key> <row>`` per line). Appends take an
+exclusive ``flock`` and reads a shared one, so several workers on one host can share a
+directory, and entries survive restarts. Rows written by other processes are picked up the
+next time a key is not found locally; the file is remapped only once it holds rows past the
+current mapping.
+
+Past ``max_rows`` the store is compacted to its newest half: both files are rewritten and
+swapped in, and other processes notice the new ``keys.txt`` and reload their index.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def embedding_key(model_id, instruction, text):
+    """Hash of the model id, the instruction and the whitespace-normalized text."""
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    return hashlib.sha256(json.dumps([model_id, instruction, normalized]).encode()).hexdigest()[:32]
+
+
+class DiskVectorStore:
+    """
+    Append-only, memory-mapped float32 vectors addressed by key.
+
+    Args:
+        directory (str): Store location, shared by every process using it.
+        max_rows (int): Compact to the newest half once this many rows are stored; 0 for no cap.
+    """
+
+    def __init__(self, directory, max_rows=0):
+        os.makedirs(directory, exist_ok=True)
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.max_rows = max_rows
+        self.dim = None
+        self.index = {}
+        self.rows = 0
+        self._keys_read = 0
+        self._keys_inode = None
+        self._vectors = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.index)
+
+    @contextmanager
+    def _flock(self, operation):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Read keys appended since the last refresh, remapping the vectors file if it grew."""
+        with self._lock, self._flock(fcntl.LOCK_SH):
+            self._read_keys()
+            if self.rows and (self._vectors is None or self.rows > len(self._vectors)):
+                rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def _read_keys(self):
+        # Callers hold ``_lock`` and the file lock.
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if self.dim is None or not os.path.exists(self.keys_path):
+            return
+        stat = os.stat(self.keys_path)
+        if stat.st_ino != self._keys_inode or stat.st_size < self._keys_read:
+            # First read, or another process compacted the store and renumbered the rows.
+            self.index, self.rows, self._keys_read, self._vectors = {}, 0, 0, None
+            self._keys_inode = stat.st_ino
+        if stat.st_size > self._keys_read:
+            with open(self.keys_path) as f:
+                f.seek(self._keys_read)
+                lines = f.read()
+            # Only consume complete lines; a crashed writer may have left a partial one.
+            complete = lines[:lines.rfind("\n") + 1]
+            self._keys_read += len(complete.encode())
+            for line in complete.splitlines():
+                key, row = line.split()
+                self.index[key] = int(row)
+                self.rows = max(self.rows, int(row) + 1)
+
+    def get(self, key):
+        with self._lock:
+            row, vectors = self.index.get(key), self._vectors
+        if row is not None and (vectors is None or row >= len(vectors)):
+            # Written by this process after the file was last mapped.
+            self.refresh()
+            with self._lock:
+                row, vectors = self.index.get(key), self._vectors
+        if row is None or vectors is None or row >= len(vectors):
+            return None
+        return np.array(vectors[row])
+
+    def put(self, key, vector):
+        vector = np.ascontiguousarray(vector, dtype=np.float32).ravel()
+        with self._lock, self._flock(fcntl.LOCK_EX):
+            if self.dim is None and not os.path.exists(self.meta_path):
+                with open(self.meta_path, "w") as f:
+                    json.dump({"dim": len(vector)}, f)
+            self._read_keys()
+            if len(vector) != self.dim:
+                logger.warning(f"Not caching a {len(vector)}-d vector in a {self.dim}-d store")
+                return
+            if key in self.index:
+                return
+            if self.max_rows and self.rows >= self.max_rows:
+                self._compact(self.max_rows // 2)
+            with open(self.vectors_path, "ab") as f:
+                # Drop a torn row left by a crashed writer so rows stay aligned.
+                row = f.tell() // (self.dim * 4)
+                f.truncate(row * self.dim * 4)
+                f.write(vector.tobytes())
+            line = f"{key} {row}\n"
+            with open(self.keys_path, "a") as f:
+                f.write(line)
+            if self._keys_inode is None:
+                self._keys_inode = os.stat(self.keys_path).st_ino
+            # Mapped lazily by the next ``get`` of a row past the mapping.
+            self.index[key] = row
+            self.rows = row + 1
+            self._keys_read += len(line.encode())
+
+    def _compact(self, keep):
+        # Callers hold ``_lock`` and the exclusive file lock, so readers never see a half-swap.
+        # The old keys go first: a crash part-way loses entries but never pairs keys with the
+        # wrong vectors file.
+        kept = sorted(self.index.items(), key=lambda item: item[1])[-keep:] if keep else []
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        np.ascontiguousarray(vectors[[row for _, row in kept]]).tofile(self.vectors_path + ".tmp")
+        del vectors
+        with open(self.keys_path + ".tmp", "w") as f:
+            f.writelines(f"{key} {row}\n" for row, (key, _) in enumerate(kept))
+        os.unlink(self.keys_path)
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.keys_path + ".tmp", self.keys_path)
+        logger.info(f"Compacted the embedding store from {self.rows} to {len(kept)} rows")
+        self.index = {key: row for row, (key, _) in enumerate(kept)}
+        self.rows, self._vectors = len(kept), None
+        self._keys_read = os.path.getsize(self.keys_path)
+        self._keys_inode = os.stat(self.keys_path).st_ino
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU in front of an optional ``DiskVectorStore``, with hit and encode-time counters.
+
+    Args:
+        directory (str): Disk store location; memory only when None.
+        max_entries (int): Size cap of the in-process LRU.
+        max_disk_rows (int): Size cap of the disk store, see ``DiskVectorStore``; 0 for none.
+    """
+
+    def __init__(self, directory=None, max_entries=4096, max_disk_rows=0):
+        self.max_entries = max_entries
+        self.disk = DiskVectorStore(directory, max_rows=max_disk_rows) if directory else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "encoded": 0, "encode_seconds": 0.0}
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return vector
+        if self.disk is not None:
+            if key not in self.disk.index:
+                self.disk.refresh()
+            vector = self.disk.get(key)
+            if vector is not None:
+                self._count("disk_hits")
+                self._remember(key, vector)
+                return vector
+        self._count("misses")
+        return None
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vector)
+            except OSError as e:
+                logger.error(f"Embedding cache write failed: {e}")
+
+    def embed(self, keys, encode):
+        """
+        Look up every key and encode only the misses, in one call.
+
+        Args:
+            keys (list): Cache keys, see ``embedding_key``.
+            encode (callable): Maps the positions of the missing keys to their vectors.
+
+        Returns:
+            list: One float32 vector per key.
+        """
+        vectors = [self.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            started = time.perf_counter()
+            encoded = np.asarray(encode(missing), dtype=np.float32)
+            self._count("encode_seconds", time.perf_counter() - started)
+            self._count("encoded", len(missing))
+            for i, vector in zip(missing, encoded):
+                self.put(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def stats(self):
+        """Counters since process start; ``saved_seconds`` assumes each hit would cost the mean encode time."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._memory)
+        counters["disk_entries"] = len(self.disk) if self.disk is not None else 0
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        per_text = counters["encode_seconds"] / counters["encoded"] if counters["encoded"] else 0.0
+        counters["saved_seconds"] = hits * per_text
+        return counters
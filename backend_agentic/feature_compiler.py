@@ -0,0 +1,94 @@
+import math
+import threading
+
+import numpy as np
+
+
+class FeatureCompiler:
+    """
+    Maps raw ``user_data`` documents straight into model-ordered feature rows.
+
+    The plan is built once from the fitted ``PrepareDummyCols``, ``OrdinalEncoder`` and model
+    artifacts and reproduces ``dummy.transform`` -> ``ordinal_enc.transform`` ->
+    ``df[model.feature_names_in_]`` without building a DataFrame per request.
+    """
+
+    NUMERIC = 0
+    ORDINAL = 1
+    DUMMY = 2
+
+    def __init__(self, dummy, ordinal_encoder, model):
+        """
+        Parameters:
+            - dummy (PrepareDummyCols): Fitted dummy-column transformer.
+            - ordinal_encoder (OrdinalEncoder): Fitted ordinal encoder.
+            - model: Fitted estimator exposing ``feature_names_in_``.
+        """
+        self.feature_names = [str(name) for name in model.feature_names_in_]
+        self.n_features = len(self.feature_names)
+        unknown_value = float(ordinal_encoder.unknown_value)
+
+        # Missing values only map to ``encoded_missing_value`` when they were seen during fit;
+        # otherwise the encoder treats them as unknown categories.
+        missing_indices = getattr(ordinal_encoder, "_missing_indices", {})
+        ordinal_maps = {}
+        for i, (name, categories) in enumerate(zip(ordinal_encoder.feature_names_in_, ordinal_encoder.categories_)):
+            codes = {category: float(code) for code, category in enumerate(categories) if not self._is_missing(category)}
+            missing = float(ordinal_encoder.encoded_missing_value) if i in missing_indices else unknown_value
+            ordinal_maps[str(name)] = (codes, unknown_value, missing)
+        dummy_sources = {}
+        for source, prefix in zip(dummy.dummy_cols, dummy.dummy_prefix):
+            head = prefix + dummy.col_name_sep
+            for column in dummy.columns:
+                if column.startswith(head):
+                    dummy_sources[column] = (source, column[len(head):])
+
+        self.data_sep = dummy.data_sep
+        self._plan = []
+        for name in self.feature_names:
+            if name in ordinal_maps:
+                self._plan.append((self.ORDINAL, name, ordinal_maps[name]))
+            elif name in dummy_sources:
+                self._plan.append((self.DUMMY, *dummy_sources[name]))
+            else:
+                self._plan.append((self.NUMERIC, name, None))
+        self.source_columns = sorted({key for _, key, _ in self._plan})
+        self._local = threading.local()
+
+    @staticmethod
+    def _is_missing(value):
+        return value is None or (isinstance(value, float) and math.isnan(value))
+
+    def _fill(self, doc, out):
+        for i, (kind, key, lookup) in enumerate(self._plan):
+            if kind == self.DUMMY:
+                value = doc.get(key)
+                out[i] = 0.0 if self._is_missing(value) else float(lookup in value.split(self.data_sep))
+                continue
+            # Absent columns are zero-filled by the reindex in ``PrepareDummyCols.transform``.
+            value = doc.get(key, 0)
+            if kind == self.ORDINAL:
+                codes, unknown, missing = lookup
+                out[i] = missing if self._is_missing(value) else codes.get(value, unknown)
+            else:
+                out[i] = np.nan if value is None else value
+        return out
+
+    def compile(self, doc):
+        """
+        Encode one document into this thread's preallocated ``(1, n_features)`` float32 row.
+
+        The returned array is reused by the next call on the same thread; copy it to keep it.
+        """
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.empty((1, self.n_features), dtype=np.float32)
+        self._fill(doc, row[0])
+        return row
+
+    def compile_many(self, docs):
+        """Encode a sequence of documents into a new ``(len(docs), n_features)`` float32 matrix."""
+        matrix = np.empty((len(docs), self.n_features), dtype=np.float32)
+        for i, doc in enumerate(docs):
+            self._fill(doc, matrix[i])
+        return matrix
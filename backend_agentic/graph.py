@@ -1,8 +1,9 @@
 import os
 import logging
+import time
 import certifi
 from datetime import datetime
-from functools import lru_cache
+from functools import lru_cache, wraps
 from typing import Any, Dict
 
 from pymongo import MongoClient
@@ -10,14 +11,24 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.mongodb import MongoDBSaver
 
 from dummy import PrepareDummyCols
-from credit_rating import get_user_profile, get_model_feature_imps
+from credit_rating import (
+    get_user_profile,
+    get_feature_contributions,
+    format_feature_contributions,
+    get_model_input,
+    feature_fingerprint,
+)
+from model_store import model_version
 from credit_score_expl import get_credit_score_expl
 from credit_product_recommender import (
+    RERANK_MODE,
+    format_structured_profile,
     get_credit_card_recommendations,
     get_final_user_profile_cc_rec,
 )
 from utils import CCrecommenderState
 from mdb_utils import get_mongo_client, DB_NAME, COLLECTION_NAME
+from single_flight import MongoLease, SingleFlight
 
 # ─── Logging ──────────────────────────────────────────────────────────────────
 logging.basicConfig(
@@ -26,6 +37,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Generate the explanation and the card-type queries concurrently. ``false`` restores the
+# sequential graph, where the queries are generated from the prose explanation.
+GRAPH_PARALLEL_BRANCHES = os.getenv("GRAPH_PARALLEL_BRANCHES", "true").lower() != "false"
+# Coalesce concurrent runs for one user across workers too, through leases in GRAPH_LEASE_COLLECTION.
+GRAPH_LEASES = os.getenv("GRAPH_LEASES", "false").lower() == "true"
+GRAPH_LEASE_COLLECTION = "graph_leases"
+GRAPH_LEASE_SECONDS = float(os.getenv("GRAPH_LEASE_SECONDS", "180"))
+
 
 
 def insert_response(doc: Dict[str, Any]) -> None:
@@ -36,36 +55,74 @@ def insert_response(doc: Dict[str, Any]) -> None:
     logger.info(f"Document: {doc}")
 
 def check_if_user_exists(state) -> str:
-    """Check if the user exists in the database."""
+    """Check if the user exists in the database.
+
+    A stored result is reused without running the model when its features hash and model
+    version still match the user's current model inputs. ``features_hash`` is only written
+    together with the explanation (``credit_profile_doc``) or when the class is unchanged,
+    never by the rescoring job, so a match means the explanation was written for this class.
+    """
     user_id = state["user_id"]
     client = get_mongo_client()
     collection = client[DB_NAME][COLLECTION_NAME]
-    user = collection.find_one({"user_id": user_id})
-    pred, _, _ = get_user_profile(user_id)
-    if user and user.get("pred") == pred:
+    user = collection.find_one(
+        {"user_id": user_id},
+        {"pred": 1, "allowed_credit_limit": 1, "features_hash": 1, "model_version": 1, "user_profile": 1},
+    )
+    # Rows only written by the rescoring job hold ``rescore`` but no explanation to build on.
+    if not user or not user.get("user_profile"):
+        logger.info(f"User {user_id} does not exist in the database.")
+        return "credit_profile"  # Proceed to create a new user profile
+
+    record = get_model_input(user_id)
+    if record is None:
+        logger.info(f"User {user_id} has no profile row.")
+        return "credit_profile"  # The profile step reports the unknown user
+    features_hash = feature_fingerprint(record)
+    if user.get("model_version") == model_version() and user.get("features_hash") == features_hash:
+        logger.info(f"User {user_id} exists in the database with unchanged model inputs.")
+        return "recommendations"  # Proceed to the next step
+
+    pred, limit, _ = get_user_profile(user_id)
+    if user.get("pred") == pred:
         logger.info(f"User {user_id} exists in the database.")
+        insert_response({
+            "user_id": user_id,
+            "allowed_credit_limit": limit,
+            "features_hash": features_hash,
+            "model_version": model_version(),
+        })
         return "recommendations"  # Proceed to the next step
     else:
         logger.info(f"User {user_id} does not exist in the database.")
         return "credit_profile"  # Proceed to create a new user profile
 
+def credit_profile_doc(user_id, profile, raw_profile, pred, limit, contributions) -> Dict[str, Any]:
+    """The ``user_credit_response`` fields written once an explanation has been generated."""
+    return {
+        "user_id": user_id,
+        "user_profile": profile,
+        "user_profile_ip": raw_profile,
+        "pred": pred,
+        "allowed_credit_limit": limit,
+        "feature_contributions": contributions,
+        "features_hash": feature_fingerprint(raw_profile),
+        "model_version": model_version(),
+        "timestamp": datetime.utcnow(),
+    }
+
 # ─── Business Logic Steps ───────────────────────────────────────────────────
 def credit_rating_profile(state: CCrecommenderState) -> Dict[str, Any]:
     """Get the user profile, credit rating & explanations."""
     user_id = state["user_id"]
     pred, limit, raw_profile = get_user_profile(user_id)
-    feat_imps = get_model_feature_imps()
+    contributions = get_feature_contributions(raw_profile, pred)
+    feat_imps = format_feature_contributions(contributions, raw_profile, pred)
     profile = get_credit_score_expl(
         raw_profile, pred, limit, feat_imps
     )
 
-    insert_response({
-        "user_id": user_id,
-        "user_profile": profile,
-        "user_profile_ip": raw_profile,
-        "pred": pred,
-        "allowed_credit_limit": limit,
-    })
+    insert_response(credit_profile_doc(user_id, profile, raw_profile, pred, limit, contributions))
     logger.info(f"Inserted/Updated document for user_id: {user_id}")
     logger.info(f"Document: {{'user_id': {user_id}, 'user_profile': {profile}, 'user_profile_ip': {raw_profile}, 'pred': {pred}, 'allowed_credit_limit': {limit}}}")
     return {
@@ -75,6 +132,47 @@ def credit_rating_profile(state: CCrecommenderState) -> Dict[str, Any]:
         "user_profile": profile,
     }
 
+def score_step(state: CCrecommenderState) -> Dict[str, Any]:
+    """Score the user locally; the LLM branches fan out from here."""
+    pred, limit, raw_profile = get_user_profile(state["user_id"])
+    return {
+        "pred": pred,
+        "allowed_credit_limit": limit,
+        "user_profile_ip": raw_profile,
+        "feature_contributions": get_feature_contributions(raw_profile, pred),
+    }
+
+def explanation_step(state: CCrecommenderState) -> Dict[str, Any]:
+    """Explanation branch of the parallel graph."""
+    raw_profile, pred, limit = state["user_profile_ip"], state["pred"], state["allowed_credit_limit"]
+    contributions = state["feature_contributions"]
+    feat_imps = format_feature_contributions(contributions, raw_profile, pred)
+    profile = get_credit_score_expl(raw_profile, pred, limit, feat_imps)
+    insert_response(credit_profile_doc(state["user_id"], profile, raw_profile, pred, limit, contributions))
+    return {"user_profile": profile}
+
+def card_suggestions(recs, user_id):
+    """Card-type queries of ``recs``; empty when generation failed, so validate marks the run invalid."""
+    if recs is None:
+        logger.error(f"No card queries generated for user_id: {user_id}")
+        return []
+    return recs.card_suggestions
+
+def card_queries_step(state: CCrecommenderState) -> Dict[str, Any]:
+    """Card-type query branch of the parallel graph; needs only the structured profile."""
+    recs = get_credit_card_recommendations(
+        user_profile=format_structured_profile(state["user_profile_ip"]),
+        user_profile_ip=state["user_profile_ip"],
+        pred=state["pred"],
+        allowed_credit_limit=state["allowed_credit_limit"],
+    )
+    suggestions = card_suggestions(recs, state["user_id"])
+    insert_response({
+        "user_id": state["user_id"],
+        "card_suggestions": suggestions,
+    })
+    return {"card_suggestions": suggestions}
+
 def recommendations_step(state: CCrecommenderState) -> Dict[str, Any]:
     recs = get_credit_card_recommendations(
         user_profile=state["user_profile"],
@@ -82,15 +180,19 @@ def recommendations_step(state: CCrecommenderState) -> Dict[str, Any]:
         pred=state["pred"],
         allowed_credit_limit=state["allowed_credit_limit"],
     )
+    suggestions = card_suggestions(recs, state["user_id"])
     insert_response({
         "user_id": state["user_id"],
-        "card_suggestions": recs.card_suggestions,
+        "card_suggestions": suggestions,
     })
     logger.info(f"Inserted/Updated document for user_id: {state['user_id']}")
-    logger.info(f"Document: {{'user_id': {state['user_id']}, 'card_suggestions': {recs.card_suggestions}}}")
-    return {"card_suggestions": recs.card_suggestions}
+    logger.info(f"Document: {{'user_id': {state['user_id']}, 'card_suggestions': {suggestions}}}")
+    return {"card_suggestions": suggestions}
 
 def rerank_step(state: CCrecommenderState) -> Dict[str, Any]:
+    if not state.get("card_suggestions"):
+        logger.warning(f"No card queries to rerank for user_id: {state['user_id']}")
+        return {}
     final = get_final_user_profile_cc_rec(
         user_profile=state["user_profile"],
         user_profile_ip=state["user_profile_ip"],
@@ -98,9 +200,13 @@ def rerank_step(state: CCrecommenderState) -> Dict[str, Any]:
         allowed_credit_limit=state["allowed_credit_limit"],
         card_suggestions=state["card_suggestions"],
     )
+    if final is None:
+        return {}
     insert_response({
         "user_id": state["user_id"],
         "final_recommendations": final.model_dump(),
+        # Which ranker picked the cards, so LLM picks can be told apart from local ones.
+        "rerank_mode": RERANK_MODE,
     })
     return {"final_recommendations": final}
 
@@ -134,6 +240,7 @@ def validate_step(state: CCrecommenderState) -> Dict[str, Any]:
         "user_profile_ip": state["user_profile_ip"],
         "pred": state["pred"],
         "allowed_credit_limit": state["allowed_credit_limit"], 
+        "step_timings": state.get("step_timings", {}),
     }
     insert_response(doc)
     return {
@@ -148,15 +255,37 @@ def validate_step(state: CCrecommenderState) -> Dict[str, Any]:
 def should_end(state: CCrecommenderState) -> str:
     return END if state.get("response") else "recommendations"
 
+def timed(name, step):
+    """Wrap a node so it reports its wall time under ``step_timings[name]``."""
+    @wraps(step)
+    def run(state: CCrecommenderState) -> Dict[str, Any]:
+        started = time.perf_counter()
+        update = step(state)
+        elapsed = time.perf_counter() - started
+        logger.info(f"Step {name} for user_id {state['user_id']} took {elapsed:.2f}s")
+        return {**update, "step_timings": {name: elapsed}}
+    return run
+
 # ─── App Factory ────────────────────────────────────────────────────────────
 @lru_cache(maxsize=1)
 def get_app():
     graph = StateGraph(CCrecommenderState)
     graph.add_node("check_user_exist", check_if_user_exists)
-    graph.add_node("credit_profile", credit_rating_profile)
-    graph.add_node("recommendations", recommendations_step)
-    graph.add_node("rerank", rerank_step)
-    graph.add_node("validate", validate_step)
+    graph.add_node("recommendations", timed("recommendations", recommendations_step))
+    graph.add_node("rerank", timed("rerank", rerank_step))
+    graph.add_node("validate", timed("validate", validate_step))
+
+    if GRAPH_PARALLEL_BRANCHES:
+        # New or changed users: score, then explain and generate card queries side by side.
+        graph.add_node("credit_profile", timed("score", score_step))
+        graph.add_node("explanation", timed("explanation", explanation_step))
+        graph.add_node("card_queries", timed("card_queries", card_queries_step))
+        graph.add_edge("credit_profile", "explanation")
+        graph.add_edge("credit_profile", "card_queries")
+        graph.add_edge(["explanation", "card_queries"], "rerank")
+    else:
+        graph.add_node("credit_profile", timed("credit_profile", credit_rating_profile))
+        graph.add_edge("credit_profile", "recommendations")
 
     # graph.add_edge(START, "credit_profile")
     graph.add_conditional_edges(
@@ -164,7 +293,6 @@ def get_app():
         check_if_user_exists,
         ["credit_profile", "recommendations"],
     )
-    graph.add_edge("credit_profile", "recommendations")
     graph.add_edge("recommendations", "rerank")
     graph.add_edge("rerank", "validate")    
     graph.add_conditional_edges(
@@ -176,6 +304,36 @@ def get_app():
     saver = MongoDBSaver(get_mongo_client())
     return graph.compile(checkpointer=saver)
 
+def graph_config(user_id):
+    return {"recursion_limit": 15, "configurable": {"thread_id": user_id}}
+
+@lru_cache(maxsize=1)
+def get_graph_runs():
+    lease = None
+    if GRAPH_LEASES:
+        lease = MongoLease(get_mongo_client()[DB_NAME][GRAPH_LEASE_COLLECTION], lease_seconds=GRAPH_LEASE_SECONDS)
+    return SingleFlight(lease)
+
+def run_graph(user_id):
+    """
+    Run the graph for ``user_id``; concurrent callers in this process share one run.
+
+    Only with ``GRAPH_LEASES`` is the run shared across processes: a caller whose user is
+    being run by another worker waits for it and returns the final state from the shared
+    checkpointer.
+    """
+    config = graph_config(user_id)
+
+    def stored_state():
+        values = get_app().get_state(config).values
+        return values if values and values.get("response") else None
+
+    return get_graph_runs().do(
+        user_id,
+        lambda: get_app().invoke({"user_id": user_id}, config=config),
+        load=stored_state,
+    )
+
 # ─── Main ───────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     user_id = 8625
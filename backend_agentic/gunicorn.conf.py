@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for serving ``app:app`` with pre-forked workers.
+
+``preload_app`` imports the app in the master, and ``when_ready`` loads the scoring artifacts
+there before any worker is forked, so workers share those (memory-mapped) pages
+copy-on-write instead of each loading their own copy. Nothing that is unsafe across fork
+runs in the master: the embedder (torch/OpenMP thread pools) and the Mongo client are
+created in each worker, by ``post_worker_init`` or on first use. Each worker logs its
+resident memory after warm-up: ``rss`` counts shared pages, ``private`` is what the worker
+holds alone.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+from mdb_utils import ensure_indexes
+from model_store import memory_usage, preload, warm_up
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+preload_app = True
+
+
+def when_ready(server):
+    before = memory_usage()
+    preload()
+    server.log.info(f"Master memory before preload {before} MB, after {memory_usage()} MB")
+
+
+def post_worker_init(worker):
+    # Best effort; ``make indexes`` is the deploy step, and a read-only user may not build indexes.
+    try:
+        ensure_indexes()
+    except Exception as e:
+        worker.log.warning(f"Could not ensure MongoDB indexes: {e}")
+    warm_up(include_embeddings=os.getenv("PRELOAD_EMBEDDINGS", "1") == "1")
+    worker.log.info(f"Worker {worker.pid} memory after warm-up {memory_usage()} MB")
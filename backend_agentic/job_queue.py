@@ -0,0 +1,280 @@
+"""
+Persistent background queue of graph runs, enqueued at login.
+
+Jobs live in ``bfsi-genai.graph_jobs``, one document per user (``_id`` is the user id), so
+a user has at most one queued or running job and the queue survives restarts. Workers claim
+the oldest queued job with an atomic ``find_one_and_update`` and hold it under a lease; a
+job whose worker died is claimed again once its lease expires, up to ``max_attempts``.
+
+``JobWorkerPool`` runs a bounded number of worker threads in the serving process (started
+lazily, after gunicorn forks). A dedicated worker process can be run instead or as well:
+
+Usage:
+    python job_queue.py --workers 4
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from mdb_utils import DB_NAME, get_mongo_client
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_COLLECTION = "graph_jobs"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+ACTIVE = ("queued", "running")
+
+
+def is_active(job, now=None):
+    """Whether ``job`` is queued or running under a live lease; a run whose lease expired has stalled."""
+    if job is None or job["status"] not in ACTIVE:
+        return False
+    if job["status"] == "running":
+        lease_expires_at = job.get("lease_expires_at")
+        return lease_expires_at is None or lease_expires_at > (now or datetime.utcnow())
+    return True
+
+
+class JobQueue:
+    """
+    Mongo-backed queue with one job per user.
+
+    Args:
+        collection (pymongo.collection.Collection): Job collection.
+        lease_seconds (float): How long a claimed job stays with its worker.
+        max_attempts (int): Claims after which an expired job is marked failed.
+    """
+
+    def __init__(self, collection, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.collection.create_index([("status", 1), ("enqueued_at", 1)])
+            self._indexed = True
+
+    def enqueue(self, user_id):
+        """
+        Queue a run for ``user_id`` unless one is already queued or running.
+
+        Returns:
+            tuple: (the user's job document, whether this call queued a new run).
+        """
+        self._ensure_index()
+        now = datetime.utcnow()
+        try:
+            # Requeue unless a job is queued or running under a live lease.
+            result = self.collection.update_one(
+                {
+                    "_id": user_id,
+                    "$or": [
+                        {"status": {"$nin": list(ACTIVE)}},
+                        {"status": "running", "lease_expires_at": {"$lte": now}},
+                    ],
+                },
+                {
+                    "$set": {"status": "queued", "enqueued_at": now, "attempts": 0},
+                    "$unset": {"started_at": "", "finished_at": "", "error": "", "lease_expires_at": ""},
+                },
+                upsert=True,
+            )
+            queued = result.upserted_id is not None or result.modified_count == 1
+        except DuplicateKeyError:
+            queued = False  # Already queued or running.
+        return self.status(user_id), queued
+
+    def claim(self, worker):
+        """Take the oldest runnable job: queued, or running with an expired lease."""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_expires_at": {"$lte": now}, "attempts": {"$lt": self.max_attempts}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": worker,
+                    "started_at": now,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("enqueued_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def finish(self, user_id, worker, error=None):
+        self.collection.update_one(
+            {"_id": user_id, "worker": worker, "status": "running"},
+            {
+                "$set": {"status": "failed" if error else "done", "finished_at": datetime.utcnow(), "error": error},
+                "$unset": {"lease_expires_at": ""},
+            },
+        )
+
+    def fail_abandoned(self):
+        """Mark jobs that used up their attempts without finishing as failed; returns the count."""
+        result = self.collection.update_many(
+            {"status": "running", "lease_expires_at": {"$lte": datetime.utcnow()}, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": "failed", "error": "lease expired", "finished_at": datetime.utcnow()}},
+        )
+        return result.modified_count
+
+    def status(self, user_id):
+        return self.collection.find_one({"_id": user_id})
+
+    def counts(self):
+        return {doc["_id"]: doc["count"] for doc in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])}
+
+
+class JobWorkerPool:
+    """
+    Bounded pool of threads that claim and run jobs.
+
+    Args:
+        queue (JobQueue): Source of jobs.
+        run (callable): Runs the job for one user id.
+        workers (int): Number of threads.
+        poll_seconds (float): Idle wait between claims when the queue is empty.
+        sweep_seconds (float): Interval between ``fail_abandoned`` sweeps in this process.
+    """
+
+    def __init__(self, queue, run, workers=JOB_WORKERS, poll_seconds=1.0, sweep_seconds=60.0):
+        self.queue = queue
+        self.run = run
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.sweep_seconds = sweep_seconds
+        self._next_sweep = 0.0
+        self._pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._counters = {"claimed": 0, "done": 0, "failed": 0}
+
+    def ensure_started(self):
+        """Start the threads in this process; safe to call on every request and after a fork."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                name = f"{os.uname().nodename}:{self._pid}:{i}"
+                threading.Thread(target=self._loop, args=(name,), name=f"job-worker-{i}", daemon=True).start()
+        logger.info(f"Started {self.workers} job workers in process {self._pid}")
+
+    def notify(self):
+        """Wake an idle worker after an enqueue."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _sweep(self):
+        """Fail abandoned jobs at most once per ``sweep_seconds`` across this pool's threads."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.sweep_seconds
+        try:
+            failed = self.queue.fail_abandoned()
+        except Exception as e:
+            logger.error(f"Abandoned job sweep failed: {e}")
+            return
+        if failed:
+            logger.warning(f"Marked {failed} abandoned jobs as failed")
+
+    def _loop(self, worker):
+        while not self._stop.is_set():
+            self._sweep()
+            try:
+                job = self.queue.claim(worker)
+            except Exception as e:
+                logger.error(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            self._count("claimed")
+            error = None
+            try:
+                self.run(job["_id"])
+            except Exception as e:
+                logger.error(f"Job for user {job['_id']} failed: {e}")
+                error = str(e)
+            self._count("failed" if error else "done")
+            try:
+                self.queue.finish(job["_id"], worker, error)
+            except Exception as e:
+                logger.error(f"Could not record job for user {job['_id']}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "workers": self.workers if self._pid == os.getpid() else 0}
+
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+@lru_cache(1)
+def get_job_queue():
+    return JobQueue(get_mongo_client()[DB_NAME][JOB_COLLECTION])
+
+
+def get_job_workers():
+    """The process's worker pool running ``graph.run_graph``, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from graph import run_graph
+            _pool = JobWorkerPool(get_job_queue(), run_graph)
+    _pool.ensure_started()
+    return _pool
+
+
+def enqueue_graph_run(user_id):
+    """Queue a graph run for ``user_id`` and wake a local worker; returns (job document, newly queued)."""
+    job, queued = get_job_queue().enqueue(user_id)
+    get_job_workers().notify()
+    return job, queued
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run graph jobs from the graph_jobs queue.")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="number of worker threads")
+    args = parser.parse_args()
+    from graph import run_graph
+    pool = JobWorkerPool(get_job_queue(), run_graph, workers=args.workers)
+    pool.ensure_started()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Job workers: {pool.stats()}")
+    except KeyboardInterrupt:
+        pool.stop()
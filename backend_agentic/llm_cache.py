@@ -0,0 +1,185 @@
+"""
+Two-level cache for LLM responses: a per-process LRU in front of a shared Mongo collection.
+
+``LLMResponseCache`` is a LangChain ``BaseCache``; attaching it to a chat model
+(``ChatFireworks(cache=...)``) caches every ``invoke`` of that model, including those
+inside ``llm | parser`` chains. Keys hash the prompt, with the whitespace of every message's
+text normalized (chat prompts arrive as LangChain's JSON dump of the messages), together
+with LangChain's ``llm_string``, which carries the model name and the sampling
+parameters, so changing either never returns a stale answer.
+
+Entries in ``bfsi-genai.llm_cache`` expire through a TTL index on ``created_at``, so all
+gunicorn workers share responses; hit/miss counters are per process.
+
+Environment:
+    LLM_CACHE_BYPASS: Set to ``true`` to neither read nor write the cache.
+    LLM_CACHE_MAX_ENTRIES: Size cap of the in-process LRU (default 512).
+    LLM_CACHE_TTL_SECONDS: Lifetime of an entry in both levels (default 7 days).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from mdb_utils import DB_NAME, get_mongo_client
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_COLLECTION = "llm_cache"
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return _WHITESPACE.sub(" ", value).strip()
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+
+def normalize_prompt(prompt):
+    """
+    The prompt with runs of whitespace in its text collapsed.
+
+    Chat models pass the serialized message list, where newlines inside a message are JSON
+    escapes, so the JSON is decoded and its strings normalized rather than the raw text.
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return _normalize(prompt)
+    return json.dumps(_normalize(messages), sort_keys=True)
+
+
+def cache_key(prompt, llm_string):
+    """sha256 of the whitespace-normalized prompt and the model/sampling parameters."""
+    return hashlib.sha256(json.dumps([normalize_prompt(prompt), llm_string]).encode()).hexdigest()
+
+
+class LLMResponseCache(BaseCache):
+    """
+    LRU of at most ``max_entries`` responses backed by a Mongo collection with a TTL index.
+
+    Args:
+        collection_name (str): Collection in ``bfsi-genai`` holding the shared entries.
+        max_entries (int): Size cap of the in-process LRU.
+        ttl_seconds (int): Lifetime of an entry.
+        bypass (bool): Skip both levels, e.g. to compare against uncached responses.
+    """
+
+    def __init__(self, collection_name=LLM_CACHE_COLLECTION, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 ttl_seconds=LLM_CACHE_TTL_SECONDS, bypass=LLM_CACHE_BYPASS):
+        self.collection_name = collection_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bypass = bypass
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+        self._thread = threading.local()
+        self._indexed = False
+
+    @property
+    def collection(self):
+        collection = get_mongo_client()[DB_NAME][self.collection_name]
+        if not self._indexed:
+            collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+            self._indexed = True
+        return collection
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _hit(self):
+        self._thread.hits = self.thread_hits() + 1
+
+    def thread_hits(self):
+        """Hits served on the calling thread, so a caller can tell whether its call was cached."""
+        return getattr(self._thread, "hits", 0)
+
+    def _remember(self, key, payload, created):
+        with self._lock:
+            self._memory[key] = (payload, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def lookup(self, prompt, llm_string):
+        if self.bypass:
+            return None
+        key = cache_key(prompt, llm_string)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and time.time() - entry[1] < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                self._hit()
+                return loads(entry[0])
+            self._memory.pop(key, None)
+        try:
+            doc = self.collection.find_one({"_id": key}, {"payload": 1, "created_at": 1})
+        except Exception as e:
+            # A cache outage must never fail the request; fall through to the model.
+            logger.error(f"LLM cache lookup failed: {e}")
+            self._count("errors")
+            doc = None
+        # The TTL monitor only runs once a minute, so expired rows can still be read.
+        age = (datetime.utcnow() - doc["created_at"]).total_seconds() if doc else None
+        if doc and age < self.ttl_seconds:
+            self._count("mongo_hits")
+            self._hit()
+            self._remember(key, doc["payload"], time.time() - age)
+            return loads(doc["payload"])
+        self._count("misses")
+        return None
+
+    def update(self, prompt, llm_string, return_val):
+        if self.bypass:
+            return
+        key = cache_key(prompt, llm_string)
+        payload = dumps(list(return_val))
+        now = datetime.utcnow()
+        self._remember(key, payload, time.time())
+        try:
+            self.collection.replace_one({"_id": key}, {"payload": payload, "created_at": now}, upsert=True)
+            self._count("writes")
+        except Exception as e:
+            logger.error(f"LLM cache write failed: {e}")
+            self._count("errors")
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._memory.clear()
+        self.collection.delete_many({})
+
+    def stats(self):
+        """Counters since process start, plus the current LRU size and hit rate."""
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._memory)
+        lookups = counters["memory_hits"] + counters["mongo_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["memory_hits"] + counters["mongo_hits"]) / lookups if lookups else 0.0
+        counters["bypass"] = self.bypass
+        return counters
+
+
+@lru_cache(1)
+def get_llm_cache():
+    return LLMResponseCache()
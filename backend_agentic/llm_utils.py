@@ -2,36 +2,214 @@ from langchain_fireworks import ChatFireworks
 from langchain.tools.retriever import create_retriever_tool
 from langchain_mongodb import MongoDBAtlasVectorSearch
 from langchain_community.embeddings import HuggingFaceInstructEmbeddings
+from langchain_community.embeddings.huggingface import DEFAULT_QUERY_INSTRUCTION
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.output_parsers import StrOutputParser
 from pymongo import MongoClient
 import certifi
 from dotenv import load_dotenv
 load_dotenv()
+import json
 import os
+from functools import lru_cache
 
 from mdb_utils import get_mongo_client
+from llm_cache import get_llm_cache
+from embedding_cache import EmbeddingCache, embedding_key
+from product_index import ProductVectorIndex
+from model_router import ModelRouter, parse_routes
+from context_builder import count_tokens
 
 # embedding model
 repo_id = "hkunlp/instructor-base"
-hf = HuggingFaceInstructEmbeddings(model_name=repo_id)
-hf.embed_instruction = "Represent the description to find most relevant credit cards as per provided Credit health:"
-
-client = get_mongo_client()
-collection = client["bfsi-genai"]["cc_products"]
-
-vector_store = MongoDBAtlasVectorSearch(
-    collection=collection,
-    embedding=hf,
-)
-
-retriever = vector_store.as_retriever(search_type='similarity', search_kwargs={'k': 25})
-retriever_tool = create_retriever_tool(
-    retriever=retriever,
-    name="credit card product retriever",
-    description="Retrieve credit card products based given user profile and credit score.", 
-)
-
-llm = ChatFireworks(
-    model="accounts/fireworks/models/llama-v3p1-405b-instruct",
-    temperature=0.1,
-    max_tokens=4096
-)
+EMBED_INSTRUCTION = "Represent the description to find most relevant credit cards as per provided Credit health:"
+
+
+QUERY_INSTRUCTION = DEFAULT_QUERY_INSTRUCTION
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./.embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "4096"))
+EMBEDDING_CACHE_MAX_DISK_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_ROWS", "200000"))
+
+
+@lru_cache(1)
+def get_embedding_model():
+    """Load the instructor embedder on first use rather than at import."""
+    hf = HuggingFaceInstructEmbeddings(model_name=repo_id)
+    hf.embed_instruction = EMBED_INSTRUCTION
+    hf.query_instruction = QUERY_INSTRUCTION
+    return hf
+
+
+class CachedInstructEmbeddings(Embeddings):
+    """
+    Instructor embeddings behind an ``EmbeddingCache`` keyed by model id, instruction and text.
+
+    The model itself is only loaded when a text misses the cache.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _embed(self, instruction, texts):
+        keys = [embedding_key(repo_id, instruction, text) for text in texts]
+
+        def encode(positions):
+            model = get_embedding_model()
+            pairs = [[instruction, texts[i]] for i in positions]
+            return model.client.encode(pairs, **model.encode_kwargs)
+
+        return [vector.tolist() for vector in self.cache.embed(keys, encode)]
+
+    def embed_documents(self, texts):
+        return self._embed(EMBED_INSTRUCTION, list(texts))
+
+    def embed_query(self, text):
+        return self._embed(QUERY_INSTRUCTION, [text])[0]
+
+    def embed_queries(self, queries):
+        """Embed many retrieval queries, encoding all misses in one batched forward pass."""
+        return self._embed(QUERY_INSTRUCTION, list(queries))
+
+
+@lru_cache(1)
+def get_embeddings():
+    cache_dir = os.path.join(EMBEDDING_CACHE_DIR, repo_id.replace("/", "__")) if EMBEDDING_CACHE_DIR else None
+    return CachedInstructEmbeddings(EmbeddingCache(
+        cache_dir, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, max_disk_rows=EMBEDDING_CACHE_MAX_DISK_ROWS,
+    ))
+
+
+PRODUCT_COLLECTION = "cc_products"
+VECTOR_INDEX_NAME = "default"
+RETRIEVER_K = 25
+
+# ``atlas`` searches with ``$vectorSearch``; ``local`` searches an in-process ``ProductVectorIndex``.
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "atlas")
+# Build the local index from this JSON export instead of the collection, e.g. to run offline.
+PRODUCT_CATALOG_FILE = os.getenv("PRODUCT_CATALOG_FILE")
+PRODUCT_INDEX_REFRESH_SECONDS = float(os.getenv("PRODUCT_INDEX_REFRESH_SECONDS", "300"))
+PRODUCT_INDEX_HNSW = os.getenv("PRODUCT_INDEX_HNSW", "false").lower() == "true"
+
+
+@lru_cache(1)
+def get_product_index():
+    """The in-process catalog index, loaded on first use."""
+    if PRODUCT_CATALOG_FILE:
+        with open(PRODUCT_CATALOG_FILE) as f:
+            records = json.load(f)
+        index = ProductVectorIndex(use_hnsw=PRODUCT_INDEX_HNSW)
+        index.add({**record, "_id": record.get("_id", i)} for i, record in enumerate(records))
+        return index
+    return ProductVectorIndex(
+        get_mongo_client()["bfsi-genai"][PRODUCT_COLLECTION],
+        refresh_seconds=PRODUCT_INDEX_REFRESH_SECONDS,
+        use_hnsw=PRODUCT_INDEX_HNSW,
+    )
+
+
+class LocalProductRetriever(BaseRetriever):
+    """Retriever over ``get_product_index()``, a drop-in for the Atlas vector store retriever."""
+
+    k: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        hits = get_product_index().search(get_embeddings().embed_query(query), self.k)
+        return [
+            Document(page_content=hit["description"], metadata={"title": hit["title"], "source": hit["source"], "score": hit["score"]})
+            for hit in hits
+        ]
+
+
+@lru_cache(1)
+def get_vector_store():
+    collection = get_mongo_client()["bfsi-genai"][PRODUCT_COLLECTION]
+    return MongoDBAtlasVectorSearch(
+        collection=collection,
+        embedding=get_embeddings(),
+        index_name=VECTOR_INDEX_NAME,
+    )
+
+
+@lru_cache(1)
+def get_retriever():
+    if RETRIEVAL_BACKEND == "local":
+        return LocalProductRetriever(k=RETRIEVER_K)
+    return get_vector_store().as_retriever(search_type='similarity', search_kwargs={'k': RETRIEVER_K})
+
+
+def embed_queries(queries):
+    """
+    Embed many retrieval queries, encoding the cache misses in one batched forward pass.
+
+    Uses the same query instruction as ``embed_query``, so the vectors match what the
+    retriever would compute one query at a time.
+    """
+    return get_embeddings().embed_queries(queries)
+
+
+def vector_search(query_vector, k=RETRIEVER_K, include_embeddings=False):
+    """
+    Search the card products for one query vector on the configured ``RETRIEVAL_BACKEND``.
+
+    Atlas runs one ``$vectorSearch`` with the same candidate count the retriever uses.
+
+    Returns:
+        list: ``{"title", "description", "score"}`` per hit, best first, plus the product's
+        ``embedding`` when ``include_embeddings`` is set.
+    """
+    if RETRIEVAL_BACKEND == "local":
+        return get_product_index().search(query_vector, k, include_embeddings=include_embeddings)
+    collection = get_mongo_client()["bfsi-genai"][PRODUCT_COLLECTION]
+    pipeline = [
+        {"$vectorSearch": {
+            "index": VECTOR_INDEX_NAME,
+            "path": "embedding",
+            "queryVector": query_vector,
+            "numCandidates": k * 10,
+            "limit": k,
+        }},
+        {"$project": {
+            "_id": 0, "title": 1, "description": "$text", "score": {"$meta": "vectorSearchScore"},
+            **({"embedding": 1} if include_embeddings else {}),
+        }},
+    ]
+    return list(collection.aggregate(pipeline))
+
+
+@lru_cache(1)
+def get_retriever_tool():
+    return create_retriever_tool(
+        retriever=get_retriever(),
+        name="credit card product retriever",
+        description="Retrieve credit card products based given user profile and credit score.", 
+    )
+
+# Model per tier for ``get_router``; the small tier is the Mixtral model of the original backend.
+MODEL_TIERS = {
+    "large": os.getenv("LARGE_MODEL", "accounts/fireworks/models/llama-v3p1-405b-instruct"),
+    "small": os.getenv("SMALL_MODEL", "accounts/fireworks/models/mixtral-8x22b-instruct"),
+}
+# JSON overrides of the per-stage routes, e.g. {"rerank": {"tier": "small", "budget_seconds": 5}}.
+MODEL_ROUTES = os.getenv("MODEL_ROUTES")
+
+@lru_cache(maxsize=None)
+def get_model(tier, timeout=None, max_tokens=None):
+    """Text-output chat model of ``tier``; a ``timeout`` (the route's request timeout) also disables client retries so it bounds the call."""
+    model = ChatFireworks(
+        model=MODEL_TIERS[tier],
+        temperature=0.1,
+        max_tokens=max_tokens or 4096,
+        request_timeout=timeout,
+        max_retries=0 if timeout else None,
+        cache=get_llm_cache(),
+    )
+    return model | StrOutputParser()
+
+
+@lru_cache(1)
+def get_router():
+    return ModelRouter(
+        get_model, routes=parse_routes(MODEL_ROUTES), count_tokens=count_tokens, cache_hits=get_llm_cache().thread_hits,
+    )
@@ -1,7 +1,8 @@
 # load this data in a new mongodb database
 import os
 import pandas as pd
-from mdb_utils import get_mongo_client
+from mdb_utils import get_mongo_client, ensure_indexes
+from profile_materializer import refresh as materialize_profiles
 from pymongo.operations import SearchIndexModel
 import certifi
 import json
@@ -36,6 +37,7 @@ def load_data_mongodb():
     db = get_mongo_client()["bfsi-genai"]
     col1 = db["cc_products"]
     col2 = db["user_data"]
+    ensure_indexes()
 
     # verify data exists
     if col1.count_documents({}) > 0:
@@ -51,6 +53,7 @@ def load_data_mongodb():
     # Insert the records into the collections
         col1.insert_many(cc_products_records)
         col2.insert_many(user_data_records)
+        materialize_profiles(full=True)
 
 
     # Create a vector search index on the embedding field
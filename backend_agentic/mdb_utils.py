@@ -1,4 +1,5 @@
 import os
+from datetime import datetime
 from pymongo import MongoClient
 import certifi
 from functools import lru_cache
@@ -9,8 +10,43 @@ load_dotenv()
 MONGO_CONN = os.getenv("MONGO_CONNECTION_STRING")
 DB_NAME = "bfsi-genai"
 COLLECTION_NAME = "user_credit_response"
+PROFILE_COLLECTION_NAME = "user_data"
+LATEST_PROFILE_COLLECTION_NAME = "user_profile_latest"
+CHECKPOINT_COLLECTION = "job_checkpoints"
+PROFILE_INDEX = [("Customer_ID", 1)]
 
 # ─── Persistence Helpers ─────────────────────────────────────────────────────
-@lru_cache(1)
 def get_mongo_client() -> MongoClient:
-    return MongoClient(MONGO_CONN, tlsCAFile=certifi.where())
\ No newline at end of file
+    """The process's client; a forked worker gets its own, since MongoClient is not fork-safe."""
+    return _mongo_client(os.getpid())
+
+@lru_cache(maxsize=None)
+def _mongo_client(pid) -> MongoClient:
+    return MongoClient(MONGO_CONN, tlsCAFile=certifi.where())
+
+@lru_cache(1)
+def ensure_indexes() -> None:
+    """
+    Create the indexes the request path relies on (its queries hint them).
+
+    Run once at deploy (``make indexes``) or startup, never from a request: reads must not
+    need index-build privileges or retry a failing build on every call.
+    """
+    db = get_mongo_client()[DB_NAME]
+    db[COLLECTION_NAME].create_index("user_id")
+    db[PROFILE_COLLECTION_NAME].create_index(PROFILE_INDEX)
+    # ``$merge`` into the materialized profiles matches on Customer_ID, which must be unique.
+    db[LATEST_PROFILE_COLLECTION_NAME].create_index(PROFILE_INDEX, unique=True)
+
+def save_checkpoint(job_name, **fields) -> None:
+    """Upsert the ``job_checkpoints`` document of a batch job."""
+    get_mongo_client()[DB_NAME][CHECKPOINT_COLLECTION].update_one(
+        {"_id": job_name},
+        {"$set": {**fields, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+if __name__ == "__main__":
+    ensure_indexes()
+    print("Indexes are in place.")
@@ -0,0 +1,227 @@
+"""
+Per-stage model routing with latency budgets and fallback.
+
+Every LLM stage (explanation, card query generation, rerank, card descriptions, output
+repair) is mapped to a model tier, a latency budget and a request timeout. The budget is a
+routing signal only: when the primary's recent p95 latency is over budget, the stage is
+routed straight to the fallback, probing the primary every ``probe_every`` calls so the
+data keeps up with it. The request timeout is separate and generous, so a long but healthy
+completion is not cut off; a timeout or error sends the prompt to the fallback tier.
+
+Latency, token counts, errors and fallbacks are recorded per stage and tier
+(``ModelRouter.stats``) so budgets and tier choices can be tuned from measurements. Calls
+answered from the response cache are counted as ``cache_hits`` and kept out of the
+latencies, so hits do not hide a slow tier from the budget check.
+"""
+
+import json
+import logging
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Model choice of one stage.
+
+    Attributes:
+        tier (str): Model tier tried first.
+        budget_seconds (float): p95 latency of the primary above which the stage is routed
+            to the fallback; None for no budget.
+        fallback (str): Tier used when the primary times out, errors or runs over budget;
+            None to raise instead.
+        timeout_seconds (float): Request timeout of every call of the stage.
+    """
+    tier: str
+    budget_seconds: float = None
+    fallback: str = None
+    timeout_seconds: float = 120.0
+
+
+# Budgets are p95 targets with room for full-length completions; a 4096-token explanation
+# from the large model takes well over 20 seconds when healthy.
+DEFAULT_ROUTES = {
+    "explanation": Route("large", 60.0, "small", 180.0),
+    # Generating card-type queries is simple enough for the small model.
+    "card_queries": Route("small", 15.0, "large", 60.0),
+    "rerank": Route("large", 45.0, "small"),
+    "card_descriptions": Route("large", 45.0, "small"),
+    "repair": Route("small", 15.0, None, 60.0),
+}
+
+
+def parse_routes(value, defaults=DEFAULT_ROUTES):
+    """
+    Routes from a JSON override such as ``{"rerank": {"tier": "small", "budget_seconds": 5}}``.
+
+    Stages not in ``value`` keep their defaults; unknown keys of a stage are rejected.
+    """
+    routes = dict(defaults)
+    for stage, override in (json.loads(value) if value else {}).items():
+        base = routes.get(stage, Route("large"))
+        routes[stage] = Route(**{**asdict(base), **override})
+    return routes
+
+
+class _TierStats:
+    def __init__(self, window):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=window)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "p50_seconds": statistics.median(latencies) if latencies else None,
+            "p95_seconds": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+        }
+
+
+class ModelRouter:
+    """
+    Route prompts of each stage to a model tier.
+
+    Args:
+        get_model (callable): ``get_model(tier, timeout, max_tokens)`` returning a runnable
+            with ``invoke(prompt) -> str`` and ``stream(prompt)`` yielding text chunks.
+        routes (dict): ``Route`` per stage; unknown stages use ``default_route``.
+        count_tokens (callable): Token counter for the records.
+        cache_hits (callable): Response cache hits so far on the calling thread; a call during
+            which it grows was served from the cache.
+        window (int): Latencies kept per stage and tier.
+        probe_every (int): While a primary is over budget, still try it every this many calls.
+    """
+
+    def __init__(self, get_model, routes=DEFAULT_ROUTES, count_tokens=len, window=50, probe_every=10,
+                 default_route=Route("large", None, "small"), cache_hits=lambda: 0):
+        self.get_model = get_model
+        self.routes = routes
+        self.count_tokens = count_tokens
+        self.cache_hits = cache_hits
+        self.window = window
+        self.probe_every = probe_every
+        self.default_route = default_route
+        self._tiers = defaultdict(lambda: _TierStats(self.window))
+        self._stages = defaultdict(lambda: {"calls": 0, "fallbacks": 0, "routed_around": 0})
+        self._lock = threading.Lock()
+
+    def route(self, stage):
+        return self.routes.get(stage, self.default_route)
+
+    def _over_budget(self, stage, route):
+        if route.fallback is None or route.budget_seconds is None:
+            return False
+        latencies = sorted(self._tiers[stage, route.tier].latencies)
+        return len(latencies) >= 5 and latencies[int(0.95 * (len(latencies) - 1))] > route.budget_seconds
+
+    def choose(self, stage):
+        """
+        Tiers to try for the next call of ``stage``.
+
+        Returns:
+            tuple: (tier, request timeout, fallback tier or None).
+        """
+        route = self.route(stage)
+        with self._lock:
+            counters = self._stages[stage]
+            counters["calls"] += 1
+            if self._over_budget(stage, route) and counters["calls"] % self.probe_every:
+                counters["routed_around"] += 1
+                return route.fallback, route.timeout_seconds, None
+        return route.tier, route.timeout_seconds, route.fallback
+
+    def _record(self, stage, tier, prompt, text, seconds, error=False, cached=False):
+        with self._lock:
+            tier_stats = self._tiers[stage, tier]
+            tier_stats.calls += 1
+            if cached:
+                # A cache hit says nothing about the tier's latency or token spend.
+                tier_stats.cache_hits += 1
+                return
+            tier_stats.prompt_tokens += self.count_tokens(prompt)
+            if error:
+                tier_stats.errors += 1
+            else:
+                tier_stats.completion_tokens += self.count_tokens(text)
+            # Failed calls still count: a timeout is the clearest over-budget signal.
+            tier_stats.latencies.append(seconds)
+
+    def _fall_back(self, stage, tier, fallback, error):
+        logger.warning(f"{stage} on {tier} failed ({error}); falling back to {fallback}")
+        with self._lock:
+            self._stages[stage]["fallbacks"] += 1
+
+    def _invoke_tier(self, stage, tier, prompt, timeout, max_tokens):
+        hits = self.cache_hits()
+        started = time.perf_counter()
+        try:
+            text = self.get_model(tier, timeout, max_tokens).invoke(prompt)
+        except Exception:
+            self._record(stage, tier, prompt, "", time.perf_counter() - started, error=True)
+            raise
+        self._record(stage, tier, prompt, text, time.perf_counter() - started, cached=self.cache_hits() > hits)
+        return text
+
+    def invoke(self, stage, prompt, max_tokens=None):
+        """Completion text for ``prompt`` from the tier routed for ``stage``."""
+        tier, timeout, fallback = self.choose(stage)
+        try:
+            return self._invoke_tier(stage, tier, prompt, timeout, max_tokens)
+        except Exception as e:
+            if fallback is None:
+                raise
+            self._fall_back(stage, tier, fallback, e)
+        return self._invoke_tier(stage, fallback, prompt, timeout, max_tokens)
+
+    def stream(self, stage, prompt, max_tokens=None):
+        """
+        Stream the completion; falls back only if the primary fails before its first chunk.
+
+        Yields:
+            str: Text chunks.
+        """
+        tier, timeout, fallback = self.choose(stage)
+        for attempt_tier, attempt_timeout in ((tier, timeout), (fallback, timeout)):
+            hits = self.cache_hits()
+            started = time.perf_counter()
+            chunks = []
+            try:
+                for chunk in self.get_model(attempt_tier, attempt_timeout, max_tokens).stream(prompt):
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                self._record(stage, attempt_tier, prompt, "", time.perf_counter() - started, error=True)
+                if chunks or attempt_tier == fallback or fallback is None:
+                    raise
+                self._fall_back(stage, attempt_tier, fallback, e)
+                continue
+            self._record(
+                stage, attempt_tier, prompt, "".join(chunks), time.perf_counter() - started,
+                cached=self.cache_hits() > hits,
+            )
+            return
+
+    def stats(self):
+        """Per-stage call, fallback and routing counters with per-tier latency and token records."""
+        with self._lock:
+            stats = {stage: {**counters, "tiers": {}} for stage, counters in self._stages.items()}
+            for (stage, tier), tier_stats in self._tiers.items():
+                stats.setdefault(stage, {"tiers": {}})["tiers"][tier] = tier_stats.summary()
+        for stage, stage_stats in stats.items():
+            route = self.route(stage)
+            stage_stats["route"] = asdict(route)
+        return stats
@@ -0,0 +1,152 @@
+"""
+Lazy loading of the credit scoring artifacts.
+
+Nothing is read from ``model/`` until first use. ``preload()`` loads everything up front so a
+pre-forking server (gunicorn ``preload_app``) shares the pages copy-on-write across workers,
+and ``warm_up()`` additionally runs one prediction so the first request pays no setup cost.
+
+Environment:
+    MODEL_DIR: Directory holding the ``.jlb`` artifacts (default ``./model``).
+    MODEL_MMAP_MODE: ``mmap_mode`` for ``joblib.load`` and the flattened tree arrays, e.g. ``r``.
+        The tree arrays are then written once to ``MODEL_DIR/.tree_ensemble-<version>-v<format>`` and mapped
+        read-only, so every process on the host shares a single copy through the page cache.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+
+import joblib
+import numpy as np
+import __main__
+
+from dummy import PrepareDummyCols
+from feature_compiler import FeatureCompiler
+from tree_ensemble import TreeEnsemble
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.getenv("MODEL_DIR", "./model")
+MMAP_MODE = os.getenv("MODEL_MMAP_MODE") or None
+
+ARTIFACTS = {
+    "label_encoder": "credit_score_mul_lable_le.jlb",
+    "dummy": "credit_score_mul_lable_coldummy.jlb",
+    "model": "credit_score_mul_lable_model.jlb",
+    "ordinal_encoder": "credit_score_mul_lable_ordenc.jlb",
+}
+
+# The dummy-column artifact was pickled from a notebook, so it resolves ``__main__.PrepareDummyCols``.
+if not hasattr(__main__, "PrepareDummyCols"):
+    __main__.PrepareDummyCols = PrepareDummyCols
+
+_load_lock = threading.RLock()
+
+
+def artifact_path(name):
+    return os.path.join(MODEL_DIR, ARTIFACTS[name])
+
+
+@lru_cache(maxsize=None)
+def _load(name):
+    logger.info(f"Loading model artifact {artifact_path(name)}")
+    return joblib.load(artifact_path(name), mmap_mode=MMAP_MODE)
+
+
+def get_artifact(name):
+    """Return the named artifact, loading it on first use."""
+    with _load_lock:
+        return _load(name)
+
+
+@lru_cache(1)
+def model_version():
+    """Content hash of the scoring artifacts; stored results are only reused under the same version."""
+    digest = hashlib.sha256()
+    for name in ARTIFACTS:
+        with open(artifact_path(name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+@lru_cache(1)
+def _feature_compiler():
+    return FeatureCompiler(get_artifact("dummy"), get_artifact("ordinal_encoder"), get_artifact("model"))
+
+
+def get_feature_compiler():
+    with _load_lock:
+        return _feature_compiler()
+
+
+@lru_cache(1)
+def _tree_engine():
+    if MMAP_MODE is None:
+        return TreeEnsemble.from_xgb(get_artifact("model"))
+    directory = os.path.join(MODEL_DIR, f".tree_ensemble-{model_version()}-v{TreeEnsemble.FORMAT}")
+    if not os.path.isdir(directory):
+        staging = f"{directory}.{os.getpid()}"
+        TreeEnsemble.from_xgb(get_artifact("model")).save(staging)
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            # Another process published the same arrays first.
+            pass
+    return TreeEnsemble.load(directory, mmap_mode=MMAP_MODE)
+
+
+def get_tree_engine():
+    with _load_lock:
+        return _tree_engine()
+
+
+def memory_usage():
+    """
+    Resident memory of this process in MB.
+
+    ``rss`` counts shared pages in every process that maps them; ``pss`` splits them
+    proportionally and ``private`` is what this process alone holds. Only ``rss`` is
+    available outside Linux.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(re.findall(r"^(\w+):\s+(\d+) kB", f.read(), re.MULTILINE))
+        return {
+            "rss": int(fields["Rss"]) / 1024,
+            "pss": int(fields["Pss"]) / 1024,
+            "private": (int(fields["Private_Clean"]) + int(fields["Private_Dirty"])) / 1024,
+        }
+    except (OSError, KeyError):
+        import resource
+        return {"rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def preload():
+    """Load every scoring artifact now, e.g. in a server master process before it forks."""
+    for name in ARTIFACTS:
+        get_artifact(name)
+    get_feature_compiler()
+    get_tree_engine()
+    model_version()
+
+
+def warm_up(include_embeddings=False):
+    """
+    Preload the artifacts and run one prediction through them; optionally load the embedder too.
+
+    Returns:
+        dict: Resident memory before and after warm-up, as reported by ``memory_usage``.
+    """
+    before = memory_usage()
+    preload()
+    compiler = get_feature_compiler()
+    get_tree_engine().predict_proba(np.zeros((1, compiler.n_features), dtype=np.float32))
+    if include_embeddings:
+        from llm_utils import get_embedding_model
+        get_embedding_model().embed_query("warm up")
+    after = memory_usage()
+    logger.info(f"Model warm-up done, memory before {before} MB, after {after} MB")
+    return {"before": before, "after": after}
@@ -0,0 +1,212 @@
+"""
+Local repair of structured LLM output before it is declared invalid.
+
+``parse_structured`` turns raw completion text into a pydantic model, trying in order:
+
+1. ``direct``: the text is valid JSON for the model.
+2. ``fenced``: the JSON is wrapped in a markdown code fence.
+3. ``extracted``: the first JSON value embedded in prose, tolerating trailing commas and
+   smart quotes.
+4. ``coerced``: the JSON has the wrong shape (a bare list, a renamed or differently cased
+   key, numbers or objects where strings are expected, missing optional text).
+5. ``fixed``: one bounded fix-up completion, parsed with steps 1-4.
+
+Outcomes are counted per stage in ``parse_outcomes``; every ``fenced``, ``extracted``,
+``coerced`` or ``fixed`` parse is a graph rerun (two 405B calls) that did not happen.
+"""
+
+import json
+import logging
+import re
+import threading
+import typing
+from collections import defaultdict
+
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ("direct", "fenced", "extracted", "coerced", "fixed", "failed")
+REPAIRED = ("fenced", "extracted", "coerced", "fixed")
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+# Parse outcomes per stage since process start; updated from request and job worker threads.
+parse_outcomes = defaultdict(lambda: dict.fromkeys(OUTCOMES, 0))
+_parse_outcomes_lock = threading.Lock()
+
+
+class OutputRepairError(ValueError):
+    """Raised when no repair step yields a valid model."""
+
+
+def strip_code_fences(text):
+    """Content of the first fenced block, or None when there is none."""
+    match = _FENCE.search(text)
+    return match.group(1).strip() if match else None
+
+
+def extract_json(text):
+    """
+    First JSON object or array embedded in ``text``.
+
+    Returns:
+        The decoded value, or None when no parseable JSON is found.
+    """
+    decoder = json.JSONDecoder()
+    # Outermost value first: a nested object only wins when nothing encloses it.
+    for match in re.finditer(r"[\[{]", text):
+        tail = text[match.start():]
+        for candidate in (tail, _TRAILING_COMMA.sub(r"\1", tail.translate(_SMART_QUOTES))):
+            try:
+                value, _ = decoder.raw_decode(candidate)
+            except ValueError:
+                continue
+            return value
+    return None
+
+
+def _list_item_type(annotation):
+    if typing.get_origin(annotation) in (list, typing.List):
+        args = typing.get_args(annotation)
+        return args[0] if args else None
+    return None
+
+
+def _coerce_value(value, annotation):
+    if annotation is str:
+        if isinstance(value, str):
+            return value
+        if isinstance(value, dict):
+            return " ".join(str(v) for v in value.values())
+        if isinstance(value, list):
+            return ", ".join(str(v) for v in value)
+        return "" if value is None else str(value)
+    item_type = _list_item_type(annotation)
+    if item_type is not None:
+        items = value if isinstance(value, list) else [value]
+        return [_coerce_value(item, item_type) for item in items]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel) and isinstance(value, dict):
+        return coerce(value, annotation)
+    return value
+
+
+def coerce(data, model):
+    """
+    Reshape decoded JSON towards ``model``'s fields.
+
+    A bare list fills the model's only list field, a single unknown key wrapping the
+    payload is unwrapped, keys are matched case- and separator-insensitively, values are
+    converted to the field types and missing ``str`` fields become empty strings.
+
+    Returns:
+        dict: Data for ``model.model_validate``.
+    """
+    fields = model.model_fields
+    list_fields = [name for name, info in fields.items() if _list_item_type(info.annotation) is not None]
+    if isinstance(data, list) and len(list_fields) == 1:
+        data = {list_fields[0]: data}
+    if not isinstance(data, dict):
+        return data
+    if len(data) == 1 and not set(data) & set(fields):
+        (inner,) = data.values()
+        if isinstance(inner, dict):
+            data = inner
+        elif isinstance(inner, list) and len(list_fields) == 1:
+            data = {list_fields[0]: inner}
+
+    def normalize(key):
+        return re.sub(r"[^a-z0-9]", "", key.lower())
+
+    by_key = {normalize(key): value for key, value in data.items()}
+    coerced = {}
+    for name, info in fields.items():
+        value = data.get(name, by_key.get(normalize(name)))
+        if value is None:
+            if info.annotation is str:
+                coerced[name] = ""
+            continue
+        coerced[name] = _coerce_value(value, info.annotation)
+    return coerced
+
+
+def _validate(data, model):
+    try:
+        return model.model_validate(data)
+    except ValidationError:
+        return None
+
+
+def repair(text, model):
+    """
+    Parse ``text`` into ``model`` with the local steps only.
+
+    Returns:
+        tuple: (model instance or None, outcome name or None).
+    """
+    try:
+        return model.model_validate_json(text), "direct"
+    except ValueError:
+        pass
+    fenced = strip_code_fences(text)
+    if fenced is not None:
+        try:
+            return model.model_validate_json(fenced), "fenced"
+        except ValueError:
+            pass
+    data = extract_json(fenced if fenced is not None else text)
+    if data is None:
+        return None, None
+    parsed = _validate(data, model)
+    if parsed is not None:
+        return parsed, "extracted"
+    parsed = _validate(coerce(data, model), model)
+    return (parsed, "coerced") if parsed is not None else (None, None)
+
+
+def parse_structured(text, model, stage, fix_up=None):
+    """
+    Parse an LLM completion into ``model``, repairing it locally and with at most one fix-up call.
+
+    Args:
+        text (str): Raw completion text.
+        model (type): Pydantic model of the expected output.
+        stage (str): Name the outcome is counted under.
+        fix_up (callable): Called once with (text, error message) when the local steps fail;
+            returns a new completion text. None to skip.
+
+    Returns:
+        The parsed model instance.
+
+    Raises:
+        OutputRepairError: When every step fails.
+    """
+    parsed, outcome = repair(text, model)
+    if parsed is None and fix_up is not None:
+        try:
+            model.model_validate_json(text)
+        except ValueError as e:
+            error = str(e)[:500]
+        try:
+            parsed, _ = repair(fix_up(text, error), model)
+            outcome = "fixed" if parsed is not None else None
+        except Exception as e:
+            logger.error(f"Fix-up call for {stage} failed: {e}")
+    with _parse_outcomes_lock:
+        parse_outcomes[stage][outcome or "failed"] += 1
+    if parsed is None:
+        raise OutputRepairError(f"Could not parse {stage} output into {model.__name__}")
+    if outcome != "direct":
+        logger.info(f"Repaired {stage} output ({outcome})")
+    return parsed
+
+
+def parse_stats():
+    """Outcome counts per stage, with the number of graph reruns the repairs avoided."""
+    with _parse_outcomes_lock:
+        stats = {stage: dict(counts) for stage, counts in parse_outcomes.items()}
+    for counts in stats.values():
+        counts["reruns_prevented"] = sum(counts[outcome] for outcome in REPAIRED)
+    return stats
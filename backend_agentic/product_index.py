@@ -0,0 +1,181 @@
+"""
+In-process vector index over the ``cc_products`` card catalog.
+
+All product embeddings are held in one L2-normalized float32 matrix, so a top-k query is a
+single matrix-vector product. For catalogs past ``hnsw_threshold`` rows an HNSW graph
+(``hnswlib``, optional) answers approximately instead. Scores use the same
+``(1 + cosine) / 2`` scale as Atlas ``vectorSearchScore``, so both backends are comparable.
+
+``refresh`` is incremental: it reads the catalog, hashes each product's indexed fields and
+embedding, and only re-normalizes products that are new or whose hash changed (edited in
+place), dropping removed ones. It runs at most every ``refresh_seconds`` from ``search``.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_embedding(value):
+    # Some catalog loads stored the vector as a JSON string.
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def content_hash(record, fields):
+    """sha256 of a product's ``fields`` and embedding, to notice in-place edits."""
+    payload = json.dumps([record.get(field) for field in fields] + [_parse_embedding(record.get("embedding"))], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ProductVectorIndex:
+    """
+    Exact (or HNSW) cosine search over product embeddings.
+
+    Args:
+        collection (pymongo.collection.Collection): Source of the products; None for an index
+            built only from ``add``.
+        refresh_seconds (float): Minimum interval between automatic refreshes in ``search``.
+        use_hnsw (bool): Build an HNSW graph once the catalog reaches ``hnsw_threshold`` rows.
+        hnsw_threshold (int): Catalog size from which HNSW replaces the exact search.
+    """
+
+    FIELDS = ("title", "text", "source")
+
+    def __init__(self, collection=None, refresh_seconds=300, use_hnsw=False, hnsw_threshold=10000):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self.use_hnsw = use_hnsw and hnswlib is not None
+        self.hnsw_threshold = hnsw_threshold
+        self.ids = []
+        self.hashes = {}
+        self.products = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._hnsw = None
+        self._refreshed_at = None
+        self._lock = threading.RLock()
+        if use_hnsw and hnswlib is None:
+            logger.warning("hnswlib is not installed; using exact search")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, records):
+        """Append products (dicts with ``_id``, ``embedding`` and ``FIELDS``) to the index."""
+        records = list(records)
+        if not records:
+            return
+        vectors = np.asarray([_parse_embedding(record["embedding"]) for record in records], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        with self._lock:
+            self.matrix = vectors if not len(self.ids) else np.vstack([self.matrix, vectors])
+            self.ids += [record["_id"] for record in records]
+            self.hashes.update((record["_id"], content_hash(record, self.FIELDS)) for record in records)
+            self.products += [{field: record.get(field) for field in self.FIELDS} for record in records]
+            self._hnsw = None
+
+    def remove(self, ids):
+        ids = set(ids)
+        with self._lock:
+            keep = [i for i, product_id in enumerate(self.ids) if product_id not in ids]
+            self.matrix = self.matrix[keep]
+            self.ids = [self.ids[i] for i in keep]
+            for product_id in ids:
+                self.hashes.pop(product_id, None)
+            self.products = [self.products[i] for i in keep]
+            self._hnsw = None
+
+    def refresh(self):
+        """
+        Load products added to the collection, reload edited ones and drop deleted ones.
+
+        Returns:
+            tuple: (added, updated, removed) counts.
+        """
+        with self._lock:
+            docs = {doc["_id"]: doc for doc in self.collection.find({}, {"_id": 1, "embedding": 1, **{f: 1 for f in self.FIELDS}})}
+            known = set(self.ids)
+            new_ids, removed = docs.keys() - known, known - docs.keys()
+            updated = {
+                product_id for product_id in docs.keys() & known
+                if content_hash(docs[product_id], self.FIELDS) != self.hashes.get(product_id)
+            }
+            if removed or updated:
+                self.remove(removed | updated)
+            if new_ids or updated:
+                self.add(docs[product_id] for product_id in new_ids | updated)
+            self._refreshed_at = time.monotonic()
+        if new_ids or updated or removed:
+            logger.info(
+                f"Product index refreshed: {len(new_ids)} added, {len(updated)} updated, "
+                f"{len(removed)} removed, {len(self.ids)} total"
+            )
+        return len(new_ids), len(updated), len(removed)
+
+    def _maybe_refresh(self):
+        if self.collection is None:
+            return
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh()
+
+    def _hnsw_index(self):
+        if self._hnsw is None:
+            index = hnswlib.Index(space="cosine", dim=self.matrix.shape[1])
+            index.init_index(max_elements=len(self.ids), ef_construction=200, M=16)
+            index.add_items(self.matrix, np.arange(len(self.ids)))
+            index.set_ef(64)
+            self._hnsw = index
+        return self._hnsw
+
+    def search(self, query_vector, k=25, include_embeddings=False):
+        """
+        Top-k products for one query vector.
+
+        Args:
+            query_vector (list): Query embedding.
+            k (int): Number of hits.
+            include_embeddings (bool): Add each hit's normalized ``embedding``.
+
+        Returns:
+            list: ``{"title", "description", "source", "score"}`` per hit, best first.
+        """
+        self._maybe_refresh()
+        with self._lock:
+            n = len(self.ids)
+            if n == 0:
+                return []
+            k = min(k, n)
+            query = np.asarray(query_vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1)
+            if self.use_hnsw and n >= self.hnsw_threshold:
+                rows, distances = self._hnsw_index().knn_query(query, k=k)
+                rows, cosine = rows[0], 1 - distances[0]
+            else:
+                similarity = self.matrix @ query
+                rows = np.argpartition(-similarity, k - 1)[:k] if k < n else np.arange(n)
+                rows = rows[np.argsort(-similarity[rows], kind="stable")]
+                cosine = similarity[rows]
+            hits = [
+                {
+                    "title": self.products[row]["title"],
+                    "description": self.products[row]["text"],
+                    "source": self.products[row]["source"],
+                    "score": float((1 + score) / 2),
+                }
+                for row, score in zip(rows.tolist(), cosine.tolist())
+            ]
+            if include_embeddings:
+                for hit, row in zip(hits, rows.tolist()):
+                    hit["embedding"] = self.matrix[row].tolist()
+            return hits
@@ -0,0 +1,109 @@
+"""
+Materialize the latest ``user_data`` row of every customer into ``user_profile_latest``.
+
+``user_data`` holds one row per customer and month; the request path reads exactly one
+indexed document per customer from ``user_profile_latest`` instead (see ``profile_store``).
+The collection is built with ``latest_profile_pipeline`` and ``$merge``-d on its unique
+``Customer_ID`` index, so reruns replace rows in place.
+
+Incremental refreshes only re-reduce the customers that gained rows since the last run:
+the highest ``user_data._id`` seen is kept as a watermark in ``job_checkpoints``. Rows
+edited in place keep their ``_id``, so pass their customers explicitly with ``--customers``
+(or call ``refresh_customers``), or run ``--full``.
+
+Usage:
+    python profile_materializer.py              # incremental, full build on the first run
+    python profile_materializer.py --full
+    python profile_materializer.py --customers 3392 8625
+"""
+
+import argparse
+import logging
+import time
+
+from mdb_utils import (
+    DB_NAME, PROFILE_COLLECTION_NAME, LATEST_PROFILE_COLLECTION_NAME, CHECKPOINT_COLLECTION, PROFILE_INDEX,
+    ensure_indexes, get_mongo_client, save_checkpoint,
+)
+from profile_store import latest_profile_pipeline
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "materialize_user_profile_latest"
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def refresh_customers(customer_ids, batch_size=1000):
+    """
+    Recompute the latest profile of the given customers.
+
+    Args:
+        customer_ids (list): Customer_IDs to refresh.
+        batch_size (int): Customer_IDs per aggregation.
+
+    Returns:
+        int: Number of customers refreshed.
+    """
+    ensure_indexes()
+    source = get_mongo_client()[DB_NAME][PROFILE_COLLECTION_NAME]
+    ids = list(dict.fromkeys(int(customer_id) for customer_id in customer_ids))
+    for chunk in _chunks(ids, batch_size):
+        source.aggregate(latest_profile_pipeline(chunk, into=LATEST_PROFILE_COLLECTION_NAME), hint=PROFILE_INDEX)
+    return len(ids)
+
+
+def refresh(batch_size=1000, full=False, job_name=JOB_NAME):
+    """
+    Bring ``user_profile_latest`` up to date with ``user_data``.
+
+    Args:
+        batch_size (int): Customer_IDs per aggregation in incremental mode.
+        full (bool): Rebuild every customer instead of those with new rows.
+        job_name (str): Checkpoint key holding the ``_id`` watermark.
+
+    Returns:
+        int: Number of customers refreshed, or None after a full rebuild.
+    """
+    ensure_indexes()
+    db = get_mongo_client()[DB_NAME]
+    source = db[PROFILE_COLLECTION_NAME]
+    started = time.perf_counter()
+
+    # Pin the upper bound first so rows inserted while this runs are picked up next time.
+    newest = source.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if newest is None:
+        logger.info(f"{PROFILE_COLLECTION_NAME} is empty, nothing to materialize")
+        return 0
+    checkpoint = db[CHECKPOINT_COLLECTION].find_one({"_id": job_name}) or {}
+    watermark = None if full else checkpoint.get("last_id")
+
+    if watermark is None:
+        logger.info(f"Rebuilding {LATEST_PROFILE_COLLECTION_NAME} from all of {PROFILE_COLLECTION_NAME}")
+        source.aggregate(latest_profile_pipeline(into=LATEST_PROFILE_COLLECTION_NAME), allowDiskUse=True)
+        refreshed = None
+    else:
+        changed = source.distinct("Customer_ID", {"_id": {"$gt": watermark, "$lte": newest["_id"]}})
+        logger.info(f"{len(changed)} customers have new rows since _id {watermark}")
+        refreshed = refresh_customers(changed, batch_size=batch_size)
+
+    save_checkpoint(job_name, last_id=newest["_id"], refreshed=refreshed, completed=True)
+    logger.info(f"Finished {job_name} in {time.perf_counter() - started:.1f}s, watermark _id {newest['_id']}")
+    return refreshed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize the latest user_data row per customer.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--full", action="store_true", help="rebuild every customer")
+    parser.add_argument("--customers", type=int, nargs="+", help="refresh only these Customer_IDs")
+    parser.add_argument("--job-name", default=JOB_NAME)
+    args = parser.parse_args()
+    if args.customers:
+        refresh_customers(args.customers, batch_size=args.batch_size)
+    else:
+        refresh(batch_size=args.batch_size, full=args.full, job_name=args.job_name)
@@ -0,0 +1,173 @@
+"""
+Typed, projection-limited access to ``bfsi-genai.user_data`` profiles.
+
+``user_data`` holds one row per customer and month. Lookups read the materialized
+``user_profile_latest`` collection (see ``profile_materializer.py``), which holds exactly
+one row per customer: the latest month, ties broken by the most recently inserted row.
+Customers that have not been materialized yet are resolved from ``user_data`` with the
+same ordering, so either way a user always maps to the same document.
+
+Every lookup goes through the ``Customer_ID`` index (passed as a hint) and returns plain
+dicts straight from the driver, so the request path never builds a DataFrame.
+
+Environment:
+    USE_LATEST_PROFILES: Set to ``false`` to always resolve profiles from ``user_data``.
+"""
+
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+from typing_extensions import TypedDict
+
+from mdb_utils import (
+    DB_NAME, PROFILE_COLLECTION_NAME, LATEST_PROFILE_COLLECTION_NAME, PROFILE_INDEX,
+    get_mongo_client,
+)
+
+logger = logging.getLogger(__name__)
+
+USE_LATEST_PROFILES = os.getenv("USE_LATEST_PROFILES", "true").lower() != "false"
+
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December",
+]
+
+
+class UserProfile(TypedDict, total=False):
+    """A ``user_data`` document; projections return a subset of these fields."""
+    ID: str
+    Customer_ID: int
+    Month: str
+    Name: str
+    SSN: str
+    Age: float
+    Occupation: str
+    Annual_Income: float
+    Monthly_Inhand_Salary: float
+    Num_Bank_Accounts: float
+    Num_Credit_Card: float
+    Interest_Rate: float
+    Num_of_Loan: float
+    Type_of_Loan: str
+    Delay_from_due_date: float
+    Num_of_Delayed_Payment: float
+    Changed_Credit_Limit: float
+    Num_Credit_Inquiries: float
+    Credit_Mix: str
+    Outstanding_Debt: float
+    Credit_Utilization_Ratio: float
+    Credit_History_Age: float
+    Payment_of_Min_Amount: str
+    Total_EMI_per_month: float
+    Amount_invested_monthly: float
+    Payment_Behaviour: str
+    Monthly_Balance: float
+    Monthly_Rental_Commitment: float
+    Credit_Score: str
+
+
+def get_profile_collection():
+    return get_mongo_client()[DB_NAME][PROFILE_COLLECTION_NAME]
+
+
+def get_latest_profile_collection():
+    return get_mongo_client()[DB_NAME][LATEST_PROFILE_COLLECTION_NAME]
+
+
+def _projection(projection):
+    return {"_id": 0, **(projection or {})}
+
+
+def latest_profile_pipeline(customer_ids=None, projection=None, into=None):
+    """
+    Aggregation that reduces ``user_data`` to the latest row per customer.
+
+    Rows are ordered by calendar month (unknown months sort first) and then by ``_id``, so
+    the result is deterministic even when a customer has several rows for one month.
+
+    Args:
+        customer_ids (list): Restrict to these Customer_IDs; all customers when omitted.
+        projection (dict): ``$project`` applied to the reduced rows.
+        into (str): ``$merge`` the rows into this collection, replacing by Customer_ID.
+
+    Returns:
+        list: The pipeline stages.
+    """
+    pipeline = []
+    if customer_ids is not None:
+        pipeline.append({"$match": {"Customer_ID": {"$in": [int(user_id) for user_id in customer_ids]}}})
+    pipeline += [
+        {"$addFields": {"_month_index": {"$indexOfArray": [MONTHS, "$Month"]}}},
+        {"$sort": {"Customer_ID": 1, "_month_index": -1, "_id": -1}},
+        {"$group": {"_id": "$Customer_ID", "profile": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$profile"}},
+        # Without ``_id`` a replaced row keeps the one already stored under its Customer_ID.
+        {"$unset": ["_id", "_month_index"]},
+    ]
+    if projection:
+        pipeline.append({"$project": projection})
+    if into:
+        pipeline.append({"$merge": {"into": into, "on": "Customer_ID", "whenMatched": "replace", "whenNotMatched": "insert"}})
+    return pipeline
+
+
+def _find_unmaterialized(user_ids, projection):
+    logger.info(f"Resolving {len(user_ids)} User IDs from {PROFILE_COLLECTION_NAME}")
+    projection = {key: value for key, value in projection.items() if key != "_id"}
+    return get_profile_collection().aggregate(latest_profile_pipeline(user_ids, projection or None), hint=PROFILE_INDEX)
+
+
+def find_profile(user_id, projection=None) -> Optional[UserProfile]:
+    """
+    Fetch the latest profile of one customer.
+
+    Args:
+        user_id (int): Customer_ID.
+        projection (dict): Fields to include (``{field: 1}``) or exclude (``{field: 0}``).
+
+    Returns:
+        UserProfile: The latest document, or None.
+    """
+    return find_profiles([user_id], projection).get(int(user_id))
+
+
+def find_profiles(user_ids: Iterable, projection=None) -> Dict[int, UserProfile]:
+    """
+    Fetch the latest profile of many customers with a single ``$in`` query.
+
+    Args:
+        user_ids (list): Customer_IDs to fetch.
+        projection (dict): Fields to include or exclude; all fields when omitted.
+
+    Returns:
+        dict: Customer_ID -> profile document, in the order returned by the server; unknown
+        IDs are omitted.
+    """
+    ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+    logger.info(f"Fetching {len(ids)} User IDs")
+    projection = _projection(projection)
+    # Results are keyed by Customer_ID, so it is fetched even when the caller leaves it out.
+    drop_key = projection.pop("Customer_ID", None) == 0
+    if any(value for key, value in projection.items() if key != "_id"):
+        projection["Customer_ID"] = 1
+    profiles = {}
+    if USE_LATEST_PROFILES:
+        cursor = get_latest_profile_collection().find({"Customer_ID": {"$in": ids}}, projection, hint=PROFILE_INDEX)
+        for profile in cursor:
+            profiles[profile["Customer_ID"]] = profile
+    missing = [user_id for user_id in ids if user_id not in profiles]
+    if missing:
+        for profile in _find_unmaterialized(missing, projection):
+            profiles[profile["Customer_ID"]] = profile
+    if drop_key:
+        for profile in profiles.values():
+            del profile["Customer_ID"]
+    return profiles
+
+
+def find_login_name(user_id) -> Optional[str]:
+    """Return only the ``Name`` field used to authenticate, or None for unknown users."""
+    profile = find_profile(user_id, {"Name": 1})
+    return profile.get("Name") if profile else None
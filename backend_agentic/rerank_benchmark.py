@@ -0,0 +1,100 @@
+"""
+Offline agreement between the local card ranker and the stored LLM rerank picks.
+
+For every ``user_credit_response`` document whose ``final_recommendations`` were picked by
+the LLM (``rerank_mode: "llm"``, written by runs with ``RERANK_MODE=llm``, or no
+``rerank_mode`` at all: responses stored before the field existed were all LLM-ranked), the card
+candidates are retrieved again from its ``card_suggestions`` and ranked with
+``card_ranker.rank_cards``. The report gives the mean share of the LLM's cards the local top
+five also contains, how often the LLM's first pick is among them, and the ranking time.
+No LLM is called.
+
+Usage:
+    python rerank_benchmark.py                 # every stored response
+    python rerank_benchmark.py --limit 200 --details
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+from card_ranker import agreement, rank_cards
+from credit_product_recommender import RERANK_TOP_K, retrieve_card_candidates
+from mdb_utils import COLLECTION_NAME, DB_NAME, get_mongo_client
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def llm_titles(final_recommendations):
+    # validate_step stores a list of cards, rerank_step a ``{"cards": [...]}`` dump.
+    cards = final_recommendations.get("cards", []) if isinstance(final_recommendations, dict) else final_recommendations
+    return [card["title"] for card in cards or []]
+
+
+def run_benchmark(limit=0, k=RERANK_TOP_K):
+    """
+    Compare local and stored LLM picks.
+
+    Args:
+        limit (int): Maximum number of responses to replay; 0 for all.
+        k (int): Cards picked locally per user.
+
+    Returns:
+        dict: ``users``, ``mean_overlap``, ``top1_hit_rate``, ``mean_rank_ms`` and
+        per-user ``details``.
+    """
+    collection = get_mongo_client()[DB_NAME][COLLECTION_NAME]
+    responses = collection.find(
+        {
+            # Responses ranked locally would only measure the ranker against itself.
+            "$or": [{"rerank_mode": "llm"}, {"rerank_mode": {"$exists": False}}],
+            "final_recommendations": {"$exists": True},
+            "card_suggestions": {"$exists": True},
+            "pred": {"$exists": True},
+        },
+        {"user_id": 1, "final_recommendations": 1, "card_suggestions": 1, "pred": 1, "user_profile_ip": 1},
+        limit=limit,
+    )
+    details, rank_seconds = [], []
+    for response in responses:
+        expected = llm_titles(response["final_recommendations"])
+        if not expected:
+            continue
+        annual_income = (response.get("user_profile_ip") or {}).get("Annual_Income")
+        candidates = retrieve_card_candidates(response["card_suggestions"], response["pred"], annual_income)
+        started = time.perf_counter()
+        chosen = [card["title"] for card in rank_cards(candidates, annual_income, response["pred"], k=k)]
+        rank_seconds.append(time.perf_counter() - started)
+        details.append({
+            "user_id": response["user_id"],
+            "llm": expected,
+            "local": chosen,
+            "in_candidates": sum(title in {c["title"] for c in candidates} for title in expected),
+            **agreement(chosen, expected),
+        })
+    if not details:
+        return {"users": 0, "mean_overlap": 0.0, "top1_hit_rate": 0.0, "mean_rank_ms": 0.0, "details": []}
+    return {
+        "users": len(details),
+        "mean_overlap": statistics.mean(d["overlap"] for d in details),
+        "top1_hit_rate": statistics.mean(d["top1_hit"] for d in details),
+        "mean_rank_ms": statistics.mean(rank_seconds) * 1000,
+        "details": details,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure agreement of the local card ranker with stored LLM picks.")
+    parser.add_argument("--limit", type=int, default=0, help="maximum responses to replay (0 = all)")
+    parser.add_argument("--details", action="store_true", help="print the picks for every user")
+    args = parser.parse_args()
+    report = run_benchmark(limit=args.limit)
+    if args.details:
+        for row in report["details"]:
+            print(f"{row['user_id']}: overlap={row['overlap']:.2f} top1={row['top1_hit']} llm={row['llm']} local={row['local']}")
+    logger.info(
+        f"{report['users']} users: mean overlap@{RERANK_TOP_K}={report['mean_overlap']:.3f}, "
+        f"top-1 hit rate={report['top1_hit_rate']:.3f}, mean rank time={report['mean_rank_ms']:.3f} ms"
+    )
@@ -0,0 +1,170 @@
+"""
+Offline rescoring of every customer profile.
+
+By default the source is ``user_profile_latest`` (one row per customer, see
+``profile_materializer.py``), so stored scores match what the request path computes;
+``--source user_data`` rescores every monthly row instead.
+
+Streams the collection in ``_id`` order in fixed-size cursor batches, scores each batch on a
+process pool with the artifacts in ``model/`` and writes the results under ``rescore``
+(``rescore.pred``, ``rescore.allowed_credit_limit``, ...) of ``user_credit_response`` with
+unordered bulk writes. The top-level ``pred``, ``features_hash`` and explanation are left to
+the graph, which writes them together, so a rescore never pairs a new class with an
+explanation written for the old one. The last written ``_id`` is checkpointed after every
+batch, so a crashed run resumes where it stopped.
+
+Usage:
+    python rescore_job.py --batch-size 2000 --workers 4
+"""
+
+import argparse
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+from pymongo import UpdateOne
+
+from mdb_utils import (
+    get_mongo_client, save_checkpoint, DB_NAME, COLLECTION_NAME, CHECKPOINT_COLLECTION, LATEST_PROFILE_COLLECTION_NAME,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "rescore_user_profile_latest"
+
+
+def _init_worker():
+    # Forked workers inherit whatever the parent preloaded; anything else loads once here.
+    from model_store import preload
+    preload()
+
+
+def score_batch(records):
+    """
+    Score one batch of raw ``user_data`` documents.
+
+    Returns:
+        list: (Customer_ID, pred, allowed_credit_limit, features_hash) per document, in input order.
+    """
+    from credit_rating import predict_records, compute_allowed_credit_limit, feature_fingerprint
+
+    preds, proba = predict_records(records)
+    monthly_income = np.array([record["Monthly_Inhand_Salary"] for record in records], dtype=float)
+    limits = compute_allowed_credit_limit(monthly_income, proba)
+    return [
+        (int(record["Customer_ID"]), str(pred), int(limit), feature_fingerprint(record))
+        for record, pred, limit in zip(records, preds, limits)
+    ]
+
+
+def rescore_update(pred, limit, features_hash, version, now):
+    """Update of one customer's rescore result, kept apart from the graph's explained fields."""
+    return {"$set": {
+        "rescore.pred": pred,
+        "rescore.allowed_credit_limit": limit,
+        "rescore.features_hash": features_hash,
+        "rescore.model_version": version,
+        "rescore.rescored_at": now,
+    }}
+
+
+def _batches(cursor, batch_size):
+    while True:
+        batch = list(islice(cursor, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_checkpoint(checkpoints, job_name):
+    """Return the ``_id`` to resume after, or None to start from the beginning."""
+    checkpoint = checkpoints.find_one({"_id": job_name})
+    if not checkpoint or checkpoint.get("completed"):
+        return None
+    return checkpoint.get("last_id")
+
+
+def run(batch_size=2000, workers=None, source=LATEST_PROFILE_COLLECTION_NAME, reset=False, job_name=JOB_NAME):
+    """
+    Rescore ``source`` into ``rescore`` of ``user_credit_response``.
+
+    Rows are processed in ``_id`` order, so when a customer has several rows the most recently
+    inserted one is written last.
+
+    Args:
+        batch_size (int): Documents per cursor batch and per pool task.
+        workers (int): Scoring processes; defaults to the CPU count.
+        source (str): Collection in ``bfsi-genai`` holding the raw profiles.
+        reset (bool): Ignore any checkpoint and start from the first document.
+        job_name (str): Checkpoint key, so different sources can be rescored independently.
+
+    Returns:
+        int: Number of rows scored in this run.
+    """
+    from model_store import get_feature_compiler, model_version, preload
+
+    db = get_mongo_client()[DB_NAME]
+    checkpoints = db[CHECKPOINT_COLLECTION]
+    responses = db[COLLECTION_NAME]
+    workers = workers or os.cpu_count()
+
+    last_id = None if reset else load_checkpoint(checkpoints, job_name)
+    query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+    if last_id is not None:
+        logger.info(f"Resuming {job_name} after _id {last_id}")
+    projection = {column: 1 for column in ["Customer_ID", "Monthly_Inhand_Salary", *get_feature_compiler().source_columns]}
+    cursor = db[source].find(query, projection).sort("_id", 1).batch_size(batch_size)
+
+    processed = 0
+    started = time.perf_counter()
+
+    def drain(batch_last_id, future):
+        nonlocal processed
+        # A customer may appear more than once per batch; unordered writes need one op per user.
+        scores = future.result()
+        latest = {customer_id: rest for customer_id, *rest in scores}
+        now = datetime.utcnow()
+        responses.bulk_write(
+            [
+                UpdateOne({"user_id": customer_id}, rescore_update(pred, limit, features_hash, model_version(), now), upsert=True)
+                for customer_id, (pred, limit, features_hash) in latest.items()
+            ],
+            ordered=False,
+        )
+        processed += len(scores)
+        save_checkpoint(job_name, last_id=batch_last_id, processed=processed, completed=False)
+        elapsed = time.perf_counter() - started
+        logger.info(f"Rescored {processed} rows ({processed / elapsed:.0f} rows/s), last _id {batch_last_id}")
+
+    preload()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        # Results are drained in submission order so the checkpoint only ever moves forward.
+        pending = deque()
+        for batch in _batches(cursor, batch_size):
+            pending.append((batch[-1]["_id"], pool.submit(score_batch, batch)))
+            if len(pending) >= 2 * workers:
+                drain(*pending.popleft())
+        while pending:
+            drain(*pending.popleft())
+
+    save_checkpoint(job_name, completed=True)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Finished {job_name}: {processed} rows in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.0f} rows/s)")
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore every customer profile into user_credit_response.")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--source", default=LATEST_PROFILE_COLLECTION_NAME)
+    parser.add_argument("--job-name", default=JOB_NAME)
+    parser.add_argument("--reset", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+    run(batch_size=args.batch_size, workers=args.workers, source=args.source, reset=args.reset, job_name=args.job_name)
@@ -0,0 +1,69 @@
+"""
+Stale-while-revalidate freshness policy for stored ``user_credit_response`` documents.
+
+A stored credit profile is a ``hit`` while it is younger than the TTL and was produced by
+the current scoring model version; otherwise it is ``stale`` and is still served, while a
+background graph run refreshes it. Only a user with no stored profile is a ``miss`` and has
+to wait for the graph. ``ReadStats`` counts the three outcomes.
+"""
+
+import os
+import threading
+from datetime import datetime
+
+# Fields of a stored ``user_credit_response`` that /credit_score can be served from.
+CREDIT_PROFILE_FIELDS = ("user_profile", "pred", "allowed_credit_limit", "user_profile_ip")
+CREDIT_SCORE_TTL_SECONDS = float(os.getenv("CREDIT_SCORE_TTL_SECONDS", "3600"))
+
+OUTCOMES = ("hit", "stale", "miss")
+
+
+def has_credit_profile(doc):
+    return bool(doc) and all(key in doc for key in CREDIT_PROFILE_FIELDS)
+
+
+def response_age(doc, now=None):
+    """Seconds since the document was last written, or None when it carries no ``timestamp``."""
+    written = doc.get("timestamp") if doc else None
+    if written is None:
+        return None
+    return max(0.0, ((now or datetime.utcnow()) - written).total_seconds())
+
+
+def classify(doc, current_model_version, ttl_seconds=CREDIT_SCORE_TTL_SECONDS, now=None):
+    """
+    Freshness of a stored response.
+
+    Args:
+        doc (dict): The stored ``user_credit_response`` document, or None.
+        current_model_version (str): ``model_store.model_version()`` of this process.
+        ttl_seconds (float): Age up to which a response is fresh.
+        now (datetime): Reference time (naive UTC); defaults to the current time.
+
+    Returns:
+        tuple: (``"hit"``, ``"stale"`` or ``"miss"``, age in seconds or None).
+    """
+    if not has_credit_profile(doc):
+        return "miss", None
+    age = response_age(doc, now)
+    if age is None or age > ttl_seconds or doc.get("model_version") != current_model_version:
+        return "stale", age
+    return "hit", age
+
+
+class ReadStats:
+    """Thread-safe hit/stale/miss counters with their ratios."""
+
+    def __init__(self):
+        self._counts = dict.fromkeys(OUTCOMES, 0)
+        self._lock = threading.Lock()
+
+    def record(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {**counts, **{f"{outcome}_ratio": counts[outcome] / total if total else 0.0 for outcome in OUTCOMES}}
@@ -0,0 +1,195 @@
+"""
+Single-flight coalescing of concurrent work on the same key.
+
+``SingleFlight.do(key, fn)`` runs ``fn`` once per key at a time: callers arriving while it
+runs wait for that run and share its result (or exception) instead of starting their own.
+
+Across worker processes, an optional ``MongoLease`` makes the first worker the leader for a
+key via a lease document with an expiry, renewed while the run lasts. Other workers wait
+for the lease to be released and then ``load`` the leader's stored result; when there is
+none they try to take the lease themselves, and only run once they hold it. A leader that
+dies only holds the key until its lease expires.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseBusyError(RuntimeError):
+    """Raised when another worker kept the lease on a key through every wait."""
+
+
+class MongoLease:
+    """
+    Expiring per-key leases stored as ``{_id: key, owner, expires_at}`` documents.
+
+    Args:
+        collection (pymongo.collection.Collection): Lease collection.
+        lease_seconds (float): Lease lifetime; the holder renews it every third of that.
+        poll_seconds (float): Interval at which waiters check the lease.
+    """
+
+    def __init__(self, collection, lease_seconds=180, poll_seconds=0.25):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            # Let Mongo clean up leases whose owner never released them.
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+    def acquire(self, key):
+        """Take the lease on ``key``; returns an owner token, or None while another owner holds it."""
+        self._ensure_index()
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            # Matches only an expired lease; a live one makes the upsert collide on _id.
+            self.collection.update_one(
+                {"_id": str(key), "expires_at": {"$lte": now}},
+                {"$set": {"owner": token, "expires_at": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return None
+        return token
+
+    def renew(self, key, token):
+        """Extend the lease on ``key`` held with ``token``; False if it was lost."""
+        result = self.collection.update_one(
+            {"_id": str(key), "owner": token},
+            {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+        )
+        return result.matched_count == 1
+
+    def release(self, key, token):
+        self.collection.delete_one({"_id": str(key), "owner": token})
+
+    def wait(self, key, timeout=None):
+        """
+        Block until the lease on ``key`` is released or expires.
+
+        Returns:
+            bool: False when ``timeout`` (default ``lease_seconds``) passed first.
+        """
+        deadline = time.monotonic() + (self.lease_seconds if timeout is None else timeout)
+        while time.monotonic() < deadline:
+            lease = self.collection.find_one({"_id": str(key)}, {"expires_at": 1})
+            if lease is None or lease["expires_at"] <= datetime.utcnow():
+                return True
+            time.sleep(self.poll_seconds)
+        return False
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    In-process coalescing, optionally extended across processes by a ``MongoLease``.
+
+    Args:
+        lease (MongoLease): Cross-process lease; None to coalesce within the process only.
+        max_remote_waits (int): Waits on another worker's lease before giving up with
+            ``LeaseBusyError``.
+    """
+
+    def __init__(self, lease=None, max_remote_waits=3):
+        self.lease = lease
+        self.max_remote_waits = max_remote_waits
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {"leaders": 0, "followers": 0, "remote_waits": 0, "remote_results": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def do(self, key, fn, load=None):
+        """
+        Run ``fn()`` for ``key`` unless a run is already in flight, and return its result.
+
+        Args:
+            key: Coalescing key, e.g. a user id.
+            fn (callable): The work.
+            load (callable): With a lease, returns the result another worker stored for
+                ``key`` (None if there is none, in which case ``fn`` runs here).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters["leaders"] += 1
+            else:
+                self._counters["followers"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._run(key, fn, load)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, fn, load):
+        if self.lease is None:
+            return fn()
+        for _ in range(self.max_remote_waits):
+            token = self.lease.acquire(key)
+            if token is not None:
+                return self._run_leased(key, token, fn)
+            self._count("remote_waits")
+            logger.info(f"Waiting for another worker's run for {key}")
+            self.lease.wait(key)
+            result = load() if load is not None else None
+            if result is not None:
+                self._count("remote_results")
+                return result
+        raise LeaseBusyError(f"Another worker kept the lease on {key} through {self.max_remote_waits} waits")
+
+    def _run_leased(self, key, token, fn):
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(key, token, stop), name=f"lease-{key}", daemon=True)
+        renewer.start()
+        try:
+            return fn()
+        finally:
+            stop.set()
+            renewer.join()
+            self.lease.release(key, token)
+
+    def _renew(self, key, token, stop):
+        # Keep the lease alive for runs longer than lease_seconds.
+        while not stop.wait(self.lease.lease_seconds / 3):
+            try:
+                if not self.lease.renew(key, token):
+                    logger.warning(f"Lost the lease on {key}")
+                    return
+            except Exception as e:
+                logger.error(f"Could not renew the lease on {key}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "in_flight": len(self._calls)}
@@ -1,4 +1,9 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
 import scipy.stats as stats
+from scipy.special import ndtr
 
 def calculate_percentile_given_value(value, mean, std):
     # Calculate the z-score (standard score)
@@ -10,31 +15,117 @@ def calculate_percentile_given_value(value, mean, std):
     return percentile/100
 
 
-def calculate_credit_score(ip):
-    # Assign weightages (you can adjust these based on your requirements)
-    weight_payment_history = 0.05
-    weight_credit_utilization = 0.5
-    weight_credit_history_length = 0.025
-    weight_recent_inquiries = 0.4
-    weight_of_outstanding = 0.025
-
-    #Calculate individual scores
-    score_payment_history = ip["Repayment History"]  * weight_payment_history
-    score_credit_utilization = ip["Credit Utilization"] * weight_credit_utilization
-    score_credit_history_length = ip["Credit History"] * weight_credit_history_length
-    score_recent_inquiries = ip["Num Credit Inquiries"] * weight_recent_inquiries
-    score_of_outstanding = ip["Outstanding"] * weight_of_outstanding
-
-    # Calculate overall credit score
-    overall_score = (
-        score_payment_history
-        + score_credit_utilization
-        + score_credit_history_length
-        + score_recent_inquiries
-        + score_of_outstanding
+@dataclass(frozen=True)
+class ScorecardConfig:
+    """
+    Weights and distribution parameters of the traditional scorecard.
+
+    Attributes:
+        weights (dict): Weight per sub-score, summed in this order.
+        credit_history_age (tuple): (mean, std) of Credit_History_Age.
+        outstanding_debt (tuple): (mean, std) of Outstanding_Debt.
+        credit_inquiries (tuple): (mean, std) of Num_Credit_Inquiries.
+        utilization_cap (float): Utilization above this ratio scores zero.
+        inquiries_cutoff (float): Inquiry percentiles above this score zero.
+        min_score (int): Score for an overall weighted sub-score of 0.
+        score_range (int): Added to ``min_score`` for an overall weighted sub-score of 1.
+    """
+    weights: dict = field(default_factory=lambda: {
+        "Repayment History": 0.05,
+        "Credit Utilization": 0.5,
+        "Credit History": 0.025,
+        "Num Credit Inquiries": 0.4,
+        "Outstanding": 0.025,
+    })
+    credit_history_age: tuple = (221.220, 99.681)
+    outstanding_debt: tuple = (1426.220, 1155.129)
+    credit_inquiries: tuple = (5.798, 3.868)
+    utilization_cap: float = 0.4
+    inquiries_cutoff: float = 0.8
+    min_score: int = 300
+    score_range: int = 550
+
+
+DEFAULT_SCORECARD = ScorecardConfig()
+
+SCORECARD_COLUMNS = [
+    "Credit_History_Age",
+    "Num_of_Delayed_Payment",
+    "Credit_Utilization_Ratio",
+    "Outstanding_Debt",
+    "Num_Credit_Inquiries",
+]
+
+
+def valid_scorecard_rows(profiles):
+    """
+    Boolean mask of the profiles ``score_profiles`` can score: every ``SCORECARD_COLUMNS``
+    value numeric and finite, and a non-zero ``Credit_History_Age``.
+    """
+    df = profiles if isinstance(profiles, pd.DataFrame) else pd.DataFrame(profiles)
+    if df.empty:
+        return np.zeros(0, dtype=bool)
+    missing = [column for column in SCORECARD_COLUMNS if column not in df]
+    if missing:
+        return np.zeros(len(df), dtype=bool)
+    values = df[SCORECARD_COLUMNS].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    return np.isfinite(values).all(axis=1) & (values[:, 0] != 0)
+
+
+def _percentile(values, mean, std):
+    # Same arithmetic as ``calculate_percentile_given_value`` so single profiles match bit for bit.
+    return ndtr((values - mean) / std) * 100 / 100
+
+
+def score_profiles(profiles, config=DEFAULT_SCORECARD):
+    """
+    Compute the five scorecard sub-scores and the 300-850 score for many profiles at once.
+
+    Args:
+        profiles (pandas.DataFrame | list | dict): Profiles as a DataFrame, a list of profile
+            dicts or a dict of column arrays, holding at least ``SCORECARD_COLUMNS``.
+        config (ScorecardConfig): Weights and distribution parameters.
+
+    Returns:
+        pandas.DataFrame: One row per profile with a column per sub-score plus ``Score``.
+
+    Raises:
+        ValueError: When a profile has a missing, non-finite or zero-age input, as the
+            per-profile scorecard did; filter with ``valid_scorecard_rows`` first.
+    """
+    df = profiles if isinstance(profiles, pd.DataFrame) else pd.DataFrame(profiles)
+    age, delayed, utilization, outstanding, inquiries = (
+        df[column].to_numpy(dtype=float) for column in SCORECARD_COLUMNS
     )
 
-    # Normalize the score
-    normalized_score = int((overall_score / 1.0) * 550 + 300)
+    invalid = ~valid_scorecard_rows(df)
+    if invalid.any():
+        raise ValueError(f"Cannot score profiles at rows {df.index[invalid].tolist()}: missing, non-finite or zero-age inputs")
+
+    utilization = utilization / 100
+    inquiries_pct = _percentile(inquiries, *config.credit_inquiries)
+    features = {
+        "Repayment History": (age - delayed) / age,
+        "Credit Utilization": 1 - np.where(utilization > config.utilization_cap, 1, utilization),
+        "Credit History": _percentile(age, *config.credit_history_age),
+        "Outstanding": 1 - _percentile(outstanding, *config.outstanding_debt),
+        "Num Credit Inquiries": np.where(inquiries_pct > config.inquiries_cutoff, 0, 1 - inquiries_pct),
+    }
+    result = pd.DataFrame(features, index=df.index)
+    result["Score"] = _score(features, config)
+    return result
+
+
+def _score(features, config):
+    overall = 0
+    for name, weight in config.weights.items():
+        overall = overall + features[name] * weight
+    scaled = (overall / 1.0) * config.score_range + config.min_score
+    if not np.isfinite(scaled).all():
+        raise ValueError("Cannot compute a credit score from non-finite sub-scores")
+    return np.trunc(scaled).astype(int)
+
 
-    return normalized_score
\ No newline at end of file
+def calculate_credit_score(ip, config=DEFAULT_SCORECARD):
+    # Weighted sum of the sub-scores, normalized to the 300-850 range
+    return int(_score({name: np.asarray(ip[name]) for name in config.weights}, config))
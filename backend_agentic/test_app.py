@@ -2,6 +2,7 @@ import pytest
 
 from stat_score_util import calculate_percentile_given_value, calculate_credit_score
 from dummy import PrepareDummyCols
+import numpy as np
 import pandas as pd
 
 def test_calculate_percentile_given_value_mean():
@@ -29,6 +30,1065 @@ def test_calculate_credit_score_basic():
     score = calculate_credit_score(ip)
     assert 300 <= score <= 850
 
+
+def _reference_scorecard(profile_ip):
+    """The original scalar scorecard, kept to check the vectorized engine against."""
+    features = {
+        "Repayment History": (profile_ip["Credit_History_Age"] - profile_ip["Num_of_Delayed_Payment"]) / profile_ip["Credit_History_Age"],
+        "Credit Utilization": 1 - (1 if (profile_ip["Credit_Utilization_Ratio"] / 100) > 0.4 else (profile_ip["Credit_Utilization_Ratio"] / 100)),
+        "Credit History": calculate_percentile_given_value(profile_ip["Credit_History_Age"], 221.220, 99.681),
+        "Outstanding": 1 - calculate_percentile_given_value(profile_ip["Outstanding_Debt"], 1426.220, 1155.129),
+        "Num Credit Inquiries": (
+            0 if calculate_percentile_given_value(profile_ip["Num_Credit_Inquiries"], 5.798, 3.868) > 0.8
+            else 1 - calculate_percentile_given_value(profile_ip["Num_Credit_Inquiries"], 5.798, 3.868)
+        ),
+    }
+    overall = (features["Repayment History"] * 0.05 + features["Credit Utilization"] * 0.5
+               + features["Credit History"] * 0.025 + features["Num Credit Inquiries"] * 0.4
+               + features["Outstanding"] * 0.025)
+    return features, int((overall / 1.0) * 550 + 300)
+
+
+def test_score_profiles_matches_scalar_scorecard():
+    from stat_score_util import score_profiles
+
+    rng = np.random.default_rng(10)
+    profiles = [
+        {
+            "Credit_History_Age": float(rng.integers(1, 400)),
+            "Num_of_Delayed_Payment": float(rng.integers(0, 25)),
+            "Credit_Utilization_Ratio": float(rng.uniform(20, 50)),
+            "Outstanding_Debt": float(rng.uniform(0, 5000)),
+            "Num_Credit_Inquiries": float(rng.integers(0, 15)),
+        }
+        for _ in range(200)
+    ]
+    scores = score_profiles(profiles)
+    for profile, (_, row) in zip(profiles, scores.iterrows()):
+        features, score = _reference_scorecard(profile)
+        assert row["Score"] == score
+        for name, value in features.items():
+            assert row[name] == value
+
+
+def test_score_profiles_rejects_unscorable_inputs():
+    from stat_score_util import calculate_credit_score, score_profiles, valid_scorecard_rows
+
+    good = {"Credit_History_Age": 120.0, "Num_of_Delayed_Payment": 3.0, "Credit_Utilization_Ratio": 30.0,
+            "Outstanding_Debt": 900.0, "Num_Credit_Inquiries": 4.0}
+    zero_age = {**good, "Credit_History_Age": 0.0}
+    nan_debt = {**good, "Outstanding_Debt": float("nan")}
+    missing = {key: value for key, value in good.items() if key != "Num_Credit_Inquiries"}
+    assert valid_scorecard_rows([good, zero_age, nan_debt, missing]).tolist() == [True, False, False, False]
+    for bad in (zero_age, nan_debt):
+        with pytest.raises(ValueError):
+            score_profiles([good, bad])
+    assert score_profiles([good])["Score"].tolist() == [_reference_scorecard(good)[1]]
+    with pytest.raises(ValueError):
+        calculate_credit_score({"Repayment History": float("nan"), "Credit Utilization": 1, "Credit History": 1,
+                                "Num Credit Inquiries": 1, "Outstanding": 1})
+
+def _synthetic_profiles(n, seed=0):
+    """Raw user_data-shaped records covering the columns the scoring pipeline reads."""
+    from credit_rating import dummy_l, ordinal_enc_l
+
+    rng = np.random.default_rng(seed)
+    categories = dict(zip(ordinal_enc_l.feature_names_in_, ordinal_enc_l.categories_))
+    loans = [c[len("ToL_"):] for c in dummy_l.columns if c.startswith("ToL_")]
+    records = []
+    for i in range(n):
+        record = {
+            "ID": f"0x{i:04x}", "Customer_ID": 1000 + i, "Name": f"User{i} Test", "SSN": "000-00-0000",
+            "Credit_Score": "Standard", "Month": "August",
+            "Type_of_Loan": ",".join(rng.choice(loans, size=rng.integers(1, 4), replace=False)),
+        }
+        for column in dummy_l.columns:
+            if column in categories:
+                record[column] = str(rng.choice(categories[column]))
+            elif not column.startswith("ToL_"):
+                record[column] = float(np.round(rng.uniform(0, 5000), 2))
+        record["Num_Credit_Inquiries"] = float(rng.integers(0, 15))
+        records.append(record)
+    return records
+
+
+def test_predict_many_matches_single_row_predict():
+    from credit_rating import predict, predict_many, compute_allowed_credit_limit
+
+    df = pd.DataFrame.from_records(_synthetic_profiles(20))
+    preds, proba = predict_many(df)
+    limits = compute_allowed_credit_limit(df["Monthly_Inhand_Salary"].to_numpy(), proba)
+    for i in range(len(df)):
+        pred, v = predict(df.iloc[[i]])
+        assert pred == preds[i]
+        np.testing.assert_allclose(v, proba[i], rtol=1e-6)
+        assert limits[i] == int(np.ceil(df["Monthly_Inhand_Salary"][i]*6*((1*v[0]+0.5*v[1]+0.25*v[2]))))
+
+
+def test_feature_compiler_matches_pandas_pipeline():
+    from credit_rating import dummy_l, ordinal_enc_l, model_l, feature_compiler
+
+    records = _synthetic_profiles(50, seed=1)
+    records[0]["Occupation"] = "Astronaut"
+    records[1]["Payment_Behaviour"] = None
+    records[2]["Num_of_Loan"] = None
+
+    def reference(recs):
+        df = pd.DataFrame.from_records(recs).drop(columns=["ID", "Customer_ID", "Name", "SSN", "Credit_Score"])
+        df = dummy_l.transform(df)
+        df[ordinal_enc_l.feature_names_in_] = ordinal_enc_l.transform(df[ordinal_enc_l.feature_names_in_])
+        return df[model_l.feature_names_in_].to_numpy(dtype=np.float32)
+
+    np.testing.assert_array_equal(feature_compiler.compile_many(records), reference(records))
+    for record in records[:3]:
+        np.testing.assert_array_equal(feature_compiler.compile(record), reference([record]))
+
+    # A column absent from a single-row request is zero-filled by the reindex.
+    del records[3]["Monthly_Rental_Commitment"]
+    np.testing.assert_array_equal(feature_compiler.compile(records[3]), reference([records[3]]))
+
+
+def test_tree_ensemble_matches_xgboost_model():
+    from credit_rating import model_l, feature_compiler, tree_engine
+
+    X = feature_compiler.compile_many(_synthetic_profiles(500, seed=2))
+    X[::3, 0] = np.nan
+    X[::7, 5] = np.inf
+    expected = model_l.predict_proba(X)
+
+    proba = tree_engine.predict_proba(X)
+    np.testing.assert_allclose(proba, expected, atol=1e-5)
+    np.testing.assert_array_equal(tree_engine.predict(X), model_l.predict(X))
+    np.testing.assert_allclose(tree_engine.predict_proba(X[:1]), expected[:1], atol=1e-5)
+
+
+
+def test_tree_ensemble_memory_mapped_round_trip(tmp_path):
+    from model_store import get_feature_compiler, get_tree_engine
+    from tree_ensemble import TreeEnsemble
+
+    engine = get_tree_engine()
+    engine.save(tmp_path)
+    mapped = TreeEnsemble.load(tmp_path, mmap_mode="r")
+    X = get_feature_compiler().compile_many(_synthetic_profiles(20, seed=6))
+    assert isinstance(mapped.leaf_value, np.memmap)
+    np.testing.assert_array_equal(mapped.predict_proba(X), engine.predict_proba(X))
+
+
+
+def test_tree_ensemble_contributions_match_xgboost():
+    import xgboost as xgb
+    from model_store import get_artifact, get_feature_compiler, get_tree_engine
+
+    model = get_artifact("model")
+    X = get_feature_compiler().compile_many(_synthetic_profiles(100, seed=7))
+    X[::4, 2] = np.nan
+    expected = model.get_booster().predict(
+        xgb.DMatrix(X, feature_names=list(model.feature_names_in_)), pred_contribs=True, approx_contribs=True
+    )
+    contributions = get_tree_engine().contributions(X)
+    np.testing.assert_allclose(contributions, expected, atol=1e-4)
+    np.testing.assert_allclose(contributions.sum(axis=-1), get_tree_engine().predict_margin(X), atol=1e-4)
+
+
+def test_feature_contributions_prompt_is_top_k():
+    from credit_rating import predict_record, get_feature_contributions, format_feature_contributions
+
+    record = _synthetic_profiles(1, seed=9)[0]
+    pred, _ = predict_record(record)
+    contributions = get_feature_contributions(record, pred)
+    magnitudes = [abs(v) for v in contributions.values()]
+    assert magnitudes == sorted(magnitudes, reverse=True)
+    lines = format_feature_contributions(contributions, record, pred, top_k=3).splitlines()
+    assert len(lines) == 3
+    assert lines[0].startswith(f"{next(iter(contributions))}={record[next(iter(contributions))]}")
+
+
+def test_rescore_score_batch_matches_score_path():
+    from credit_rating import predict_record, compute_allowed_credit_limit, feature_fingerprint
+    from rescore_job import score_batch
+
+    records = _synthetic_profiles(5, seed=4)
+    for record, (customer_id, pred, limit, features_hash) in zip(records, score_batch(records)):
+        expected_pred, v = predict_record(record)
+        assert customer_id == record["Customer_ID"]
+        assert pred == expected_pred
+        assert limit == int(compute_allowed_credit_limit(record["Monthly_Inhand_Salary"], v)[0])
+        assert features_hash == feature_fingerprint(record)
+
+
+def test_rescore_update_leaves_the_explained_fields_alone():
+    from datetime import datetime
+    import mongomock
+    from rescore_job import rescore_update
+
+    responses = mongomock.MongoClient()["bfsi-genai"]["user_credit_response"]
+    responses.insert_one({"user_id": 1, "pred": "Good", "features_hash": "old", "user_profile": "Good history."})
+    now = datetime(2026, 1, 1)
+    responses.update_one({"user_id": 1}, rescore_update("Poor", 100, "new", "v2", now), upsert=True)
+    responses.update_one({"user_id": 2}, rescore_update("Standard", 500, "h2", "v2", now), upsert=True)
+
+    explained = responses.find_one({"user_id": 1}, {"_id": 0})
+    assert (explained["pred"], explained["features_hash"], explained["user_profile"]) == ("Good", "old", "Good history.")
+    assert explained["rescore"] == {"pred": "Poor", "allowed_credit_limit": 100, "features_hash": "new", "model_version": "v2", "rescored_at": now}
+    assert responses.find_one({"user_id": 2}, {"_id": 0}) == {"user_id": 2, "rescore": {
+        "pred": "Standard", "allowed_credit_limit": 500, "features_hash": "h2", "model_version": "v2", "rescored_at": now,
+    }}
+
+
+def test_feature_fingerprint_tracks_model_inputs_only():
+    from credit_rating import feature_fingerprint
+
+    record = _synthetic_profiles(1, seed=5)[0]
+    fingerprint = feature_fingerprint(record)
+    assert feature_fingerprint({**record, "Name": "Someone Else", "Month": "May"}) == fingerprint
+    assert feature_fingerprint({**record, "Outstanding_Debt": record["Outstanding_Debt"] + 1}) != fingerprint
+
+
+def run_latest_profile_pipeline(rows, pipeline):
+    """Evaluate the stages latest_profile_pipeline emits, as the server would."""
+    for stage in pipeline:
+        (op, arg), = stage.items()
+        if op == "$match":
+            rows = [row for row in rows if row["Customer_ID"] in arg["Customer_ID"]["$in"]]
+        elif op == "$addFields":
+            months, _ = arg["_month_index"]["$indexOfArray"]
+            rows = [{**row, "_month_index": months.index(row["Month"]) if row["Month"] in months else -1} for row in rows]
+        elif op == "$sort":
+            for key, direction in reversed(list(arg.items())):
+                rows = sorted(rows, key=lambda row: row[key], reverse=direction < 0)
+        elif op == "$group":
+            first = {}
+            for row in rows:
+                first.setdefault(row["Customer_ID"], row)
+            rows = [{"_id": customer_id, "profile": row} for customer_id, row in first.items()]
+        elif op == "$replaceRoot":
+            rows = [row["profile"] for row in rows]
+        elif op == "$unset":
+            rows = [{key: value for key, value in row.items() if key not in arg} for row in rows]
+        elif op == "$project":
+            if any(arg.values()):
+                rows = [{key: row[key] for key in arg if arg[key] and key in row} for row in rows]
+            else:
+                rows = [{key: value for key, value in row.items() if key not in arg} for row in rows]
+    return rows
+
+
+def test_latest_profile_pipeline_orders_by_month_then_insertion():
+    from profile_store import MONTHS, latest_profile_pipeline
+
+    pipeline = latest_profile_pipeline([3392, "8625"], into="user_profile_latest")
+    assert pipeline[0] == {"$match": {"Customer_ID": {"$in": [3392, 8625]}}}
+    assert pipeline[1]["$addFields"]["_month_index"] == {"$indexOfArray": [MONTHS, "$Month"]}
+    assert list(pipeline[2]["$sort"].items()) == [("Customer_ID", 1), ("_month_index", -1), ("_id", -1)]
+    assert pipeline[3]["$group"]["profile"] == {"$first": "$$ROOT"}
+    assert pipeline[-1]["$merge"]["on"] == "Customer_ID"
+    assert "$match" not in latest_profile_pipeline()[0]
+
+
+def test_find_profiles_rewrites_projections_and_falls_back_to_user_data(monkeypatch):
+    import mongomock
+    import profile_store
+    from mdb_utils import PROFILE_INDEX
+
+    class Hinted:
+        """A mongomock collection that checks the index hint (mongomock rejects ``hint``)."""
+
+        def __init__(self, collection):
+            self.collection = collection
+            self.aggregated = []
+
+        def find(self, query, projection, hint):
+            assert hint == PROFILE_INDEX
+            return self.collection.find(query, projection)
+
+        def aggregate(self, pipeline, hint):
+            # mongomock lacks $indexOfArray, so the fallback pipeline is evaluated in Python.
+            assert hint == PROFILE_INDEX
+            self.aggregated.append(pipeline[0]["$match"]["Customer_ID"]["$in"])
+            return run_latest_profile_pipeline(list(self.collection.find()), pipeline)
+
+    db = mongomock.MongoClient()["bfsi-genai"]
+    db.user_data.insert_many([
+        {"_id": 1, "Customer_ID": 5, "Month": "May", "Name": "Old May", "Age": 30.0},
+        {"_id": 2, "Customer_ID": 5, "Month": "May", "Name": "New May", "Age": 31.0},
+        {"_id": 3, "Customer_ID": 5, "Month": "March", "Name": "March", "Age": 29.0},
+        {"_id": 4, "Customer_ID": 7, "Month": "January", "Name": "Stale", "Age": 50.0},
+    ])
+    db.user_profile_latest.insert_one({"Customer_ID": 7, "Month": "June", "Name": "Latest", "Age": 52.0})
+    user_data, latest = Hinted(db.user_data), Hinted(db.user_profile_latest)
+    monkeypatch.setattr(profile_store, "get_profile_collection", lambda: user_data)
+    monkeypatch.setattr(profile_store, "get_latest_profile_collection", lambda: latest)
+    monkeypatch.setattr(profile_store, "USE_LATEST_PROFILES", True)
+
+    # Duplicates collapse, unknown IDs are omitted, and only unmaterialized IDs hit user_data.
+    # Customer_ID is fetched to key the results and kept, since the projection does not exclude it.
+    assert profile_store.find_profiles([5, "7", 5, 99], {"Name": 1}) == {
+        7: {"Customer_ID": 7, "Name": "Latest"},
+        5: {"Customer_ID": 5, "Name": "New May"},
+    }
+    assert user_data.aggregated == [[5, 99]]
+
+    # An explicit exclusion still keys the results by Customer_ID but drops it from them.
+    assert profile_store.find_profiles([5, 7], {"Name": 1, "Customer_ID": 0}) == {7: {"Name": "Latest"}, 5: {"Name": "New May"}}
+    assert profile_store.find_profiles([5, 7], {"Age": 0, "Month": 0, "Customer_ID": 0}) == {7: {"Name": "Latest"}, 5: {"Name": "New May"}}
+
+    # Without a projection whole documents come back, minus _id and the sort helper field.
+    assert profile_store.find_profile(5) == {"Customer_ID": 5, "Month": "May", "Name": "New May", "Age": 31.0}
+    assert profile_store.find_profile("99") is None
+    assert profile_store.find_login_name(7) == "Latest"
+
+    monkeypatch.setattr(profile_store, "USE_LATEST_PROFILES", False)
+    assert profile_store.find_profiles([7], {"Age": 1}) == {7: {"Customer_ID": 7, "Age": 50.0}}
+    assert user_data.aggregated[-1] == [7]
+
+
+def test_profile_materializer_keeps_latest_month_and_follows_watermark(monkeypatch):
+    import profile_materializer
+    from mdb_utils import CHECKPOINT_COLLECTION, DB_NAME, PROFILE_COLLECTION_NAME
+
+    latest = {}
+
+    class Source:
+        def __init__(self, rows):
+            self.rows = rows
+            self.refreshed = []
+
+        def find_one(self, query, projection, sort):
+            return max(self.rows, key=lambda row: row["_id"]) if self.rows else None
+
+        def distinct(self, field, query):
+            bounds = query["_id"]
+            return sorted({row[field] for row in self.rows if bounds["$gt"] < row["_id"] <= bounds["$lte"]})
+
+        def aggregate(self, pipeline, **kwargs):
+            if "$match" in pipeline[0]:
+                self.refreshed.append(pipeline[0]["$match"]["Customer_ID"]["$in"])
+            latest.update((row["Customer_ID"], row) for row in run_latest_profile_pipeline(self.rows, pipeline[:-1]))
+
+    class Checkpoints(dict):
+        def find_one(self, query):
+            return self.get(query["_id"])
+
+    source = Source([
+        {"_id": 1, "Customer_ID": 1, "Month": "January", "Age": 30},
+        {"_id": 2, "Customer_ID": 1, "Month": "March", "Age": 31},
+        {"_id": 3, "Customer_ID": 1, "Month": "February", "Age": 32},
+        {"_id": 4, "Customer_ID": 2, "Month": "May", "Age": 40},
+        {"_id": 5, "Customer_ID": 2, "Month": "May", "Age": 41},
+        {"_id": 6, "Customer_ID": 2, "Month": "Unknown", "Age": 42},
+    ])
+    checkpoints = Checkpoints()
+    monkeypatch.setattr(profile_materializer, "get_mongo_client", lambda: {DB_NAME: {PROFILE_COLLECTION_NAME: source, CHECKPOINT_COLLECTION: checkpoints}})
+    monkeypatch.setattr(profile_materializer, "ensure_indexes", lambda: None)
+    monkeypatch.setattr(profile_materializer, "save_checkpoint", lambda job_name, **fields: checkpoints.__setitem__(job_name, fields))
+
+    # First run rebuilds everything: the latest calendar month wins, then the newest _id within a month.
+    assert profile_materializer.refresh() is None
+    assert {customer_id: row["Age"] for customer_id, row in latest.items()} == {1: 31, 2: 41}
+    assert "_id" not in latest[1] and "_month_index" not in latest[1]
+    assert checkpoints[profile_materializer.JOB_NAME]["last_id"] == 6
+
+    # Only customers with rows past the watermark are reduced again.
+    source.rows.append({"_id": 7, "Customer_ID": 1, "Month": "April", "Age": 33})
+    assert profile_materializer.refresh() == 1
+    assert source.refreshed == [[1]]
+    assert latest[1]["Age"] == 33 and latest[2]["Age"] == 41
+    assert checkpoints[profile_materializer.JOB_NAME]["last_id"] == 7
+
+    # An in-place edit keeps its _id, so the watermark does not see it.
+    source.rows[4] = {**source.rows[4], "Age": 50}
+    assert profile_materializer.refresh() == 0
+    assert latest[2]["Age"] == 41
+
+
+def test_embedding_cache_encodes_misses_once_and_persists(tmp_path):
+    from embedding_cache import EmbeddingCache, embedding_key
+
+    assert embedding_key("m", "q:", "Travel  card\n") == embedding_key("m", "q:", "Travel card")
+    assert embedding_key("m", "q:", "Travel card") != embedding_key("m", "d:", "Travel card")
+
+    calls = []
+    def encode(positions):
+        calls.append(list(positions))
+        return [np.full(4, i, dtype=np.float32) for i in positions]
+
+    keys = [embedding_key("m", "q:", text) for text in ["a", "b", "c"]]
+    cache = EmbeddingCache(str(tmp_path), max_entries=2)
+    first = cache.embed(keys, encode)
+    again = cache.embed(keys, encode)
+    assert calls == [[0, 1, 2]]
+    for a, b in zip(first, again):
+        np.testing.assert_array_equal(a, b)
+    stats = cache.stats()
+    assert stats["misses"] == 3 and stats["memory_hits"] + stats["disk_hits"] == 3 and stats["disk_hits"] >= 1
+
+    # A fresh process reads the vectors back from disk without encoding.
+    restarted = EmbeddingCache(str(tmp_path))
+    np.testing.assert_array_equal(restarted.embed(keys[2:], encode)[0], np.full(4, 2, dtype=np.float32))
+    assert calls == [[0, 1, 2]] and restarted.stats()["disk_hits"] == 1
+
+
+def test_disk_vector_store_remaps_only_past_the_mapping_and_compacts(tmp_path, monkeypatch):
+    import os
+    import embedding_cache
+    from embedding_cache import DiskVectorStore
+
+    mapped, memmap = [], np.memmap
+    monkeypatch.setattr(embedding_cache.np, "memmap", lambda *args, **kwargs: mapped.append(kwargs["shape"]) or memmap(*args, **kwargs))
+
+    store = DiskVectorStore(str(tmp_path), max_rows=4)
+    reader = DiskVectorStore(str(tmp_path))
+    for i in range(3):
+        store.put(f"k{i}", np.full(2, i))
+    store.put("k0", np.full(2, 9))
+    assert mapped == [] and len(store) == 3
+
+    # One remap covers every row appended since; later reads reuse it.
+    np.testing.assert_array_equal(store.get("k2"), [2, 2])
+    np.testing.assert_array_equal(store.get("k0"), [0, 0])
+    reader.refresh()
+    reader.refresh()
+    np.testing.assert_array_equal(reader.get("k1"), [1, 1])
+    assert mapped == [(3, 2), (3, 2)]
+
+    # Reaching max_rows keeps the newest half, then appends.
+    store.put("k3", np.full(2, 3))
+    store.put("k4", np.full(2, 4))
+    assert store.index == {"k2": 0, "k3": 1, "k4": 2}
+    assert os.path.getsize(store.vectors_path) == 3 * 2 * 4
+    np.testing.assert_array_equal(store.get("k4"), [4, 4])
+
+    # Other processes notice the rewritten keys file and drop the renumbered rows.
+    reader.refresh()
+    assert reader.get("k1") is None
+    np.testing.assert_array_equal(reader.get("k3"), [3, 3])
+
+
+@pytest.fixture
+def llm_cache_module(monkeypatch):
+    """``llm_cache``, importable without langchain: stub its two langchain_core imports when absent."""
+    import importlib
+    import json
+    import sys
+    import types
+
+    if importlib.util.find_spec("langchain_core") is None:
+        caches, load = types.ModuleType("langchain_core.caches"), types.ModuleType("langchain_core.load")
+        caches.BaseCache = object
+        load.dumps, load.loads = json.dumps, json.loads
+        monkeypatch.setitem(sys.modules, "langchain_core", types.ModuleType("langchain_core"))
+        monkeypatch.setitem(sys.modules, "langchain_core.caches", caches)
+        monkeypatch.setitem(sys.modules, "langchain_core.load", load)
+    sys.modules.pop("llm_cache", None)
+    yield importlib.import_module("llm_cache")
+    sys.modules.pop("llm_cache", None)
+
+
+def test_llm_cache_lru_ttl_bypass_and_counters(llm_cache_module, monkeypatch):
+    import json
+    from datetime import datetime, timedelta
+    from mdb_utils import DB_NAME
+
+    class DictCollection:
+        def __init__(self):
+            self.docs = {}
+
+        def create_index(self, *args, **kwargs):
+            pass
+
+        def find_one(self, query, projection):
+            return self.docs.get(query["_id"])
+
+        def replace_one(self, query, doc, upsert):
+            self.docs[query["_id"]] = doc
+
+    collection = DictCollection()
+    monkeypatch.setattr(llm_cache_module, "get_mongo_client", lambda: {DB_NAME: {"llm_cache": collection}})
+
+    def chat(text):
+        return json.dumps([{"type": "constructor", "kwargs": {"content": text, "type": "human"}}])
+
+    # Whitespace inside the message text is normalized, even though the prompt is serialized JSON.
+    assert llm_cache_module.cache_key(chat("Explain\n\nthe  score "), "m") == llm_cache_module.cache_key(chat("Explain the score"), "m")
+    assert llm_cache_module.cache_key(chat("Explain the score"), "m") != llm_cache_module.cache_key(chat("Explain the score"), "n")
+
+    cache = llm_cache_module.LLMResponseCache(max_entries=2, ttl_seconds=60)
+    for prompt in ("a", "b", "c"):
+        cache.update(chat(prompt), "m", [f"answer {prompt}"])
+    assert cache.stats()["memory_entries"] == 2 and cache.stats()["writes"] == 3
+
+    # "a" was evicted from the LRU but is still served by the shared collection.
+    assert cache.lookup(chat("a"), "m") == ["answer a"]
+    assert cache.lookup(chat("a"), "m") == ["answer a"]
+    assert cache.lookup(chat("missing"), "m") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["mongo_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3) and cache.thread_hits() == 2
+
+    # A row past its TTL is a miss even before the TTL monitor removes it.
+    key = llm_cache_module.cache_key(chat("b"), "m")
+    collection.docs[key]["created_at"] = datetime.utcnow() - timedelta(seconds=120)
+    cache._memory.clear()
+    assert cache.lookup(chat("b"), "m") is None
+    assert cache.stats()["misses"] == 2
+
+    bypass = llm_cache_module.LLMResponseCache(bypass=True)
+    bypass.update(chat("d"), "m", ["answer d"])
+    assert bypass.lookup(chat("a"), "m") is None
+    stats = bypass.stats()
+    assert stats["writes"] == stats["misses"] == stats["memory_entries"] == 0 and stats["bypass"]
+
+
+def test_product_index_matches_brute_force_cosine():
+    import json
+    from product_index import ProductVectorIndex
+
+    with open("data/cc_products.json") as f:
+        records = [{**record, "_id": i} for i, record in enumerate(json.load(f))]
+    index = ProductVectorIndex()
+    index.add(records[:-5])
+    index.add(records[-5:])
+    vectors = np.asarray([record["embedding"] for record in records], dtype=np.float64)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    query = vectors[3] + 0.5 * vectors[7]
+    hits = index.search(query, k=10)
+    expected = np.argsort(-(vectors @ (query / np.linalg.norm(query))))[:10]
+    assert [hit["title"] for hit in hits] == [records[i]["title"] for i in expected]
+    assert hits[0]["score"] >= hits[-1]["score"]
+    assert index.search(vectors[3], k=1)[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+    index.remove([records[3]["_id"]])
+    assert len(index) == len(records) - 1
+    assert records[3]["title"] not in [hit["title"] for hit in index.search(vectors[3], k=len(records))]
+
+
+def test_product_index_refresh_picks_up_in_place_edits():
+    import json
+    from product_index import ProductVectorIndex
+
+    class ListCollection:
+        def __init__(self, docs):
+            self.docs = docs
+
+        def find(self, query, projection):
+            return [{key: doc[key] for key in projection if key in doc} for doc in self.docs]
+
+    with open("data/cc_products.json") as f:
+        docs = [{**record, "_id": i} for i, record in enumerate(json.load(f)[:6])]
+    collection = ListCollection(docs)
+    index = ProductVectorIndex(collection)
+    assert index.refresh() == (6, 0, 0)
+    assert index.refresh() == (0, 0, 0)
+
+    # Edit one product's text and swap another's embedding for a third product's.
+    docs[1] = {**docs[1], "text": "Rewritten description."}
+    docs[2] = {**docs[2], "embedding": docs[4]["embedding"]}
+    del docs[5]
+    assert index.refresh() == (0, 2, 1)
+    assert len(index) == 5
+    hits = index.search(docs[4]["embedding"], k=2)
+    assert {hit["title"] for hit in hits} == {docs[2]["title"], docs[4]["title"]}
+    assert index.search(docs[1]["embedding"], k=1)[0]["description"] == "Rewritten description."
+
+
+def test_search_card_products_batches_embeddings_and_merges_by_title(monkeypatch):
+    # llm_utils pulls in the whole langchain stack, not just langchain_fireworks.
+    pytest.importorskip("llm_utils")
+    import threading
+    import credit_product_recommender
+    import llm_utils
+
+    class StubEmbedder:
+        def __init__(self):
+            self.batches = []
+
+        def embed_queries(self, queries):
+            self.batches.append(list(queries))
+            return [[float(i)] for i in range(len(queries))]
+
+    embedder = StubEmbedder()
+    monkeypatch.setattr(llm_utils, "get_embeddings", lambda: embedder)
+
+    # Every search waits for the other two, so this only passes if they run concurrently.
+    barrier = threading.Barrier(3, timeout=5)
+    hits = {
+        0: [{"title": "Travel", "description": "Lounges.", "score": 0.7}, {"title": "Cashback", "description": "5%.", "score": 0.6}],
+        1: [{"title": "Cashback", "description": "5%.", "score": 0.9}],
+        2: [{"title": "Fuel", "description": "Fuel points.", "score": 0.5}, {"title": "Travel", "description": "Lounges.", "score": 0.4}],
+    }
+    def vector_search(vector, k):
+        barrier.wait()
+        return [dict(hit) for hit in hits[int(vector[0])]]
+    monkeypatch.setattr(credit_product_recommender, "vector_search", vector_search)
+
+    results = credit_product_recommender.search_card_products(["travel", "cashback", "fuel"], k=5, max_workers=3)
+    assert embedder.batches == [["travel", "cashback", "fuel"]]
+    assert [(card["title"], card["score"]) for card in results] == [("Travel", 0.7), ("Cashback", 0.9), ("Fuel", 0.5)]
+    assert credit_product_recommender.search_card_products([]) == []
+    assert len(embedder.batches) == 1
+
+
+def test_candidate_pool_rerank_and_income_bands():
+    from candidate_pools import income_band, pool_id, pool_query, rank_within_pool, TIER_QUERIES
+
+    assert [income_band(v) for v in (None, 12000.0, 30000.0, 79999.0, 250000.0)] == [None, "low", "middle", "middle", "high"]
+    assert pool_id("Good") == "Good" and pool_id("Good", "low") == "Good|low"
+    assert pool_query("Poor", "high").startswith(TIER_QUERIES["Poor"])
+
+    rng = np.random.default_rng(6)
+    vectors = rng.normal(size=(6, 8))
+    candidates = [{"title": f"card {i}", "description": "", "embedding": vector.tolist()} for i, vector in enumerate(vectors)]
+    ranked = rank_within_pool(candidates, [vectors[4] * 3, vectors[1]], k=3)
+    assert {hit["title"] for hit in ranked[:2]} == {"card 4", "card 1"}
+    assert ranked[0]["score"] == pytest.approx(1.0)
+    assert len(ranked) == 3 and ranked[1]["score"] >= ranked[2]["score"]
+
+
+def test_card_context_ranks_dedupes_and_respects_budget():
+    from context_builder import build_card_context, count_tokens, truncate_tokens
+
+    text = "First sentence here. Second sentence is a bit longer than the first one. Third."
+    assert truncate_tokens(text, count_tokens(text)) == text
+    assert truncate_tokens(text, 8) == "First sentence here."
+
+    long = " ".join(f"Benefit number {i} of this card." for i in range(60))
+    cards = [
+        {"title": "Low", "description": "Basic cashback card with a low annual fee.", "score": 0.61},
+        {"title": "Top", "description": long, "score": 0.93},
+        {"title": "Top Copy", "description": long + " ", "score": 0.90},
+        {"title": "Mid", "description": "Travel rewards and lounge access.", "score": 0.75},
+    ]
+    context, stats = build_card_context(cards, budget_tokens=1000, max_description_tokens=40)
+    assert [line.split(":")[0] for line in context.splitlines()] == ["- Top", "- Mid", "- Low"]
+    assert stats["duplicates"] == 1 and stats["kept"] == 3
+    assert count_tokens(context.splitlines()[0]) <= 45
+
+    context, stats = build_card_context(cards, budget_tokens=50, max_description_tokens=40)
+    assert stats["tokens"] <= 50 and stats["over_budget"] >= 1
+
+
+def test_prompt_token_counts_are_exact_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from context_builder import count_tokens, log_prompt_tokens, prompt_token_stats
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: log_prompt_tokens("test_threads", "four token prompt"), range(2000)))
+    counts = prompt_token_stats()["test_threads"]
+    assert counts == {"prompts": 2000, "tokens": 2000 * count_tokens("four token prompt")}
+
+
+def test_card_ranker_parses_fees_and_fits_tier():
+    from card_ranker import agreement, format_annual_fee, parse_annual_fee, rank_cards
+
+    assert parse_annual_fee("Enjoy lounges. The annual membership fee is $125.") == 125.0
+    assert parse_annual_fee("The annual fee is waived for spends of $330, otherwise it is $33.") == 33.0
+    assert parse_annual_fee("The annual fees can be waived off by spending $200 within 90 days or $1000 in a year.") is None
+    assert parse_annual_fee("A lifetime free card with no annual fees.") == 0.0
+    assert parse_annual_fee("Earn 3 points for every $20 spent.") is None
+    # "No joining fee" says nothing about the annual fee, and a stated amount beats a no-fee phrase.
+    assert parse_annual_fee("No joining fee. Annual fee of Rs. 2,500, waived on spends above Rs. 1,00,000.") == 2500.0
+    assert parse_annual_fee("Lifetime free add-on cards. The annual fee is $500.") == 500.0
+    assert [format_annual_fee(v) for v in (None, 0.0, 45.0)] == ["As per card terms", "Lifetime free", "$45"]
+
+    cards = [
+        {"title": "Elite", "description": "Premium card with lounge access, golf and concierge. The annual fee is $500.", "score": 0.80},
+        {"title": "Basic", "description": "Lifetime free cashback card for fuel and grocery spends.", "score": 0.78},
+        {"title": "Mid", "description": "Rewards on dining and cashback on utility bills. The annual membership fee is $40.", "score": 0.79},
+    ]
+    assert rank_cards(cards, 250000.0, "Good", k=1)[0]["title"] == "Elite"
+    poor = rank_cards(cards, 20000.0, "Poor", k=3)
+    assert [card["title"] for card in poor][0] == "Basic" and poor[-1]["title"] == "Elite"
+    assert poor[-1]["features"]["fee_burden"] == 1.0
+    assert rank_cards(cards + [dict(cards[1], score=0.1)], 20000.0, "Poor", k=5)[0]["features"]["similarity"] == 0.78
+    assert agreement(["Basic", "Mid"], ["Mid", "Elite"]) == {"overlap": 0.5, "top1_hit": True}
+
+
+def test_output_repair_steps_and_outcome_counts():
+    from typing import List
+    from pydantic import BaseModel
+    from output_repair import OutputRepairError, parse_stats, parse_structured
+
+    class Card(BaseModel):
+        title: str
+        annual_fee: str
+
+    class Cards(BaseModel):
+        cards: List[Card]
+
+    expected = Cards(cards=[Card(title="A", annual_fee="45")])
+    assert parse_structured('{"cards": [{"title": "A", "annual_fee": "45"}]}', Cards, "test") == expected
+    assert parse_structured('Here:\n```json\n{"cards": [{"title": "A", "annual_fee": "45"}]}\n```', Cards, "test") == expected
+    assert parse_structured('Sure! {"cards": [{"title": "A", "annual_fee": "45"},],} Done.', Cards, "test") == expected
+    assert parse_structured('[{"Title": "A", "annual fee": 45}]', Cards, "test") == expected
+
+    calls = []
+    def fix_up(text, error):
+        calls.append(error)
+        return '{"cards": [{"title": "A", "annual_fee": "45"}]}'
+    assert parse_structured("no json here", Cards, "test", fix_up=fix_up) == expected
+    assert len(calls) == 1
+    with pytest.raises(OutputRepairError):
+        parse_structured("still no json", Cards, "test", fix_up=lambda text, error: "nope")
+
+    stats = parse_stats()["test"]
+    assert {k: stats[k] for k in ("direct", "fenced", "extracted", "coerced", "fixed", "failed")} == {
+        "direct": 1, "fenced": 1, "extracted": 1, "coerced": 1, "fixed": 1, "failed": 1,
+    }
+    assert stats["reruns_prevented"] == 4
+
+
+def test_model_router_falls_back_and_routes_around_slow_tier():
+    from model_router import ModelRouter, Route, parse_routes
+
+    class FakeModel:
+        def __init__(self, tier, fail):
+            self.tier, self.fail = tier, fail
+
+        def invoke(self, prompt):
+            if self.fail:
+                raise TimeoutError("budget exceeded")
+            return f"{self.tier}: {prompt}"
+
+        def stream(self, prompt):
+            if self.fail:
+                raise TimeoutError("budget exceeded")
+            yield from self.invoke(prompt).split(" ")
+
+    failing = {"large"}
+    calls = []
+    def get_model(tier, timeout, max_tokens):
+        calls.append((tier, timeout))
+        return FakeModel(tier, tier in failing)
+
+    # The budget only steers routing; every call gets the route's own request timeout.
+    router = ModelRouter(get_model, routes={"rerank": Route("large", 2.0, "small", 90.0)}, probe_every=3)
+    assert router.invoke("rerank", "pick") == "small: pick"
+    assert calls == [("large", 90.0), ("small", 90.0)]
+    assert "".join(router.stream("rerank", "go")) == "small:go"
+
+    # Pretend the large tier has been slow: it is skipped except for every third call, and
+    # the stage has had two calls above, so this loop's first call is the probe.
+    router._tiers["rerank", "large"].latencies.extend([5.0] * 5)
+    failing.clear()
+    calls.clear()
+    results = [router.invoke("rerank", str(i)) for i in range(3)]
+    assert [tier for tier, _ in calls] == ["large", "small", "small"]
+    assert results == ["large: 0", "small: 1", "small: 2"]
+
+    stats = router.stats()["rerank"]
+    assert stats["fallbacks"] == 2 and stats["routed_around"] == 2
+    assert stats["tiers"]["large"]["errors"] == 2 and stats["tiers"]["small"]["calls"] == 4
+
+    # Cache hits are counted but keep their latency out of the budget check.
+    hits = [0]
+    def cached_get_model(tier, timeout, max_tokens):
+        hits[0] += 1
+        return FakeModel(tier, False)
+    cached = ModelRouter(cached_get_model, routes={"rerank": Route("large", 2.0, "small")}, cache_hits=lambda: hits[0])
+    for i in range(6):
+        cached.invoke("rerank", "pick")
+    large = cached.stats()["rerank"]["tiers"]["large"]
+    assert large["calls"] == 6 and large["cache_hits"] == 6 and large["p50_seconds"] is None
+    assert not cached._over_budget("rerank", cached.route("rerank"))
+
+    routes = parse_routes('{"rerank": {"budget_seconds": 5}, "new_stage": {"tier": "small"}}')
+    assert routes["rerank"] == Route("large", 5, "small") and routes["new_stage"].tier == "small"
+    assert parse_routes('{"explanation": {"timeout_seconds": 240}}')["explanation"] == Route("large", 60.0, "small", 240)
+
+
+def test_single_flight_shares_one_run_between_concurrent_callers():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from single_flight import SingleFlight
+
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def work():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return {"response": "Recommendations valid"}
+
+    with ThreadPoolExecutor(5) as pool:
+        leader = pool.submit(flight.do, 8625, work)
+        started.wait(5)
+        followers = [pool.submit(flight.do, 8625, work) for _ in range(3)]
+        other_user = pool.submit(flight.do, 42, lambda: "other")
+        assert other_user.result(5) == "other"
+        while flight.stats()["followers"] < 3:
+            time.sleep(0.01)
+        release.set()
+        results = [leader.result(5)] + [f.result(5) for f in followers]
+    assert len(runs) == 1 and all(result is results[0] for result in results)
+    assert flight.stats() == {"leaders": 2, "followers": 3, "remote_waits": 0, "remote_results": 0, "in_flight": 0}
+
+    def fail():
+        raise RuntimeError("graph failed")
+    with pytest.raises(RuntimeError):
+        flight.do(8625, fail)
+    assert flight.do(8625, lambda: "rerun") == "rerun"
+
+
+def test_single_flight_never_runs_without_the_lease_and_renews_it():
+    import time
+    import mongomock
+    from single_flight import LeaseBusyError, MongoLease, SingleFlight
+
+    class HeldLease:
+        """Another worker holds every key, and never stores a result."""
+        lease_seconds = 0.03
+
+        def __init__(self, free=False):
+            self.free, self.waits, self.renewals, self.released = free, 0, 0, []
+
+        def acquire(self, key):
+            return "token" if self.free else None
+
+        def wait(self, key, timeout=None):
+            self.waits += 1
+            return True
+
+        def renew(self, key, token):
+            self.renewals += 1
+            return True
+
+        def release(self, key, token):
+            self.released.append(key)
+
+    runs = []
+    busy = HeldLease()
+    with pytest.raises(LeaseBusyError):
+        SingleFlight(busy, max_remote_waits=2).do(8625, lambda: runs.append(1), load=lambda: None)
+    assert runs == [] and busy.waits == 2
+
+    free = HeldLease(free=True)
+    assert SingleFlight(free).do(8625, lambda: time.sleep(0.2) or "done") == "done"
+    assert free.renewals >= 2 and free.released == [8625]
+
+    lease = MongoLease(mongomock.MongoClient()["bfsi-genai"]["graph_leases"], lease_seconds=60)
+    token = lease.acquire(8625)
+    assert lease.acquire(8625) is None
+    assert lease.renew(8625, token) and not lease.renew(8625, "someone else")
+    lease.release(8625, token)
+    assert lease.acquire(8625) is not None
+
+
+def test_graph_fans_out_joins_and_merges_step_timings(monkeypatch):
+    pytest.importorskip("langgraph")
+    pytest.importorskip("langchain_fireworks")
+    from langgraph.checkpoint.memory import MemorySaver
+    import graph
+    from utils import merge_timings
+
+    assert merge_timings(None, {"score": 1.0}) == {"score": 1.0}
+    assert merge_timings({"score": 1.0}, {"rerank": 2.0}) == {"score": 1.0, "rerank": 2.0}
+
+    # Failed query generation yields no queries, and rerank then leaves validate to mark the run invalid.
+    written = []
+    monkeypatch.setattr(graph, "insert_response", written.append)
+    monkeypatch.setattr(graph, "get_credit_card_recommendations", lambda **kwargs: None)
+    state = {"user_id": 1, "user_profile_ip": {}, "pred": "Good", "allowed_credit_limit": 1000}
+    assert graph.card_queries_step(state) == {"card_suggestions": []}
+    assert graph.rerank_step({**state, "card_suggestions": []}) == {}
+
+    seen = {}
+    def rerank(state):
+        seen["joined"] = (state["user_profile"], state["card_suggestions"])
+        return {"final_recommendations": {"cards": []}}
+    def validate(state):
+        seen["timings"] = set(state["step_timings"])
+        return {"response": "Recommendations valid"}
+
+    monkeypatch.setattr(graph, "GRAPH_PARALLEL_BRANCHES", True)
+    monkeypatch.setattr(graph, "check_if_user_exists", lambda state: "credit_profile")
+    monkeypatch.setattr(graph, "score_step", lambda state: {"pred": "Good", "allowed_credit_limit": 1000, "user_profile_ip": {}})
+    monkeypatch.setattr(graph, "explanation_step", lambda state: {"user_profile": "explained"})
+    monkeypatch.setattr(graph, "card_queries_step", lambda state: {"card_suggestions": ["travel"]})
+    monkeypatch.setattr(graph, "rerank_step", rerank)
+    monkeypatch.setattr(graph, "validate_step", validate)
+    monkeypatch.setattr(graph, "MongoDBSaver", lambda client: MemorySaver())
+    monkeypatch.setattr(graph, "get_mongo_client", lambda: None)
+    graph.get_app.cache_clear()
+    try:
+        final = graph.get_app().invoke({"user_id": 1}, config=graph.graph_config(1))
+    finally:
+        graph.get_app.cache_clear()
+
+    # Rerank runs once, after both branches, and sees both of their outputs.
+    assert seen["joined"] == ("explained", ["travel"])
+    assert seen["timings"] == {"score", "explanation", "card_queries", "rerank"}
+    assert set(final["step_timings"]) == {"score", "explanation", "card_queries", "rerank", "validate"}
+    assert final["response"] == "Recommendations valid"
+
+
+def test_check_if_user_exists_routes_missing_and_rescored_users_to_the_profile_step(monkeypatch):
+    pytest.importorskip("langgraph")
+    pytest.importorskip("langchain_fireworks")
+    import mongomock
+    import graph
+
+    client = mongomock.MongoClient()
+    responses = client[graph.DB_NAME][graph.COLLECTION_NAME]
+    monkeypatch.setattr(graph, "get_mongo_client", lambda: client)
+    monkeypatch.setattr(graph, "model_version", lambda: "v1")
+    monkeypatch.setattr(graph, "feature_fingerprint", lambda record: f"hash-{record['Age']}")
+    inputs = {1: {"Age": 30}, 2: {"Age": 40}}
+    monkeypatch.setattr(graph, "get_model_input", lambda user_id: inputs.get(user_id))
+
+    responses.insert_one({"user_id": 1, "user_profile": "Good history.", "pred": "Good", "features_hash": "hash-30", "model_version": "v1"})
+    # The rescoring job writes under ``rescore`` only; that is not an explanation to reuse.
+    responses.insert_one({"user_id": 2, "rescore": {"pred": "Poor", "features_hash": "hash-40", "model_version": "v1"}})
+    responses.insert_one({"user_id": 3, "user_profile": "Profile row is gone.", "pred": "Good", "features_hash": "hash-50", "model_version": "v1"})
+
+    assert graph.check_if_user_exists({"user_id": 1}) == "recommendations"
+    assert graph.check_if_user_exists({"user_id": 2}) == "credit_profile"
+    assert graph.check_if_user_exists({"user_id": 3}) == "credit_profile"
+
+
+def test_job_worker_pool_runs_claimed_jobs_and_records_failures():
+    import time
+    from job_queue import JobWorkerPool
+
+    class ListQueue:
+        def __init__(self, user_ids):
+            self.pending = list(user_ids)
+            self.finished = {}
+            self.sweeps = 0
+
+        def claim(self, worker):
+            return {"_id": self.pending.pop(0)} if self.pending else None
+
+        def finish(self, user_id, worker, error=None):
+            self.finished[user_id] = error
+
+        def fail_abandoned(self):
+            self.sweeps += 1
+            return 0
+
+    def run(user_id):
+        if user_id == 3:
+            raise RuntimeError("graph failed")
+
+    queue = ListQueue([1, 2, 3])
+    pool = JobWorkerPool(queue, run, workers=2, poll_seconds=0.01, sweep_seconds=60)
+    pool.ensure_started()
+    pool.ensure_started()
+    deadline = time.monotonic() + 5
+    while len(queue.finished) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.stop()
+    assert queue.finished == {1: None, 2: None, 3: "graph failed"}
+    assert pool.stats() == {"claimed": 3, "done": 2, "failed": 1, "workers": 2}
+    # Abandoned jobs are swept once per interval, not once per thread or claim.
+    assert queue.sweeps == 1
+
+
+def test_job_queue_enqueue_reports_whether_it_queued_a_run():
+    import mongomock
+    from job_queue import JobQueue
+
+    queue = JobQueue(mongomock.MongoClient()["bfsi-genai"]["graph_jobs"])
+    job, queued = queue.enqueue(8625)
+    assert queued and job["status"] == "queued"
+    assert queue.enqueue(8625) == (job, False)
+
+    claimed = queue.claim("worker-1")
+    assert claimed["_id"] == 8625 and queue.enqueue(8625)[1] is False
+    queue.finish(8625, "worker-1")
+    job, queued = queue.enqueue(8625)
+    assert queued and job["status"] == "queued"
+
+def test_job_is_active_only_under_a_live_lease():
+    from datetime import datetime, timedelta
+    from job_queue import is_active
+
+    now = datetime(2026, 1, 1)
+    assert is_active({"status": "queued"}, now)
+    assert is_active({"status": "running", "lease_expires_at": now + timedelta(seconds=1)}, now)
+    assert not is_active({"status": "running", "lease_expires_at": now - timedelta(seconds=1)}, now)
+    assert not is_active({"status": "done"}, now)
+    assert not is_active(None, now)
+
+
+def test_credit_response_freshness_policy():
+    from datetime import datetime, timedelta
+    from response_freshness import ReadStats, classify
+
+    now = datetime(2026, 1, 1, 12, 0)
+    doc = {
+        "user_profile": "explanation", "pred": "Good", "allowed_credit_limit": 5000.0,
+        "user_profile_ip": {}, "model_version": "v1", "timestamp": now - timedelta(minutes=10),
+    }
+    assert classify(doc, "v1", ttl_seconds=3600, now=now) == ("hit", 600.0)
+    assert classify(doc, "v1", ttl_seconds=300, now=now) == ("stale", 600.0)
+    assert classify(doc, "v2", ttl_seconds=3600, now=now) == ("stale", 600.0)
+    assert classify({**doc, "timestamp": None}, "v1", now=now) == ("stale", None)
+    assert classify({"pred": "Good", "model_version": "v1"}, "v1", now=now) == ("miss", None)
+    assert classify(None, "v1", now=now) == ("miss", None)
+
+    reads = ReadStats()
+    for outcome in ("hit", "hit", "stale", "miss"):
+        reads.record(outcome)
+    stats = reads.stats()
+    assert (stats["hit"], stats["stale"], stats["miss"]) == (2, 1, 1)
+    assert stats["hit_ratio"] == 0.5 and stats["miss_ratio"] == 0.25
+
+def test_credit_score_stream_emits_score_tokens_then_done(monkeypatch):
+    pytest.importorskip("langgraph")
+    pytest.importorskip("langchain_fireworks")
+    import json
+    import app as app_module
+
+    def get_user_profile(user_id):
+        if user_id == 404:
+            raise KeyError(user_id)
+        return "Good", 5000.0, {"Age": 30}
+
+    saved = []
+    failing = []
+    def stream_credit_score_expl(profile_ip, pred, allowed_limit, feature_importance):
+        yield "Strong "
+        if failing:
+            raise TimeoutError("model timed out")
+        yield "history."
+
+    monkeypatch.setattr(app_module, "get_user_profile", get_user_profile)
+    monkeypatch.setattr(app_module, "traditional_credit_score", lambda profile_ip: ({"Age": 10.0}, 720))
+    monkeypatch.setattr(app_module, "get_feature_contributions", lambda profile_ip, pred: {})
+    monkeypatch.setattr(app_module, "format_feature_contributions", lambda contributions, profile_ip, pred: "")
+    monkeypatch.setattr(app_module, "stream_credit_score_expl", stream_credit_score_expl)
+    monkeypatch.setattr(app_module, "credit_profile_doc", lambda user_id, profile, *args: {"user_id": user_id, "user_profile": profile})
+    monkeypatch.setattr(app_module, "insert_response", saved.append)
+    client = app_module.app.test_client()
+
+    def events(user_id):
+        response = client.get(f"/credit_score/{user_id}/stream")
+        assert response.mimetype == "text/event-stream"
+        parsed = []
+        for block in response.get_data(as_text=True).strip().split("\n\n"):
+            event, data = block.split("\n")
+            parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return parsed
+
+    received = events(3392)
+    assert [event for event, _ in received] == ["score", "token", "token", "done"]
+    assert received[0][1]["scoreCardCreditScore"] == 720 and received[0][1]["userCreditProfile"] == "Good"
+    assert received[-1][1] == {"userProfile": "Strong history."}
+    assert saved == [{"user_id": 3392, "user_profile": "Strong history."}]
+
+    # A failure mid-stream ends with an error event, and nothing is saved.
+    failing.append(True)
+    assert [event for event, _ in events(3392)] == ["score", "token", "error"]
+    assert len(saved) == 1
+
+    assert client.get("/credit_score/404/stream").status_code == 404
+
+
 if __name__ == "__main__":
     import sys
     import pytest
@@ -0,0 +1,223 @@
+import json
+import os
+
+import numpy as np
+
+
+class TreeEnsemble:
+    """
+    Array-backed inference engine for a fitted XGBoost ``multi:softprob`` classifier.
+
+    Every tree is padded to a complete binary tree of the ensemble's depth and flattened into
+    contiguous ``(n_trees, n_nodes)`` arrays (feature, threshold, default direction) plus a
+    ``(n_trees, n_leaves)`` leaf-value array. A shallow leaf is copied into every padded leaf
+    below it, so the children of node ``i`` are always ``2i+1``/``2i+2`` and all rows walk all
+    trees together in ``depth`` vectorized steps. Class probabilities come out of that single
+    traversal and labels are derived from them with ``argmax``.
+
+    ``node_value`` holds the hessian-weighted mean leaf value below every padded node, which is
+    what ``contributions`` uses to attribute each split along a row's path to its feature.
+    """
+
+    # Bumped whenever the persisted array layout changes.
+    FORMAT = 2
+
+    def __init__(self, feature, threshold, default_left, leaf_value, node_value, tree_class, base_margin):
+        self.n_trees, self.n_nodes = feature.shape
+        self.depth = int(np.log2(self.n_nodes + 1)) - 1
+        self.n_leaves = leaf_value.shape[1]
+        self.feature = feature.ravel()
+        self.threshold = threshold.ravel()
+        self.default_left = default_left.ravel()
+        self.leaf_value = leaf_value.ravel()
+        self.node_value = node_value.ravel()
+        self.tree_class = tree_class
+        self.base_margin = base_margin
+        self.n_classes = len(base_margin)
+        self.class_matrix = np.eye(self.n_classes, dtype=np.float64)[tree_class]
+        self._node_base = np.arange(self.n_trees, dtype=np.int32) * self.n_nodes
+        self._leaf_base = np.arange(self.n_trees, dtype=np.int32) * self.n_leaves - (self.n_leaves - 1)
+
+    @classmethod
+    def from_xgb(cls, model):
+        """
+        Export the trees of a fitted ``XGBClassifier`` into flat node arrays.
+
+        Args:
+            model (xgboost.XGBClassifier): Fitted classifier with a ``multi:softprob`` objective.
+
+        Returns:
+            TreeEnsemble: The flattened engine.
+        """
+        learner = json.loads(model.get_booster().save_raw("json"))["learner"]
+        objective = learner["objective"]["name"]
+        if objective != "multi:softprob":
+            raise ValueError(f"Unsupported objective for TreeEnsemble: {objective}")
+        trees = learner["gradient_booster"]["model"]["trees"]
+        if any(any(tree["split_type"]) for tree in trees):
+            raise ValueError("Categorical splits are not supported by TreeEnsemble")
+        n_classes = int(learner["learner_model_param"]["num_class"])
+        base_score = [float(v) for v in learner["learner_model_param"]["base_score"].strip("[]").split(",")]
+
+        depth = max(cls._depth(tree) for tree in trees)
+        n_nodes, n_leaves = 2 ** (depth + 1) - 1, 2 ** depth
+        feature = np.zeros((len(trees), n_nodes), dtype=np.int32)
+        threshold = np.full((len(trees), n_nodes), np.inf, dtype=np.float32)
+        default_left = np.ones((len(trees), n_nodes), dtype=bool)
+        leaf_value = np.zeros((len(trees), n_leaves), dtype=np.float32)
+        node_value = np.zeros((len(trees), n_nodes), dtype=np.float32)
+        for t, tree in enumerate(trees):
+            mean = cls._mean_values(tree)
+            for node, slot, level in cls._walk(tree, depth):
+                node_value[t, slot] = mean[node]
+                if level == depth:
+                    leaf_value[t, slot - (n_leaves - 1)] = tree["split_conditions"][node]
+                elif tree["left_children"][node] != -1:
+                    feature[t, slot] = tree["split_indices"][node]
+                    threshold[t, slot] = tree["split_conditions"][node]
+                    default_left[t, slot] = tree["default_left"][node]
+
+        return cls(
+            feature=feature,
+            threshold=threshold,
+            default_left=default_left,
+            leaf_value=leaf_value,
+            node_value=node_value,
+            tree_class=np.asarray(learner["gradient_booster"]["model"]["tree_info"], dtype=np.int32),
+            base_margin=np.resize(np.asarray(base_score, dtype=np.float64), n_classes),
+        )
+
+    ARRAYS = ("feature", "threshold", "default_left", "leaf_value", "node_value", "tree_class", "base_margin")
+
+    def save(self, directory):
+        """Persist the node arrays as ``.npy`` files so they can be memory-mapped by ``load``."""
+        os.makedirs(directory, exist_ok=True)
+        shapes = {"feature": (self.n_trees, self.n_nodes), "threshold": (self.n_trees, self.n_nodes),
+                  "default_left": (self.n_trees, self.n_nodes), "leaf_value": (self.n_trees, self.n_leaves),
+                  "node_value": (self.n_trees, self.n_nodes)}
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            np.save(os.path.join(directory, f"{name}.npy"), array.reshape(shapes.get(name, array.shape)))
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        """
+        Load arrays written by ``save``.
+
+        Args:
+            directory (str): Directory written by ``save``.
+            mmap_mode (str): Passed to ``numpy.load``; ``"r"`` shares the pages between processes.
+        """
+        return cls(**{name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in cls.ARRAYS})
+
+    @staticmethod
+    def _depth(tree):
+        left, right = tree["left_children"], tree["right_children"]
+        depth, frontier = 0, [0]
+        while True:
+            frontier = [child for node in frontier if left[node] != -1 for child in (left[node], right[node])]
+            if not frontier:
+                return depth
+            depth += 1
+
+    @staticmethod
+    def _mean_values(tree):
+        """Hessian-weighted mean leaf value below each node, as XGBoost uses for approximate contributions."""
+        left, right = tree["left_children"], tree["right_children"]
+        hessian, value = tree["sum_hessian"], tree["split_conditions"]
+        mean = [0.0] * len(left)
+        # Children always come after their parent, so a reverse sweep visits them first.
+        for node in reversed(range(len(left))):
+            if left[node] == -1:
+                mean[node] = value[node]
+            else:
+                mean[node] = (mean[left[node]] * hessian[left[node]] + mean[right[node]] * hessian[right[node]]) / hessian[node]
+        return mean
+
+    @staticmethod
+    def _walk(tree, depth):
+        """Yield (original node, padded slot, level); a shallow leaf fills its whole padded subtree."""
+        left, right = tree["left_children"], tree["right_children"]
+        stack = [(0, 0, 0)]
+        while stack:
+            node, slot, level = stack.pop()
+            yield node, slot, level
+            if level == depth:
+                continue
+            is_leaf = left[node] == -1
+            stack.append((node if is_leaf else left[node], 2 * slot + 1, level + 1))
+            stack.append((node if is_leaf else right[node], 2 * slot + 2, level + 1))
+
+    def _descend(self, X):
+        """Yield ``(slot, child)`` per level: the padded node each row is at in every tree and where it goes next."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_offset = (np.arange(n_rows, dtype=np.int32) * n_features)[:, None]
+        has_missing = np.isnan(flat).any()
+        node = np.zeros((n_rows, self.n_trees), dtype=np.int32)
+        for _ in range(self.depth):
+            slot = node + self._node_base
+            x = flat.take(self.feature.take(slot) + row_offset)
+            if has_missing:
+                go_right = ~(x < self.threshold.take(slot)) & ~(np.isnan(x) & self.default_left.take(slot))
+            else:
+                go_right = x >= self.threshold.take(slot)
+            node = 2 * node + 1 + go_right
+            yield slot, node
+
+    def apply(self, X):
+        """
+        Padded leaf slot reached in every tree.
+
+        Args:
+            X (array-like): ``(n_rows, n_features)`` feature matrix in model column order.
+
+        Returns:
+            numpy.ndarray: ``(n_rows, n_trees)`` indices into ``leaf_value``.
+        """
+        node = np.zeros((len(X), self.n_trees), dtype=np.int32)
+        for _, node in self._descend(X):
+            pass
+        return node + self._leaf_base
+
+    def contributions(self, X):
+        """
+        Per-row path contributions of every feature to every class margin (Saabas method).
+
+        Each split on a row's path credits its feature with the change in mean leaf value from
+        the node to the child taken. Per class, the contributions plus the bias sum to the margin.
+
+        Args:
+            X (array-like): ``(n_rows, n_features)`` feature matrix in model column order.
+
+        Returns:
+            numpy.ndarray: ``(n_rows, n_classes, n_features + 1)``; the last column is the bias.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        width = n_features + 1
+        base = (np.arange(n_rows)[:, None] * self.n_classes + self.tree_class) * width
+        totals = np.zeros(n_rows * self.n_classes * width, dtype=np.float64)
+        for slot, child in self._descend(X):
+            delta = self.node_value.take(child + self._node_base) - self.node_value.take(slot)
+            totals += np.bincount((base + self.feature.take(slot)).ravel(), weights=delta.ravel(), minlength=totals.size)
+        totals = totals.reshape(n_rows, self.n_classes, width)
+        totals[:, :, -1] = self.node_value.take(self._node_base) @ self.class_matrix + self.base_margin
+        return totals
+
+    def predict_margin(self, X):
+        """Raw per-class margins, ``base_margin`` plus the summed leaf values of each class's trees."""
+        return self.leaf_value.take(self.apply(X)).astype(np.float64) @ self.class_matrix + self.base_margin
+
+    def predict_proba(self, X):
+        """Softmax class probabilities, matching ``XGBClassifier.predict_proba``."""
+        margin = self.predict_margin(X)
+        margin -= margin.max(axis=1, keepdims=True)
+        proba = np.exp(margin)
+        proba /= proba.sum(axis=1, keepdims=True)
+        return proba.astype(np.float32)
+
+    def predict(self, X):
+        """Encoded class labels derived from the probabilities."""
+        return self.predict_proba(X).argmax(axis=1)
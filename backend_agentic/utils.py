@@ -1,12 +1,16 @@
 from pydantic import BaseModel, Field
 import operator
-from typing import Annotated, List, Tuple
+from typing import Annotated, Dict, List, Tuple
 from typing_extensions import TypedDict
 from langchain_core.pydantic_v1 import BaseModel, Field, validator
 from credit_product_recommender import CreditCardList
 from dotenv import load_dotenv
 load_dotenv()
 
+def merge_timings(left: Dict[str, float], right: Dict[str, float]) -> Dict[str, float]:
+    """Reducer so parallel branches can each report their own step timing."""
+    return {**(left or {}), **(right or {})}
+
 class CCrecommenderState(TypedDict):
     user_id: str
     user_profile: str
@@ -22,6 +26,8 @@ class CCrecommenderState(TypedDict):
     past_steps: Annotated[List[Tuple], operator.add]
     response: str
     final_recommendations: CreditCardList
+    feature_contributions: Dict[str, float]
+    step_timings: Annotated[Dict[str, float], merge_timings]
 
 class Recommendations(BaseModel):
     """Recommendations to user credit rating and User profile."""